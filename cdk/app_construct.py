@@ -1,16 +1,58 @@
 from typing import Any, Self
 
+import aws_cdk as cdk
+from aws_cdk import Stack
 from aws_cdk import aws_apigateway as apigw
+from aws_cdk import aws_apigatewayv2 as apigwv2
+from aws_cdk import aws_events as events
+from aws_cdk import aws_events_targets as events_targets
+from aws_cdk import aws_iam as iam
+from aws_cdk import aws_lambda as lambda_
+from aws_cdk import aws_lambda_event_sources as lambda_event_sources
 from aws_cdk import aws_wafv2 as wafv2
 from constructs import Construct
 
+from cdk.direct_integration import list_pool_integration
 from cdk.infra_construct import InfraConstruct
 from cdk.lmd_construct import LambdaConstruct
-from cdk.paramater import build_name
+from cdk.paramater import build_name, paramater
+
+STAGE_NAME = "v1"
+
+
+def cache_key_parameters(method_path: str) -> list[str]:
+    api_cache = paramater["api_cache"]
+    if not api_cache["enabled"] or method_path not in api_cache["methods"]:
+        return []
+    cache_keys: list[str] = api_cache["methods"][method_path]["cache_keys"]
+    return cache_keys
+
+
+def request_parameters(method_path: str) -> dict[str, bool]:
+    # キャッシュキーに使う値はメソッドリクエストで宣言しておく. パスパラメータは必須
+    return {
+        x: x.startswith("method.request.path.")
+        for x in cache_key_parameters(method_path)
+    }
+
+
+def router_environment(routes: list[str]) -> dict[str, str]:
+    # 全関数で同じ値の変数はそのまま, 異なる値は "<関数名の大文字>__<変数名>" で渡す
+    envs = [paramater["lambda"][x]["env"] for x in routes]
+    environment: dict[str, str] = {}
+    for key in dict.fromkeys(k for env in envs for k in env):
+        values = [env.get(key) for env in envs]
+        if all(x == values[0] for x in values):
+            environment[key] = str(values[0])
+            continue
+        for name, env in zip(routes, envs, strict=True):
+            if key in env:
+                environment[f"{name.upper()}__{key}"] = env[key]
+    return environment
 
 
 class AppConstruct(Construct):
-    def __init__(
+    def __init__(  # noqa: PLR0915
         self: Self,
         scope: Construct,
         construct_id: str,
@@ -19,19 +61,37 @@ class AppConstruct(Construct):
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
+        api_cache = paramater["api_cache"]
         self.api = apigw.RestApi(
             scope=self,
             id="api",
             default_cors_preflight_options=apigw.CorsOptions(
                 allow_origins=apigw.Cors.ALL_ORIGINS,
                 allow_methods=apigw.Cors.ALL_METHODS,
+                allow_headers=[
+                    *apigw.Cors.DEFAULT_HEADERS,
+                    "X-Tenant-Id",
+                    "Idempotency-Key",
+                ],
             ),
             rest_api_name=build_name("api", "destiny_dice"),
             description="destiny_dice",
             deploy_options=apigw.StageOptions(
-                data_trace_enabled=True,
+                data_trace_enabled=paramater["front_door"]["rest_api_data_trace"],
                 logging_level=apigw.MethodLoggingLevel.ERROR,
-                stage_name="v1",
+                stage_name=STAGE_NAME,
+                cache_cluster_enabled=api_cache["enabled"],
+                cache_cluster_size=(
+                    api_cache["cluster_size"] if api_cache["enabled"] else None
+                ),
+                method_options={
+                    path: apigw.MethodDeploymentOptions(
+                        caching_enabled=True,
+                        cache_ttl=cdk.Duration.seconds(method["ttl_seconds"]),
+                    )
+                    for path, method in api_cache["methods"].items()
+                    if api_cache["enabled"]
+                },
             ),
         )
 
@@ -53,12 +113,19 @@ class AppConstruct(Construct):
         pools = self.api.root.add_resource("pools")
         pool_name = pools.add_resource("{pool_name}")
         dice = pool_name.add_resource("dice")
+        stats = pool_name.add_resource("stats")
+        simulate = pool_name.add_resource("simulate")
+        compound_dice = self.api.root.add_resource("dice")
+
+        self.router: LambdaConstruct | None = None
+        if paramater["router"]["enabled"]:
+            self.router = LambdaConstruct(self, "router", infra)
 
         self.create_pool = LambdaConstruct(self, "create_pool", infra)
         pool_name.add_method(
             http_method="POST",
             integration=apigw.LambdaIntegration(
-                handler=self.create_pool.function,
+                handler=self.route_handler(self.create_pool),
             ),
         )
         assert self.create_pool.function.role is not None
@@ -72,26 +139,66 @@ class AppConstruct(Construct):
             key="ITEM_TABLE_NAME",
             value=infra.table_item.table_name,
         )
+        # 再作成や置き換えの際に前の世代の出目の集計を消すため
+        infra.table_stats.grant_read_write_data(self.create_pool.function.role)
+        self.create_pool.function.add_environment(
+            key="STATS_TABLE_NAME",
+            value=infra.table_stats.table_name,
+        )
+        infra.table_idempotency.grant_read_write_data(self.create_pool.function.role)
+        self.create_pool.function.add_environment(
+            key="IDEMPOTENCY_TABLE_NAME",
+            value=infra.table_idempotency.table_name,
+        )
+        infra.bucket_snapshot.grant_put(self.create_pool.function.role)
+        infra.bucket_snapshot.grant_delete(self.create_pool.function.role)
+        self.create_pool.function.add_environment(
+            key="SNAPSHOT_BUCKET_NAME",
+            value=infra.bucket_snapshot.bucket_name,
+        )
+        if api_cache["enabled"]:
+            self.add_cache_invalidation(infra, self.create_pool)
 
         self.list_pool = LambdaConstruct(self, "list_pool", infra)
-        pools.add_method(
-            http_method="GET",
-            integration=apigw.LambdaIntegration(
-                handler=self.list_pool.function,
-            ),
-        )
+        if paramater["direct_integration"]["list_pool"]:
+            integration, method_responses = list_pool_integration(
+                scope=self,
+                table=infra.table_pool,
+                cache_key_parameters=cache_key_parameters("/pools/GET"),
+            )
+            pools.add_method(
+                http_method="GET",
+                integration=integration,
+                method_responses=method_responses,
+                request_parameters=request_parameters("/pools/GET"),
+            )
+        else:
+            pools.add_method(
+                http_method="GET",
+                integration=apigw.LambdaIntegration(
+                    handler=self.route_handler(self.list_pool),
+                    cache_key_parameters=cache_key_parameters("/pools/GET"),
+                ),
+                request_parameters=request_parameters("/pools/GET"),
+            )
         assert self.list_pool.function.role is not None
         infra.table_pool.grant_read_data(self.list_pool.function.role)
         self.list_pool.function.add_environment(
             key="POOL_TABLE_NAME",
             value=infra.table_pool.table_name,
         )
+        # 版数付きの一覧でスナップショットの URL を組み立てるため
+        infra.table_catalog.grant_read_data(self.list_pool.function.role)
+        self.list_pool.function.add_environment(
+            key="CATALOG_TABLE_NAME",
+            value=infra.table_catalog.table_name,
+        )
 
         self.delete_pool = LambdaConstruct(self, "delete_pool", infra)
         pool_name.add_method(
             http_method="DELETE",
             integration=apigw.LambdaIntegration(
-                handler=self.delete_pool.function,
+                handler=self.route_handler(self.delete_pool),
             ),
         )
         assert self.delete_pool.function.role is not None
@@ -105,22 +212,394 @@ class AppConstruct(Construct):
             key="ITEM_TABLE_NAME",
             value=infra.table_item.table_name,
         )
+        infra.table_stats.grant_read_write_data(self.delete_pool.function.role)
+        self.delete_pool.function.add_environment(
+            key="STATS_TABLE_NAME",
+            value=infra.table_stats.table_name,
+        )
+        infra.table_idempotency.grant_read_write_data(self.delete_pool.function.role)
+        self.delete_pool.function.add_environment(
+            key="IDEMPOTENCY_TABLE_NAME",
+            value=infra.table_idempotency.table_name,
+        )
+        infra.bucket_snapshot.grant_delete(self.delete_pool.function.role)
+        self.delete_pool.function.add_environment(
+            key="SNAPSHOT_BUCKET_NAME",
+            value=infra.bucket_snapshot.bucket_name,
+        )
+        if api_cache["enabled"]:
+            self.add_cache_invalidation(infra, self.delete_pool)
 
         self.dice = LambdaConstruct(self, "dice", infra)
         dice.add_method(
             http_method="GET",
             integration=apigw.LambdaIntegration(
-                handler=self.dice.function,
+                handler=self.route_handler(self.dice),
             ),
         )
         assert self.dice.function.role is not None
-        infra.table_pool.grant_read_data(self.dice.function.role)
+        # 最終参照時刻の記録と, 退避済みプールの書き戻しのため書き込みも許可する
+        infra.table_pool.grant_read_write_data(self.dice.function.role)
         self.dice.function.add_environment(
             key="POOL_TABLE_NAME",
             value=infra.table_pool.table_name,
         )
-        infra.table_item.grant_read_data(self.dice.function.role)
+        infra.table_item.grant_read_write_data(self.dice.function.role)
+        self.dice.function.add_environment(
+            key="ITEM_TABLE_NAME",
+            value=infra.table_item.table_name,
+        )
+        infra.table_stats.grant_write_data(self.dice.function.role)
         self.dice.function.add_environment(
+            key="STATS_TABLE_NAME",
+            value=infra.table_stats.table_name,
+        )
+        infra.bucket_snapshot.grant_read(self.dice.function.role)
+        # 書き戻しが済んだ退避先を消すため
+        infra.bucket_snapshot.grant_delete(self.dice.function.role)
+        self.dice.function.add_environment(
+            key="SNAPSHOT_BUCKET_NAME",
+            value=infra.bucket_snapshot.bucket_name,
+        )
+        # 出目の集計を自身の非同期呼び出しに回すため. 自身の関数名の参照は
+        # 循環となるため, 関数名は build_name で組み立てる
+        self.dice.function.add_environment(
+            key="STATS_FUNCTION_NAME",
+            value=build_name("function", "dice"),
+        )
+        self.dice.function.role.add_to_principal_policy(
+            iam.PolicyStatement(
+                actions=["lambda:InvokeFunction"],
+                resources=[
+                    Stack.of(self).format_arn(
+                        service="lambda",
+                        resource="function",
+                        resource_name=f"{build_name('function', 'dice')}*",
+                        arn_format=cdk.ArnFormat.COLON_RESOURCE_NAME,
+                    ),
+                ],
+            ),
+        )
+
+        self.stats = LambdaConstruct(self, "stats", infra)
+        stats.add_method(
+            http_method="GET",
+            integration=apigw.LambdaIntegration(
+                handler=self.stats.handler,
+                cache_key_parameters=cache_key_parameters(
+                    "/pools/{pool_name}/stats/GET",
+                ),
+            ),
+            request_parameters=request_parameters("/pools/{pool_name}/stats/GET"),
+        )
+        assert self.stats.function.role is not None
+        infra.table_pool.grant_read_data(self.stats.function.role)
+        self.stats.function.add_environment(
+            key="POOL_TABLE_NAME",
+            value=infra.table_pool.table_name,
+        )
+        infra.table_stats.grant_read_data(self.stats.function.role)
+        self.stats.function.add_environment(
+            key="STATS_TABLE_NAME",
+            value=infra.table_stats.table_name,
+        )
+
+        self.simulate = LambdaConstruct(self, "simulate", infra)
+        simulate.add_method(
+            http_method="POST",
+            integration=apigw.LambdaIntegration(
+                handler=self.simulate.handler,
+            ),
+        )
+        assert self.simulate.function.role is not None
+        infra.table_pool.grant_read_data(self.simulate.function.role)
+        infra.table_item.grant_read_data(self.simulate.function.role)
+        self.simulate.function.add_environment(
+            key="POOL_TABLE_NAME",
+            value=infra.table_pool.table_name,
+        )
+        self.simulate.function.add_environment(
+            key="ITEM_TABLE_NAME",
+            value=infra.table_item.table_name,
+        )
+        # 退避済みのプールは dice に書き戻しを依頼する
+        self.dice.function.grant_invoke(self.simulate.function)
+        self.simulate.function.add_environment(
+            key="DICE_FUNCTION_NAME",
+            value=self.dice.function.function_name,
+        )
+        # 大規模な試行を自身の並列呼び出しに分割するため
+        # (関数の ARN を参照すると循環依存になるので関数名から組み立てる)
+        self.simulate.function.role.add_to_principal_policy(
+            iam.PolicyStatement(
+                actions=["lambda:InvokeFunction"],
+                resources=[
+                    Stack.of(self).format_arn(
+                        service="lambda",
+                        resource="function",
+                        resource_name=f"{build_name('function', 'simulate')}*",
+                        arn_format=cdk.ArnFormat.COLON_RESOURCE_NAME,
+                    ),
+                ],
+            ),
+        )
+
+        self.compound_dice = LambdaConstruct(self, "compound_dice", infra)
+        compound_dice.add_method(
+            http_method="POST",
+            integration=apigw.LambdaIntegration(
+                handler=self.compound_dice.handler,
+            ),
+        )
+        assert self.compound_dice.function.role is not None
+        infra.table_pool.grant_read_data(self.compound_dice.function.role)
+        self.compound_dice.function.add_environment(
+            key="POOL_TABLE_NAME",
+            value=infra.table_pool.table_name,
+        )
+        infra.table_item.grant_read_data(self.compound_dice.function.role)
+        self.compound_dice.function.add_environment(
+            key="ITEM_TABLE_NAME",
+            value=infra.table_item.table_name,
+        )
+        # 退避済みのプールは dice に書き戻しを依頼する
+        self.dice.function.grant_invoke(self.compound_dice.function)
+        self.compound_dice.function.add_environment(
+            key="DICE_FUNCTION_NAME",
+            value=self.dice.function.function_name,
+        )
+        infra.table_stats.grant_write_data(self.compound_dice.function.role)
+        self.compound_dice.function.add_environment(
+            key="STATS_TABLE_NAME",
+            value=infra.table_stats.table_name,
+        )
+        # 出目の集計を自身の非同期呼び出しに回すため
+        self.compound_dice.function.role.add_to_principal_policy(
+            iam.PolicyStatement(
+                actions=["lambda:InvokeFunction"],
+                resources=[
+                    Stack.of(self).format_arn(
+                        service="lambda",
+                        resource="function",
+                        resource_name=f"{build_name('function', 'compound_dice')}*",
+                        arn_format=cdk.ArnFormat.COLON_RESOURCE_NAME,
+                    ),
+                ],
+            ),
+        )
+
+        self.stream_processor = LambdaConstruct(self, "stream_processor", infra)
+        stream = paramater["lambda"]["stream_processor"]["stream"]
+        for table in [infra.table_pool, infra.table_item]:
+            self.stream_processor.function.add_event_source(
+                lambda_event_sources.DynamoEventSource(
+                    table=table,
+                    starting_position=lambda_.StartingPosition.TRIM_HORIZON,
+                    batch_size=stream["batch_size"],
+                    max_batching_window=cdk.Duration.seconds(
+                        stream["max_batching_window_seconds"],
+                    ),
+                    retry_attempts=stream["retry_attempts"],
+                    bisect_batch_on_error=True,
+                    report_batch_item_failures=True,
+                    on_failure=lambda_event_sources.SnsDlq(infra.sns_topic),
+                ),
+            )
+        assert self.stream_processor.function.role is not None
+        self.stream_processor.function.add_environment(
+            key="POOL_TABLE_NAME",
+            value=infra.table_pool.table_name,
+        )
+        self.stream_processor.function.add_environment(
+            key="ITEM_TABLE_NAME",
+            value=infra.table_item.table_name,
+        )
+        infra.table_catalog.grant_read_write_data(self.stream_processor.function.role)
+        self.stream_processor.function.add_environment(
+            key="CATALOG_TABLE_NAME",
+            value=infra.table_catalog.table_name,
+        )
+        if api_cache["enabled"]:
+            self.add_cache_invalidation(infra, self.stream_processor)
+
+        self.archiver = LambdaConstruct(self, "archiver", infra)
+        events.Rule(
+            scope=self,
+            id="archiver_schedule",
+            schedule=events.Schedule.expression(
+                paramater["lambda"]["archiver"]["schedule"],
+            ),
+            targets=[events_targets.LambdaFunction(self.archiver.function)],
+            rule_name=build_name("rule", "archiver"),
+        )
+        assert self.archiver.function.role is not None
+        infra.table_pool.grant_read_write_data(self.archiver.function.role)
+        self.archiver.function.add_environment(
+            key="POOL_TABLE_NAME",
+            value=infra.table_pool.table_name,
+        )
+        infra.table_item.grant_read_write_data(self.archiver.function.role)
+        self.archiver.function.add_environment(
             key="ITEM_TABLE_NAME",
             value=infra.table_item.table_name,
         )
+        infra.bucket_snapshot.grant_put(self.archiver.function.role)
+        self.archiver.function.add_environment(
+            key="SNAPSHOT_BUCKET_NAME",
+            value=infra.bucket_snapshot.bucket_name,
+        )
+
+        # テーブル単位のセッションへ出目を配信する WebSocket API
+        self.session = LambdaConstruct(self, "session", infra)
+        stage_name = paramater["lambda"]["session"]["stage_name"]
+        self.ws_api = apigwv2.CfnApi(
+            scope=self,
+            id="ws_api",
+            name=build_name("api", "session"),
+            protocol_type="WEBSOCKET",
+            route_selection_expression="$request.body.action",
+        )
+        ws_integration = apigwv2.CfnIntegration(
+            scope=self,
+            id="ws_integration",
+            api_id=self.ws_api.ref,
+            integration_type="AWS_PROXY",
+            integration_uri=(
+                f"arn:aws:apigateway:{Stack.of(self).region}:lambda:path"
+                f"/2015-03-31/functions/{self.session.handler.function_arn}"
+                "/invocations"
+            ),
+        )
+        for route_key in ["$connect", "$disconnect", "roll", "$default"]:
+            apigwv2.CfnRoute(
+                scope=self,
+                id=f"ws_route_{route_key.lstrip('$')}",
+                api_id=self.ws_api.ref,
+                route_key=route_key,
+                target=f"integrations/{ws_integration.ref}",
+            )
+        apigwv2.CfnStage(
+            scope=self,
+            id="ws_stage",
+            api_id=self.ws_api.ref,
+            stage_name=stage_name,
+            auto_deploy=True,
+        )
+        self.session.handler.add_permission(
+            id="ws_invoke",
+            principal=iam.ServicePrincipal("apigateway.amazonaws.com"),
+            source_arn=Stack.of(self).format_arn(
+                service="execute-api",
+                resource=self.ws_api.ref,
+                resource_name="*",
+            ),
+        )
+        assert self.session.function.role is not None
+        self.session.function.role.add_to_principal_policy(
+            iam.PolicyStatement(
+                actions=["execute-api:ManageConnections"],
+                resources=[
+                    Stack.of(self).format_arn(
+                        service="execute-api",
+                        resource=self.ws_api.ref,
+                        resource_name=f"{stage_name}/POST/@connections/*",
+                    ),
+                ],
+            ),
+        )
+        infra.table_connection.grant_read_write_data(self.session.function.role)
+        self.session.function.add_environment(
+            key="CONNECTION_TABLE_NAME",
+            value=infra.table_connection.table_name,
+        )
+        # 出目は dice 関数に 1 回だけ振らせ, 統計の記録も dice 側に任せる
+        self.dice.handler.grant_invoke(self.session.function.role)
+        self.session.function.add_environment(
+            key="DICE_FUNCTION_NAME",
+            value=self.dice.handler.function_arn,
+        )
+
+        if self.router is not None:
+            self.add_router(infra, self.router)
+
+    def route_handler(self: Self, function: LambdaConstruct) -> lambda_.IFunction:
+        if (
+            self.router is not None
+            and function.node.id in paramater["router"]["routes"]
+        ):
+            return self.router.handler
+        return function.handler
+
+    def add_router(self: Self, infra: InfraConstruct, router: LambdaConstruct) -> None:
+        # routes の関数に付けた権限と環境変数をまとめて router に付ける
+        assert router.function.role is not None
+        for key, value in router_environment(paramater["router"]["routes"]).items():
+            router.function.add_environment(key=key, value=value)
+        for table, env_name in [
+            (infra.table_pool, "POOL_TABLE_NAME"),
+            (infra.table_item, "ITEM_TABLE_NAME"),
+            (infra.table_stats, "STATS_TABLE_NAME"),
+            (infra.table_idempotency, "IDEMPOTENCY_TABLE_NAME"),
+        ]:
+            table.grant_read_write_data(router.function.role)
+            router.function.add_environment(key=env_name, value=table.table_name)
+        infra.table_catalog.grant_read_data(router.function.role)
+        router.function.add_environment(
+            key="CATALOG_TABLE_NAME",
+            value=infra.table_catalog.table_name,
+        )
+        infra.bucket_snapshot.grant_read_write(router.function.role)
+        infra.bucket_snapshot.grant_delete(router.function.role)
+        router.function.add_environment(
+            key="SNAPSHOT_BUCKET_NAME",
+            value=infra.bucket_snapshot.bucket_name,
+        )
+        if "dice" in paramater["router"]["routes"]:
+            # 出目の集計は router ではなく dice 関数の非同期呼び出しで行う
+            self.dice.function.grant_invoke(router.function)
+            router.function.add_environment(
+                key="STATS_FUNCTION_NAME",
+                value=self.dice.function.function_name,
+            )
+        if paramater["api_cache"]["enabled"]:
+            self.add_cache_invalidation(infra, router)
+
+    def add_cache_invalidation(
+        self: Self,
+        infra: InfraConstruct,
+        function: LambdaConstruct,
+    ) -> None:
+        # 書き込み後にキャッシュ済みの GET を Cache-Control: max-age=0 で取り直させる
+        # (ステージ URL を参照するとデプロイメントと循環するため API ID から組み立てる)
+        stack = Stack.of(self)
+        stage_name = STAGE_NAME
+        assert function.function.role is not None
+        function.function.role.add_to_principal_policy(
+            iam.PolicyStatement(
+                actions=["execute-api:InvalidateCache"],
+                resources=[
+                    stack.format_arn(
+                        service="execute-api",
+                        resource=self.api.rest_api_id,
+                        resource_name=f"{stage_name}/GET/pools*",
+                    ),
+                ],
+            ),
+        )
+        function.function.add_environment(
+            key="API_CACHE_URL",
+            value=(
+                f"https://{self.api.rest_api_id}.execute-api.{stack.region}."
+                f"{stack.url_suffix}/{stage_name}"
+            ),
+        )
+        # REST API の WAF は許可リスト外の IP アドレスを拒否するため, ヘッダで通す
+        infra.origin_secret.grant_read(function.function)
+        function.function.add_environment(
+            key="ORIGIN_VERIFY_HEADER",
+            value=paramater["origin_verify"]["header"],
+        )
+        function.function.add_environment(
+            key="ORIGIN_SECRET_ARN",
+            value=infra.origin_secret.secret_arn,
+        )
@@ -4,7 +4,11 @@ from aws_cdk import Stack
 from constructs import Construct
 
 from cdk.app_construct import AppConstruct
+from cdk.edge_construct import EdgeConstruct
+from cdk.front_door_construct import FrontDoorConstruct
 from cdk.infra_construct import InfraConstruct
+from cdk.monitoring_construct import MonitoringConstruct
+from cdk.paramater import paramater
 from cdk.static_construct import StaticConstruct
 
 
@@ -21,3 +25,26 @@ class DestinyDiceStack(Stack):
         self.infra = InfraConstruct(self, "infra")
         self.static = StaticConstruct(self, "static", web_acl_arn)
         self.app = AppConstruct(self, "app", self.infra)
+        if paramater["edge"]["enabled"]:
+            self.edge = EdgeConstruct(
+                self,
+                "edge",
+                self.infra,
+                self.app,
+                web_acl_arn,
+            )
+        front_door = paramater["front_door"]
+        if front_door["http_api"] or front_door["function_url"]:
+            self.front_door = FrontDoorConstruct(
+                self,
+                "front_door",
+                self.infra,
+                self.app,
+                web_acl_arn,
+            )
+        self.monitoring = MonitoringConstruct(
+            self,
+            "monitoring",
+            self.infra,
+            self.app,
+        )
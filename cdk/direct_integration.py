@@ -0,0 +1,98 @@
+from pathlib import Path
+
+from aws_cdk import aws_apigateway as apigw
+from aws_cdk import aws_dynamodb as dynamdb
+from aws_cdk import aws_iam as iam
+from constructs import Construct
+
+VTL_DIR = Path(__file__).parent / "vtl"
+
+# Lambda の Response.data() が返すヘッダー (値は API Gateway の静的値の書式)
+RESPONSE_HEADERS = {
+    "Content-Type": "'application/json'",
+    "Access-Control-Allow-Origin": "'*'",
+    "Access-Control-Allow-Methods": "'GET, POST, DELETE'",
+    "Access-Control-Allow-Credentials": "'true'",
+    "Access-Control-Allow-Headers": "'origin, x-requested-with'",
+}
+
+# Lambda の例外処理と同じステータスと本文
+ERROR_RESPONSES = {
+    "429": (
+        r"4\d{2}",
+        '{"message": "too many requests. Please retry after some time."}',
+    ),
+    "500": (
+        r"5\d{2}",
+        '{"message": "internal server error. Please access again after some time."}',
+    ),
+}
+
+
+def load_template(name: str, table_name: str) -> str:
+    template = (VTL_DIR / f"{name}.vtl").read_text()
+    return template.replace("__POOL_TABLE_NAME__", table_name)
+
+
+def list_pool_integration(
+    scope: Construct,
+    table: dynamdb.ITable,
+    cache_key_parameters: list[str],
+) -> tuple[apigw.AwsIntegration, list[apigw.MethodResponse]]:
+    # Lambda を介さず API Gateway から DynamoDB の Scan を直接呼び出す
+    # ページングできないため, 1 MB に収まる規模のプール一覧を前提とする
+    role = iam.Role(
+        scope=scope,
+        id="list_pool_direct_role",
+        assumed_by=iam.ServicePrincipal("apigateway.amazonaws.com"),
+    )
+    table.grant_read_data(role)
+    response_parameters = {
+        f"method.response.header.{k}": v for k, v in RESPONSE_HEADERS.items()
+    }
+    integration = apigw.AwsIntegration(
+        service="dynamodb",
+        action="Scan",
+        options=apigw.IntegrationOptions(
+            credentials_role=role,
+            cache_key_parameters=cache_key_parameters,
+            passthrough_behavior=apigw.PassthroughBehavior.NEVER,
+            request_templates={
+                "application/json": load_template(
+                    "list_pool_request",
+                    table.table_name,
+                ),
+            },
+            integration_responses=[
+                apigw.IntegrationResponse(
+                    status_code="200",
+                    response_parameters=response_parameters,
+                    response_templates={
+                        "application/json": load_template(
+                            "list_pool_response",
+                            table.table_name,
+                        ),
+                    },
+                ),
+                *[
+                    apigw.IntegrationResponse(
+                        status_code=status_code,
+                        selection_pattern=pattern,
+                        response_parameters=response_parameters,
+                        response_templates={"application/json": body},
+                    )
+                    for status_code, (pattern, body) in ERROR_RESPONSES.items()
+                ],
+            ],
+        ),
+    )
+    method_responses = [
+        apigw.MethodResponse(
+            status_code=status_code,
+            response_parameters={
+                f"method.response.header.{k}": True for k in RESPONSE_HEADERS
+            },
+        )
+        for status_code in ["200", *ERROR_RESPONSES]
+    ]
+    return integration, method_responses
@@ -0,0 +1,124 @@
+from typing import Any, Self
+
+import aws_cdk as cdk
+from aws_cdk import aws_cloudfront as cloudfront
+from aws_cdk import aws_cloudfront_origins as origins
+from constructs import Construct
+
+from cdk.app_construct import AppConstruct
+from cdk.infra_construct import InfraConstruct
+from cdk.paramater import build_name, paramater
+
+# 版数 (v) の付いていないスナップショットの要求は長期キャッシュさせない.
+# /snapshots/<名前>.snapshot を S3 の pools/<名前>.snapshot (origin_path) に対応付ける
+REQUIRE_VERSION_FUNCTION = """
+function handler(event) {
+    var request = event.request;
+    if (!request.querystring.v || !/^[0-9]+$/.test(request.querystring.v.value)) {
+        return {statusCode: 400, statusDescription: "Bad Request"};
+    }
+    request.uri = request.uri.replace(/^\\/snapshots\\//, "/");
+    return request;
+}
+"""
+
+
+class EdgeConstruct(Construct):
+    def __init__(  # noqa: PLR0913
+        self: Self,
+        scope: Construct,
+        construct_id: str,
+        infra: InfraConstruct,
+        app: AppConstruct,
+        web_acl_arn: str,
+        **kwargs: Any,  # noqa: ANN401
+    ) -> None:
+        super().__init__(scope, construct_id, **kwargs)
+
+        edge = paramater["edge"]
+        # REST API の WAF は CloudFront の IP アドレスを許可しないため, ヘッダで通す
+        api_origin = origins.RestApiOrigin(
+            app.api,
+            custom_headers={
+                paramater["origin_verify"]["header"]: (
+                    infra.origin_secret.secret_value.unsafe_unwrap()
+                ),
+            },
+        )
+
+        # プール一覧はテナントと版数付きかどうかでキャッシュを分ける
+        catalog_policy = cloudfront.CachePolicy(
+            scope=self,
+            id="catalog_policy",
+            cache_policy_name=build_name("cache", "catalog"),
+            default_ttl=cdk.Duration.seconds(edge["catalog"]["default_ttl_seconds"]),
+            max_ttl=cdk.Duration.seconds(edge["catalog"]["max_ttl_seconds"]),
+            min_ttl=cdk.Duration.seconds(0),
+            header_behavior=cloudfront.CacheHeaderBehavior.allow_list("X-Tenant-Id"),
+            query_string_behavior=cloudfront.CacheQueryStringBehavior.allow_list(
+                "versions",
+            ),
+            enable_accept_encoding_gzip=True,
+            enable_accept_encoding_brotli=True,
+        )
+        # スナップショットは版数ごとに別のキーとなるため, 同じキーの内容は変わらない
+        snapshot_policy = cloudfront.CachePolicy(
+            scope=self,
+            id="snapshot_policy",
+            cache_policy_name=build_name("cache", "snapshot"),
+            default_ttl=cdk.Duration.days(edge["snapshot"]["ttl_days"]),
+            max_ttl=cdk.Duration.days(edge["snapshot"]["ttl_days"]),
+            min_ttl=cdk.Duration.days(edge["snapshot"]["ttl_days"]),
+            query_string_behavior=cloudfront.CacheQueryStringBehavior.allow_list("v"),
+        )
+
+        self.distribution = cloudfront.Distribution(
+            scope=self,
+            id="distribution",
+            comment=build_name("cloudfront", "api"),
+            # 書き込みや dice など, 一覧とスナップショット以外はキャッシュせず中継する
+            default_behavior=cloudfront.BehaviorOptions(
+                origin=api_origin,
+                allowed_methods=cloudfront.AllowedMethods.ALLOW_ALL,
+                cache_policy=cloudfront.CachePolicy.CACHING_DISABLED,
+                origin_request_policy=(
+                    cloudfront.OriginRequestPolicy.ALL_VIEWER_EXCEPT_HOST_HEADER
+                ),
+                viewer_protocol_policy=cloudfront.ViewerProtocolPolicy.HTTPS_ONLY,
+            ),
+            additional_behaviors={
+                "/pools": cloudfront.BehaviorOptions(
+                    origin=api_origin,
+                    cache_policy=catalog_policy,
+                    viewer_protocol_policy=cloudfront.ViewerProtocolPolicy.HTTPS_ONLY,
+                ),
+                "/snapshots/*": cloudfront.BehaviorOptions(
+                    origin=origins.S3Origin(
+                        infra.bucket_snapshot,
+                        origin_path="/pools",
+                    ),
+                    cache_policy=snapshot_policy,
+                    viewer_protocol_policy=cloudfront.ViewerProtocolPolicy.HTTPS_ONLY,
+                    function_associations=[
+                        cloudfront.FunctionAssociation(
+                            function=cloudfront.Function(
+                                scope=self,
+                                id="require_version",
+                                code=cloudfront.FunctionCode.from_inline(
+                                    REQUIRE_VERSION_FUNCTION,
+                                ),
+                            ),
+                            event_type=cloudfront.FunctionEventType.VIEWER_REQUEST,
+                        ),
+                    ],
+                ),
+            },
+            price_class=cloudfront.PriceClass.PRICE_CLASS_ALL,
+            web_acl_id=web_acl_arn,
+        )
+
+        cdk.CfnOutput(
+            self,
+            "edge_api_url",
+            value=f"https://{self.distribution.domain_name}",
+        )
@@ -0,0 +1,202 @@
+from typing import Any, Self
+
+import aws_cdk as cdk
+from aws_cdk import Stack
+from aws_cdk import aws_apigatewayv2 as apigwv2
+from aws_cdk import aws_cloudfront as cloudfront
+from aws_cdk import aws_cloudfront_origins as origins
+from aws_cdk import aws_iam as iam
+from aws_cdk import aws_lambda as lambda_
+from constructs import Construct
+
+from cdk.app_construct import AppConstruct
+from cdk.infra_construct import InfraConstruct
+from cdk.lmd_construct import LambdaConstruct
+from cdk.paramater import build_name, paramater
+
+ALLOW_HEADERS = ["Content-Type", "Authorization", "X-Tenant-Id", "Idempotency-Key"]
+
+
+def routes(app: AppConstruct) -> dict[str, LambdaConstruct]:
+    # REST API と同じリソースパスを HTTP API のルートキーで表したもの
+    return {
+        "GET /pools": app.list_pool,
+        "POST /pools/{pool_name}": app.create_pool,
+        "DELETE /pools/{pool_name}": app.delete_pool,
+        "GET /pools/{pool_name}/dice": app.dice,
+        "GET /pools/{pool_name}/stats": app.stats,
+        "POST /pools/{pool_name}/simulate": app.simulate,
+        "POST /dice": app.compound_dice,
+    }
+
+
+class FrontDoorConstruct(Construct):
+    def __init__(  # noqa: PLR0913
+        self: Self,
+        scope: Construct,
+        construct_id: str,
+        infra: InfraConstruct,
+        app: AppConstruct,
+        web_acl_arn: str,
+        **kwargs: Any,  # noqa: ANN401
+    ) -> None:
+        super().__init__(scope, construct_id, **kwargs)
+
+        front_door = paramater["front_door"]
+        if front_door["http_api"]:
+            self.add_http_api(infra, app, web_acl_arn)
+        if front_door["function_url"]:
+            self.add_function_urls(app)
+
+    def add_http_api(
+        self: Self,
+        infra: InfraConstruct,
+        app: AppConstruct,
+        web_acl_arn: str,
+    ) -> None:
+        stack = Stack.of(self)
+        origin_verify = paramater["origin_verify"]
+        self.http_api = apigwv2.CfnApi(
+            scope=self,
+            id="http_api",
+            name=build_name("api", "destiny_dice_http"),
+            protocol_type="HTTP",
+            cors_configuration=apigwv2.CfnApi.CorsProperty(
+                allow_origins=["*"],
+                allow_methods=["*"],
+                allow_headers=ALLOW_HEADERS,
+            ),
+        )
+        # HTTP API のステージには WAF を関連付けられないため, 既定のエンドポイントを
+        # 直接呼ばれないよう, CloudFront が付けるヘッダをオーソライザーで確かめる
+        self.origin_verify = LambdaConstruct(self, "origin_verify", infra)
+        infra.origin_secret.grant_read(self.origin_verify.function)
+        self.origin_verify.function.add_environment(
+            key="ORIGIN_VERIFY_HEADER",
+            value=origin_verify["header"],
+        )
+        self.origin_verify.function.add_environment(
+            key="ORIGIN_SECRET_ARN",
+            value=infra.origin_secret.secret_arn,
+        )
+        self.origin_verify.handler.add_permission(
+            id="http_api_authorize",
+            principal=iam.ServicePrincipal("apigateway.amazonaws.com"),
+            source_arn=stack.format_arn(
+                service="execute-api",
+                resource=self.http_api.ref,
+                resource_name="authorizers/*",
+            ),
+        )
+        self.authorizer = apigwv2.CfnAuthorizer(
+            scope=self,
+            id="http_authorizer",
+            api_id=self.http_api.ref,
+            name=build_name("authorizer", "origin_verify"),
+            authorizer_type="REQUEST",
+            authorizer_payload_format_version="2.0",
+            enable_simple_responses=True,
+            # ヘッダを持たない要求はオーソライザーを呼ばずに 401 となる
+            identity_source=[f"$request.header.{origin_verify['header']}"],
+            authorizer_result_ttl_in_seconds=paramater["lambda"]["origin_verify"][
+                "authorizer_ttl_seconds"
+            ],
+            authorizer_uri=(
+                f"arn:{stack.partition}:apigateway:{stack.region}:lambda:path/"
+                f"2015-03-31/functions/{self.origin_verify.handler.function_arn}"
+                "/invocations"
+            ),
+        )
+        integrations: dict[str, apigwv2.CfnIntegration] = {}
+        for route_key, function in routes(app).items():
+            name = function.node.id
+            if name not in integrations:
+                integrations[name] = apigwv2.CfnIntegration(
+                    scope=self,
+                    id=f"http_integration_{name}",
+                    api_id=self.http_api.ref,
+                    integration_type="AWS_PROXY",
+                    integration_uri=function.handler.function_arn,
+                    payload_format_version="2.0",
+                )
+                function.handler.add_permission(
+                    id="http_api_invoke",
+                    principal=iam.ServicePrincipal("apigateway.amazonaws.com"),
+                    source_arn=stack.format_arn(
+                        service="execute-api",
+                        resource=self.http_api.ref,
+                        resource_name="*",
+                    ),
+                )
+            apigwv2.CfnRoute(
+                scope=self,
+                id=f"http_route_{route_key.replace(' ', '_')}",
+                api_id=self.http_api.ref,
+                route_key=route_key,
+                target=f"integrations/{integrations[name].ref}",
+                authorization_type="CUSTOM",
+                authorizer_id=self.authorizer.ref,
+            )
+        # ステージ名を付けない $default ステージにし, CloudFront からパスをそのまま渡す
+        apigwv2.CfnStage(
+            scope=self,
+            id="http_stage",
+            api_id=self.http_api.ref,
+            stage_name="$default",
+            auto_deploy=True,
+        )
+
+        # IP アドレスの許可リストは CloudFront の WAF で確かめる
+        self.distribution = cloudfront.Distribution(
+            scope=self,
+            id="distribution",
+            comment=build_name("cloudfront", "http_api"),
+            default_behavior=cloudfront.BehaviorOptions(
+                origin=origins.HttpOrigin(
+                    f"{self.http_api.ref}.execute-api.{stack.region}.{stack.url_suffix}",
+                    custom_headers={
+                        origin_verify["header"]: (
+                            infra.origin_secret.secret_value.unsafe_unwrap()
+                        ),
+                    },
+                ),
+                allowed_methods=cloudfront.AllowedMethods.ALLOW_ALL,
+                cache_policy=cloudfront.CachePolicy.CACHING_DISABLED,
+                origin_request_policy=(
+                    cloudfront.OriginRequestPolicy.ALL_VIEWER_EXCEPT_HOST_HEADER
+                ),
+                viewer_protocol_policy=cloudfront.ViewerProtocolPolicy.HTTPS_ONLY,
+            ),
+            price_class=cloudfront.PriceClass.PRICE_CLASS_ALL,
+            web_acl_id=web_acl_arn,
+        )
+        cdk.CfnOutput(
+            self,
+            "http_api_url",
+            value=f"https://{self.distribution.domain_name}",
+        )
+
+    def add_function_urls(self: Self, app: AppConstruct) -> None:
+        # 関数 URL は関数ごとに別のドメインとなるため, 計測用にそれぞれ出力する.
+        # WAF も CloudFront も前段に置けないため, 呼び出しには IAM の署名を求める
+        # (create_pool と delete_pool は同じパスをメソッドで分けており, 1 つの
+        # オリジンにまとめられないため CloudFront は前段に置かない)
+        self.function_urls: dict[str, lambda_.FunctionUrl] = {}
+        for function in dict.fromkeys(routes(app).values()):
+            name = function.node.id
+            self.function_urls[name] = lambda_.FunctionUrl(
+                scope=self,
+                id=f"function_url_{name}",
+                function=function.handler,
+                auth_type=lambda_.FunctionUrlAuthType.AWS_IAM,
+                cors=lambda_.FunctionUrlCorsOptions(
+                    allowed_origins=["*"],
+                    allowed_methods=[lambda_.HttpMethod.ALL],
+                    allowed_headers=ALLOW_HEADERS,
+                ),
+            )
+            cdk.CfnOutput(
+                self,
+                f"function_url_{name}_output",
+                value=self.function_urls[name].url,
+            )
@@ -2,10 +2,12 @@ from typing import Any, Self
 
 import aws_cdk as cdk
 from aws_cdk import aws_dynamodb as dynamdb
+from aws_cdk import aws_s3 as s3
+from aws_cdk import aws_secretsmanager as secretsmanager
 from aws_cdk import aws_sns as sns
 from constructs import Construct
 
-from cdk.paramater import build_name
+from cdk.paramater import build_name, paramater
 from cdk.waf_construct import WafConstruct
 
 
@@ -28,8 +30,23 @@ class InfraConstruct(Construct):
             ),
             billing_mode=dynamdb.BillingMode.PAY_PER_REQUEST,
             removal_policy=cdk.RemovalPolicy.DESTROY,
+            stream=dynamdb.StreamViewType.NEW_AND_OLD_IMAGES,
+            time_to_live_attribute="expire_at",
             table_name=build_name("table", "pool"),
         )
+        # テナントに属するプールだけが持つ tenant_id による疎な索引
+        self.table_pool.add_global_secondary_index(
+            index_name="tenant_id",
+            partition_key=dynamdb.Attribute(
+                name="tenant_id",
+                type=dynamdb.AttributeType.STRING,
+            ),
+            sort_key=dynamdb.Attribute(
+                name="pool_name",
+                type=dynamdb.AttributeType.STRING,
+            ),
+            projection_type=dynamdb.ProjectionType.ALL,
+        )
 
         self.table_item = dynamdb.Table(
             scope=self,
@@ -44,9 +61,103 @@ class InfraConstruct(Construct):
             ),
             billing_mode=dynamdb.BillingMode.PAY_PER_REQUEST,
             removal_policy=cdk.RemovalPolicy.DESTROY,
+            stream=dynamdb.StreamViewType.NEW_AND_OLD_IMAGES,
+            time_to_live_attribute="expire_at",
             table_name=build_name("table", "item"),
         )
 
+        self.table_stats = dynamdb.Table(
+            scope=self,
+            id="stats",
+            partition_key=dynamdb.Attribute(
+                name="pool_name",
+                type=dynamdb.AttributeType.STRING,
+            ),
+            sort_key=dynamdb.Attribute(
+                name="item_id",
+                type=dynamdb.AttributeType.NUMBER,
+            ),
+            billing_mode=dynamdb.BillingMode.PAY_PER_REQUEST,
+            removal_policy=cdk.RemovalPolicy.DESTROY,
+            table_name=build_name("table", "stats"),
+        )
+
+        # pool / item テーブルの変更から導出するカタログ
+        self.table_catalog = dynamdb.Table(
+            scope=self,
+            id="catalog",
+            partition_key=dynamdb.Attribute(
+                name="pool_name",
+                type=dynamdb.AttributeType.STRING,
+            ),
+            billing_mode=dynamdb.BillingMode.PAY_PER_REQUEST,
+            removal_policy=cdk.RemovalPolicy.DESTROY,
+            table_name=build_name("table", "catalog"),
+        )
+
+        # create_pool / delete_pool の冪等性キーと保存済みレスポンス
+        self.table_idempotency = dynamdb.Table(
+            scope=self,
+            id="idempotency",
+            partition_key=dynamdb.Attribute(
+                name="id",
+                type=dynamdb.AttributeType.STRING,
+            ),
+            billing_mode=dynamdb.BillingMode.PAY_PER_REQUEST,
+            removal_policy=cdk.RemovalPolicy.DESTROY,
+            time_to_live_attribute="expiration",
+            table_name=build_name("table", "idempotency"),
+        )
+
+        # session の WebSocket 接続. セッション単位で購読者を引く索引を持つ
+        self.table_connection = dynamdb.Table(
+            scope=self,
+            id="connection",
+            partition_key=dynamdb.Attribute(
+                name="connection_id",
+                type=dynamdb.AttributeType.STRING,
+            ),
+            billing_mode=dynamdb.BillingMode.PAY_PER_REQUEST,
+            removal_policy=cdk.RemovalPolicy.DESTROY,
+            time_to_live_attribute="expire_at",
+            table_name=build_name("table", "connection"),
+        )
+        self.table_connection.add_global_secondary_index(
+            index_name="session_key",
+            partition_key=dynamdb.Attribute(
+                name="session_key",
+                type=dynamdb.AttributeType.STRING,
+            ),
+            projection_type=dynamdb.ProjectionType.KEYS_ONLY,
+        )
+
+        # プールのスナップショットを置く S3 バケット
+        self.bucket_snapshot = s3.Bucket(
+            scope=self,
+            id="snapshot",
+            block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+            encryption=s3.BucketEncryption.S3_MANAGED,
+            enforce_ssl=True,
+            removal_policy=cdk.RemovalPolicy.DESTROY,
+            auto_delete_objects=True,
+            # archiver が退避したプールは参照頻度が低いため低頻度アクセス層へ移す
+            lifecycle_rules=[
+                s3.LifecycleRule(
+                    prefix="archive/",
+                    transitions=[
+                        s3.Transition(
+                            storage_class=s3.StorageClass.INFREQUENT_ACCESS,
+                            transition_after=cdk.Duration.days(
+                                paramater["lambda"]["archiver"][
+                                    "archive_transition_days"
+                                ],
+                            ),
+                        ),
+                    ],
+                ),
+            ],
+        )
+
         # AWS SNS
         self.sns_topic = sns.Topic(
             self,
@@ -54,4 +165,15 @@ class InfraConstruct(Construct):
             topic_name=build_name("topic", "error_notify"),
         )
 
-        self.waf = WafConstruct(self, "apigw")
+        # CloudFront のオリジン要求と, キャッシュを取り直す関数が付けるヘッダの値
+        self.origin_secret = secretsmanager.Secret(
+            scope=self,
+            id="origin_secret",
+            secret_name=build_name("secret", "origin_verify"),
+            generate_secret_string=secretsmanager.SecretStringGenerator(
+                exclude_punctuation=True,
+                password_length=32,
+            ),
+        )
+
+        self.waf = WafConstruct(self, "apigw", origin_secret=self.origin_secret)
@@ -16,6 +16,26 @@ with (Path.cwd() / "pyproject.toml").open("rb") as f:
     project = tomllib.load(f)["project"]["name"]
 
 
+# レイヤーのネイティブ拡張はアーキテクチャごとにビルドする
+ARCHITECTURES = {
+    "x86_64": lambda_.Architecture.X86_64,
+    "arm64": lambda_.Architecture.ARM_64,
+}
+LAYER_DIRS = {
+    "x86_64": ".layers",
+    "arm64": ".layers-arm64",
+}
+# function_layer: requirements-<関数名>.txt の重い依存はその関数にだけ付ける
+FUNCTION_LAYER_DIRS = {
+    "x86_64": ".layers-{}",
+    "arm64": ".layers-arm64-{}",
+}
+POWERTOOLS_LAYER_NAMES = {
+    "x86_64": "AWSLambdaPowertoolsPythonV2",
+    "arm64": "AWSLambdaPowertoolsPythonV2-Arm64",
+}
+
+
 class LambdaConstruct(Construct):
     def __init__(
         self: Self,
@@ -27,30 +47,72 @@ class LambdaConstruct(Construct):
         super().__init__(scope, construct_id, **kwargs)
 
         region = cdk.Stack.of(self).region
+        architecture = paramater["lambda"][construct_id]["architecture"]
         powertools_layer = lambda_.LayerVersion.from_layer_version_arn(
             self,
             "powertools",
-            layer_version_arn=f"arn:aws:lambda:{region}:017000801446:layer:AWSLambdaPowertoolsPythonV2:40",
+            layer_version_arn=f"arn:aws:lambda:{region}:017000801446:layer:{POWERTOOLS_LAYER_NAMES[architecture]}:40",
         )
 
         lib_layer = lambda_.LayerVersion(
             self,
             "lib",
-            code=lambda_.Code.from_asset(".layers"),
+            code=lambda_.Code.from_asset(LAYER_DIRS[architecture]),
+            compatible_runtimes=[lambda_.Runtime.PYTHON_3_11],
+            compatible_architectures=[ARCHITECTURES[architecture]],
+        )
+        # 全関数に共通するモジュール (プロファイラなど). 純 Python のみを置く
+        shared_layer = lambda_.LayerVersion(
+            self,
+            "shared",
+            code=lambda_.Code.from_asset(
+                str(Path.cwd() / "src" / "layer"),
+                exclude=["**/__pycache__"],
+            ),
             compatible_runtimes=[lambda_.Runtime.PYTHON_3_11],
         )
+        layers = [powertools_layer, lib_layer, shared_layer]
+        if paramater["lambda"][construct_id].get("function_layer", False):
+            layers.append(
+                lambda_.LayerVersion(
+                    self,
+                    "function_layer",
+                    code=lambda_.Code.from_asset(
+                        FUNCTION_LAYER_DIRS[architecture].format(construct_id),
+                    ),
+                    compatible_runtimes=[lambda_.Runtime.PYTHON_3_11],
+                    compatible_architectures=[ARCHITECTURES[architecture]],
+                ),
+            )
+
+        # bundle_app: 他の関数のモジュールも呼び出すため src/app 全体を配置する
+        if paramater["lambda"][construct_id].get("bundle_app", False):
+            code = lambda_.Code.from_asset(
+                str(Path.cwd() / "src" / "app"),
+                exclude=["**/__pycache__"],
+            )
+            handler = f"{construct_id}.lambda_function.lambda_handler"
+        else:
+            code = lambda_.Code.from_asset(
+                str(Path.cwd() / "src" / "app" / construct_id),
+            )
+            handler = "lambda_function.lambda_handler"
 
         self.function = lambda_.Function(
             scope=self,
             id="function",
-            code=lambda_.Code.from_asset(
-                str(Path.cwd() / "src" / "app" / construct_id),
-            ),
-            handler="lambda_function.lambda_handler",
+            code=code,
+            handler=handler,
             runtime=lambda_.Runtime.PYTHON_3_11,
             environment=paramater["lambda"][construct_id]["env"],
             memory_size=paramater["lambda"][construct_id]["memory_size"],
-            layers=[powertools_layer, lib_layer],
+            architecture=ARCHITECTURES[architecture],
+            timeout=(
+                cdk.Duration.seconds(paramater["lambda"][construct_id]["timeout"])
+                if "timeout" in paramater["lambda"][construct_id]
+                else None
+            ),
+            layers=layers,
             function_name=build_name("function", construct_id),
         )
 
@@ -59,6 +121,17 @@ class LambdaConstruct(Construct):
             construct_id,
         )
 
+        # プロビジョニング済み同時実行はバージョンに紐づくため, エイリアス経由で公開する
+        self.handler: lambda_.IFunction = self.function
+        provisioned_concurrency = paramater["lambda"][construct_id][
+            "provisioned_concurrency"
+        ]
+        if provisioned_concurrency > 0:
+            self.handler = self.function.add_alias(
+                "live",
+                provisioned_concurrent_executions=provisioned_concurrency,
+            )
+
         self.lambda_error_metric = self.function.metric_all_errors(
             period=cdk.Duration.minutes(5),
         )
@@ -115,3 +188,108 @@ class LambdaConstruct(Construct):
         self.log_error_alarm.add_alarm_action(
             cloudwatch_actions.SnsAction(infra.sns_topic),
         )
+
+        # レイテンシ SLO: 関数ごとの上書きを既定値に重ねる
+        monitoring = paramater["monitoring"]
+        self.slo = monitoring["lambda"] | paramater["lambda"][construct_id].get(
+            "slo",
+            {},
+        )
+        period = cdk.Duration.minutes(monitoring["period_minutes"])
+
+        # Init Duration はメトリクスとして発行されないため REPORT 行から取り出す
+        self.logs.add_metric_filter(
+            id="init_duration",
+            filter_pattern=logs.FilterPattern.space_delimited(
+                "type",
+                "request_id_label",
+                "request_id",
+                "duration_label",
+                "duration",
+                "duration_unit",
+                "billed_label",
+                "billed_duration_label",
+                "billed_duration",
+                "billed_duration_unit",
+                "memory_label",
+                "memory_size_label",
+                "memory_size",
+                "memory_size_unit",
+                "max_label",
+                "max_memory_label",
+                "max_memory_used_label",
+                "max_memory_used",
+                "max_memory_used_unit",
+                "init_label",
+                "init_duration_label",
+                "init_duration",
+                "init_duration_unit",
+            )
+            .where_string("type", "=", "REPORT")
+            .where_string("init_label", "=", "Init"),
+            metric_name=f"{construct_id}_init_duration",
+            metric_namespace=project,
+            metric_value="$init_duration",
+            unit=cloudwatch.Unit.MILLISECONDS,
+            filter_name="InitDuration",
+        )
+        self.init_duration_metric = cloudwatch.Metric(
+            metric_name=f"{construct_id}_init_duration",
+            namespace=project,
+            statistic="p99",
+            period=period,
+        )
+
+        self.duration_metrics = {
+            statistic: self.function.metric_duration(
+                period=period,
+                statistic=statistic,
+            )
+            for statistic in ["p50", "p95", "p99"]
+        }
+        self.throttles_metric = self.function.metric_throttles(period=period)
+
+        self.latency_alarms = [
+            self.duration_metrics[statistic].create_alarm(
+                scope=self,
+                id=f"duration_{statistic}",
+                evaluation_periods=monitoring["evaluation_periods"],
+                threshold=self.slo[f"duration_{statistic}_ms"],
+                treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,
+                actions_enabled=True,
+                alarm_name=build_name("alarm", f"duration_{statistic}_{construct_id}"),
+                alarm_description=(
+                    f"Duration {statistic} SLO from {self.function.function_name}"
+                ),
+            )
+            for statistic in ["p95", "p99"]
+        ]
+        self.latency_alarms.append(
+            self.init_duration_metric.create_alarm(
+                scope=self,
+                id="init_duration_p99",
+                evaluation_periods=monitoring["evaluation_periods"],
+                threshold=self.slo["init_duration_p99_ms"],
+                treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,
+                actions_enabled=True,
+                alarm_name=build_name("alarm", f"init_duration_p99_{construct_id}"),
+                alarm_description=(
+                    f"Init duration p99 SLO from {self.function.function_name}"
+                ),
+            ),
+        )
+        self.throttles_alarm = self.throttles_metric.create_alarm(
+            scope=self,
+            id="throttles",
+            evaluation_periods=1,
+            threshold=self.slo["throttles"],
+            comparison_operator=(
+                cloudwatch.ComparisonOperator.GREATER_THAN_OR_EQUAL_TO_THRESHOLD
+            ),
+            treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,
+            actions_enabled=True,
+            alarm_name=build_name("alarm", f"throttles_{construct_id}"),
+            alarm_description=f"Throttles from {self.function.function_name}",
+        )
+        for alarm in [*self.latency_alarms, self.throttles_alarm]:
+            alarm.add_alarm_action(cloudwatch_actions.SnsAction(infra.sns_topic))
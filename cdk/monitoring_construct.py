@@ -0,0 +1,187 @@
+from typing import Any, Self
+
+import aws_cdk as cdk
+from aws_cdk import aws_cloudwatch as cloudwatch
+from aws_cdk import aws_cloudwatch_actions as cloudwatch_actions
+from aws_cdk import aws_dynamodb as dynamdb
+from constructs import Construct
+
+from cdk.app_construct import AppConstruct
+from cdk.infra_construct import InfraConstruct
+from cdk.lmd_construct import LambdaConstruct
+from cdk.paramater import build_name, paramater
+
+
+class MonitoringConstruct(Construct):
+    def __init__(
+        self: Self,
+        scope: Construct,
+        construct_id: str,
+        infra: InfraConstruct,
+        app: AppConstruct,
+        **kwargs: Any,  # noqa: ANN401
+    ) -> None:
+        super().__init__(scope, construct_id, **kwargs)
+
+        monitoring = paramater["monitoring"]
+        period = cdk.Duration.minutes(monitoring["period_minutes"])
+        functions = [x for x in app.node.children if isinstance(x, LambdaConstruct)]
+        tables = [x for x in infra.node.children if isinstance(x, dynamdb.Table)]
+
+        self.dashboard = cloudwatch.Dashboard(
+            scope=self,
+            id="dashboard",
+            dashboard_name=build_name("dashboard", "slo"),
+        )
+        self.dashboard.add_widgets(
+            cloudwatch.GraphWidget(
+                title="api latency",
+                left=[
+                    app.api.metric_latency(period=period, statistic=statistic)
+                    for statistic in ["p50", "p95", "p99"]
+                ],
+                width=24,
+            ),
+        )
+        # router 関数と個別の関数のどちらで初期化が少ないかを比べる
+        self.dashboard.add_widgets(
+            cloudwatch.LogQueryWidget(
+                title="cold start rate",
+                log_group_names=[x.logs.log_group_name for x in functions],
+                query_lines=[
+                    'filter @type = "REPORT"',
+                    "stats count(*) as invocations,"
+                    " sum(ispresent(@initDuration)) as cold_starts,"
+                    " sum(ispresent(@initDuration)) * 100 / count(*) as cold_start_pct"
+                    " by @log",
+                    "sort cold_start_pct desc",
+                ],
+                view=cloudwatch.LogQueryVisualizationType.TABLE,
+                width=24,
+            ),
+        )
+        # 関数ごとに 1 行: 実行時間 / 初期化時間 / スロットリングと同時実行数 / アラーム
+        for function in functions:
+            self.dashboard.add_widgets(
+                cloudwatch.GraphWidget(
+                    title=f"{function.node.id} duration",
+                    left=list(function.duration_metrics.values()),
+                    left_annotations=[
+                        cloudwatch.HorizontalAnnotation(
+                            value=function.slo[f"duration_{statistic}_ms"],
+                            label=f"{statistic} SLO",
+                        )
+                        for statistic in ["p95", "p99"]
+                    ],
+                    width=8,
+                ),
+                cloudwatch.GraphWidget(
+                    title=f"{function.node.id} init duration",
+                    left=[function.init_duration_metric],
+                    width=6,
+                ),
+                cloudwatch.GraphWidget(
+                    title=f"{function.node.id} throttles",
+                    left=[function.throttles_metric],
+                    right=[
+                        function.function.metric(
+                            "ConcurrentExecutions",
+                            period=period,
+                            statistic="Maximum",
+                        ),
+                    ],
+                    width=6,
+                ),
+                cloudwatch.AlarmStatusWidget(
+                    title=f"{function.node.id} alarms",
+                    alarms=[
+                        *function.latency_alarms,
+                        function.throttles_alarm,
+                        function.lambda_error_alarm,
+                        function.log_error_alarm,
+                    ],
+                    width=4,
+                ),
+            )
+
+        # テーブルごとに操作別 p99 レイテンシの最大値とスロットリング数を監視する
+        dynamodb = monitoring["dynamodb"]
+        self.table_alarms: list[cloudwatch.Alarm] = []
+        for table in tables:
+            name = table.node.id
+            # Operation ディメンションは GetItem のような表記
+            latency = {
+                operation.lower(): table.metric_successful_request_latency(
+                    dimensions_map={
+                        "TableName": table.table_name,
+                        "Operation": "".join(
+                            x.capitalize() for x in operation.split("_")
+                        ),
+                    },
+                    period=period,
+                    statistic="p99",
+                )
+                for operation in dynamodb["operations"]
+            }
+            max_latency = cloudwatch.MathExpression(
+                expression=f"MAX([{', '.join(latency)}])",
+                using_metrics=latency,
+                period=period,
+                label=f"{name} latency p99",
+            )
+            throttled = table.metric_throttled_requests_for_operations(
+                operations=[
+                    dynamdb.Operation[operation] for operation in dynamodb["operations"]
+                ],
+                period=period,
+            )
+            latency_alarm = max_latency.create_alarm(
+                scope=self,
+                id=f"{name}_latency_p99",
+                evaluation_periods=monitoring["evaluation_periods"],
+                threshold=dynamodb["latency_p99_ms"],
+                treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,
+                actions_enabled=True,
+                alarm_name=build_name("alarm", f"dynamodb_latency_p99_{name}"),
+                alarm_description=f"SuccessfulRequestLatency p99 SLO from {name}",
+            )
+            throttles_alarm = cloudwatch.Alarm(
+                scope=self,
+                metric=throttled,
+                id=f"{name}_throttles",
+                evaluation_periods=1,
+                threshold=dynamodb["throttles"],
+                comparison_operator=(
+                    cloudwatch.ComparisonOperator.GREATER_THAN_OR_EQUAL_TO_THRESHOLD
+                ),
+                treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,
+                actions_enabled=True,
+                alarm_name=build_name("alarm", f"dynamodb_throttles_{name}"),
+                alarm_description=f"ThrottledRequests from {name}",
+            )
+            for alarm in [latency_alarm, throttles_alarm]:
+                alarm.add_alarm_action(cloudwatch_actions.SnsAction(infra.sns_topic))
+            self.table_alarms.extend([latency_alarm, throttles_alarm])
+            self.dashboard.add_widgets(
+                cloudwatch.GraphWidget(
+                    title=f"{name} latency p99",
+                    left=list(latency.values()),
+                    left_annotations=[
+                        cloudwatch.HorizontalAnnotation(
+                            value=dynamodb["latency_p99_ms"],
+                            label="p99 SLO",
+                        ),
+                    ],
+                    width=12,
+                ),
+                cloudwatch.GraphWidget(
+                    title=f"{name} throttled requests",
+                    left=[throttled],
+                    width=8,
+                ),
+                cloudwatch.AlarmStatusWidget(
+                    title=f"{name} alarms",
+                    alarms=[latency_alarm, throttles_alarm],
+                    width=4,
+                ),
+            )
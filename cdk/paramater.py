@@ -1,4 +1,5 @@
 from pathlib import Path
+from typing import Any
 
 import tomllib
 
@@ -6,32 +7,239 @@ with (Path.cwd() / "pyproject.toml").open("rb") as f:
     project = tomllib.load(f)["project"]["name"]
 
 
-paramater = {
+paramater: dict[str, Any] = {
+    # memory_size / architecture は tools.power_tuning の計測結果から決める
     "lambda": {
         "create_pool": {
             "env": {
                 "LOG_LEVEL": "INFO",
+                "SNAPSHOT_COMPRESS": "false",
+                "SNAPSHOT_COMPRESS_MIN_BYTES": str(2**20),
+                "TENANT_RATE_LIMIT": "1",
+                "TENANT_BURST": "5",
+                "TENANT_MAX_ITEMS": "100000",
+                "POOL_TTL_SECONDS": "0",
+                "IDEMPOTENCY_TTL_SECONDS": "3600",
+                "LOG_PAYLOAD_SAMPLE_RATE": "0.01",
             },
             "memory_size": 128,
+            "architecture": "x86_64",
+            "provisioned_concurrency": 0,
         },
         "list_pool": {
             "env": {
                 "LOG_LEVEL": "INFO",
+                "TENANT_RATE_LIMIT": "10",
+                "TENANT_BURST": "20",
             },
             "memory_size": 128,
+            "architecture": "x86_64",
+            "provisioned_concurrency": 0,
         },
         "delete_pool": {
             "env": {
                 "LOG_LEVEL": "INFO",
+                "IDEMPOTENCY_TTL_SECONDS": "3600",
             },
             "memory_size": 128,
+            "architecture": "x86_64",
+            "provisioned_concurrency": 0,
         },
         "dice": {
             "env": {
                 "LOG_LEVEL": "INFO",
+                "HOT_POOLS": "",
+                "CACHE_TTL_SECONDS": "60",
+                "CACHE_MAX_BYTES": str(16 * 2**20),
+                "TENANT_RATE_LIMIT": "50",
+                "TENANT_BURST": "100",
+                "ACCESS_TOUCH_SECONDS": "3600",
             },
             "memory_size": 128,
+            "architecture": "x86_64",
+            "provisioned_concurrency": 0,
         },
+        "stats": {
+            "env": {
+                "LOG_LEVEL": "INFO",
+            },
+            "memory_size": 128,
+            "architecture": "x86_64",
+            "provisioned_concurrency": 0,
+        },
+        "simulate": {
+            "env": {
+                "LOG_LEVEL": "INFO",
+                "MAX_TRIALS": "1000000000",
+                "TRIALS_PER_INVOCATION": "50000000",
+                "MAX_SAMPLES": "100",
+                "CACHE_TTL_SECONDS": "60",
+            },
+            "memory_size": 1024,
+            "architecture": "x86_64",
+            "function_layer": True,
+            "slo": {
+                "duration_p95_ms": 10000,
+                "duration_p99_ms": 20000,
+            },
+            "provisioned_concurrency": 0,
+            "timeout": 29,
+        },
+        "compound_dice": {
+            "env": {
+                "LOG_LEVEL": "INFO",
+                "MAX_ROLLS": "100",
+                "TENANT_RATE_LIMIT": "20",
+                "TENANT_BURST": "40",
+            },
+            "memory_size": 128,
+            "architecture": "x86_64",
+            "provisioned_concurrency": 0,
+        },
+        "stream_processor": {
+            "env": {
+                "LOG_LEVEL": "INFO",
+            },
+            "memory_size": 128,
+            "architecture": "x86_64",
+            "provisioned_concurrency": 0,
+            "stream": {
+                "batch_size": 100,
+                "max_batching_window_seconds": 1,
+                "retry_attempts": 10,
+            },
+        },
+        "archiver": {
+            "env": {
+                "LOG_LEVEL": "INFO",
+                "ARCHIVE_AFTER_SECONDS": str(30 * 24 * 60 * 60),
+            },
+            "memory_size": 512,
+            "architecture": "x86_64",
+            "provisioned_concurrency": 0,
+            "timeout": 900,
+            "slo": {
+                "duration_p95_ms": 600000,
+                "duration_p99_ms": 840000,
+            },
+            "schedule": "rate(1 day)",
+            "archive_transition_days": 30,
+        },
+        "session": {
+            "env": {
+                "LOG_LEVEL": "INFO",
+                "CONNECTION_TTL_SECONDS": str(2 * 60 * 60),
+                "BROADCAST_BATCH_SIZE": "100",
+                "BROADCAST_CONCURRENCY": "16",
+            },
+            "memory_size": 256,
+            "architecture": "x86_64",
+            "provisioned_concurrency": 0,
+            "stage_name": "v1",
+        },
+        "router": {
+            "env": {
+                "LOG_LEVEL": "INFO",
+            },
+            "memory_size": 256,
+            "architecture": "x86_64",
+            "provisioned_concurrency": 0,
+            "bundle_app": True,
+        },
+        # front_door の HTTP API のオーソライザー.
+        # 結果は identity_source (ヘッダの値) ごとに保持される
+        "origin_verify": {
+            "env": {
+                "LOG_LEVEL": "INFO",
+            },
+            "memory_size": 128,
+            "architecture": "x86_64",
+            "provisioned_concurrency": 0,
+            "authorizer_ttl_seconds": 300,
+        },
+    },
+    # routes の関数へのリクエストを 1 つの router 関数で受け, 初期化と接続を共有する
+    # 各関数は他からの呼び出しのため残し, API のメソッドだけを router に向ける
+    "router": {
+        "enabled": False,
+        "routes": ["create_pool", "list_pool", "delete_pool", "dice"],
+    },
+    # 読み取り系メソッドのステージキャッシュ. キーは "/<リソースパス>/<メソッド>"
+    # create_pool / delete_pool は書き込み後に該当するキャッシュキーを取り直す
+    # キャッシュクラスタは稼働時間で課金されるため, 必要な環境でのみ有効にする
+    "api_cache": {
+        "enabled": False,
+        "cluster_size": "0.5",
+        "methods": {
+            "/pools/GET": {
+                "ttl_seconds": 300,
+                "cache_keys": [
+                    "method.request.header.X-Tenant-Id",
+                    "method.request.querystring.versions",
+                ],
+            },
+            "/pools/{pool_name}/stats/GET": {
+                "ttl_seconds": 30,
+                "cache_keys": [
+                    "method.request.path.pool_name",
+                    "method.request.header.X-Tenant-Id",
+                ],
+            },
+        },
+    },
+    # True にした読み取りは Lambda を介さず API Gateway から DynamoDB を直接呼び出す
+    "direct_integration": {
+        "list_pool": False,
+    },
+    # CloudFront 経由の読み取り. スナップショットは版数付きの URL で配信する
+    "edge": {
+        "enabled": False,
+        "catalog": {
+            "default_ttl_seconds": 60,
+            "max_ttl_seconds": 300,
+        },
+        "snapshot": {
+            "ttl_days": 365,
+        },
+    },
+    # REST API の代わりに使う入口. 有効にすると REST API と並べて作成する
+    "front_door": {
+        "http_api": False,
+        "function_url": False,
+        "rest_api_data_trace": True,
+    },
+    # LambdaConstruct / MonitoringConstruct が作るアラームの閾値
+    # 関数ごとの上書きは paramater["lambda"][<関数>]["slo"] に書く
+    "monitoring": {
+        "period_minutes": 5,
+        "evaluation_periods": 3,
+        "lambda": {
+            "duration_p95_ms": 1000,
+            "duration_p99_ms": 3000,
+            "init_duration_p99_ms": 2000,
+            "throttles": 1,
+        },
+        "dynamodb": {
+            # 各関数が実際に呼ぶ操作. dice の UpdateItem, compound_dice の
+            # BatchGetItem, list_pool の Scan もホットパスに含まれる
+            "operations": [
+                "GET_ITEM",
+                "QUERY",
+                "PUT_ITEM",
+                "BATCH_WRITE_ITEM",
+                "UPDATE_ITEM",
+                "BATCH_GET_ITEM",
+                "SCAN",
+            ],
+            "latency_p99_ms": 50,
+            "throttles": 1,
+        },
+    },
+    # CloudFront などの正規の経路だけが付けるヘッダ. 値は Secrets Manager で生成する
+    # REST API の WAF は, IP アドレスの許可リストに加えてこのヘッダを持つ要求を通す
+    "origin_verify": {
+        "header": "X-Origin-Verify",
+        "priority": 90,
     },
     "waf": {
         "common": {
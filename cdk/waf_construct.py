@@ -1,5 +1,6 @@
 from typing import Any, Self
 
+from aws_cdk import aws_secretsmanager as secretsmanager
 from aws_cdk import aws_wafv2 as wafv2
 from constructs import Construct
 
@@ -11,6 +12,7 @@ class WafConstruct(Construct):
         self: Self,
         scope: Construct,
         construct_id: str,
+        origin_secret: secretsmanager.ISecret | None = None,
         **kwargs: Any,  # noqa: ANN401
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
@@ -24,26 +26,45 @@ class WafConstruct(Construct):
             name=build_name("ipset", construct_id),
         )
 
-        self.webacl = wafv2.CfnWebACL(
-            scope_=self,
-            id="webacl",
-            default_action=wafv2.CfnWebACL.DefaultActionProperty(
-                block=wafv2.CfnWebACL.BlockActionProperty(),
-            ),
-            scope=paramater["waf"][construct_id]["scope"],
-            visibility_config=wafv2.CfnWebACL.VisibilityConfigProperty(
-                cloud_watch_metrics_enabled=True,
-                metric_name=paramater["waf"]["common"]["metric_name"],
-                sampled_requests_enabled=True,
+        rules = [
+            wafv2.CfnWebACL.RuleProperty(
+                name=build_name("rule", construct_id),
+                priority=paramater["waf"]["common"]["priority"],
+                statement=wafv2.CfnWebACL.StatementProperty(
+                    ip_set_reference_statement=wafv2.CfnWebACL.IPSetReferenceStatementProperty(
+                        arn=self.ipset.attr_arn,
+                    ),
+                ),
+                visibility_config=wafv2.CfnWebACL.VisibilityConfigProperty(
+                    cloud_watch_metrics_enabled=True,
+                    metric_name=paramater["waf"]["common"]["metric_name"],
+                    sampled_requests_enabled=True,
+                ),
+                action=wafv2.CfnWebACL.RuleActionProperty(
+                    allow=wafv2.CfnWebACL.AllowActionProperty(),
+                ),
             ),
-            name=build_name("webacl", construct_id),
-            rules=[
+        ]
+        # CloudFront の IP アドレスは許可リストに載らないため, 正規の経路はヘッダで通す
+        if origin_secret is not None:
+            origin_verify = paramater["origin_verify"]
+            rules.append(
                 wafv2.CfnWebACL.RuleProperty(
-                    name=build_name("rule", construct_id),
-                    priority=paramater["waf"]["common"]["priority"],
+                    name=build_name("rule", f"{construct_id}_origin_verify"),
+                    priority=origin_verify["priority"],
                     statement=wafv2.CfnWebACL.StatementProperty(
-                        ip_set_reference_statement=wafv2.CfnWebACL.IPSetReferenceStatementProperty(
-                            arn=self.ipset.attr_arn,
+                        byte_match_statement=wafv2.CfnWebACL.ByteMatchStatementProperty(
+                            field_to_match=wafv2.CfnWebACL.FieldToMatchProperty(
+                                single_header={"Name": origin_verify["header"].lower()},
+                            ),
+                            positional_constraint="EXACTLY",
+                            search_string=origin_secret.secret_value.unsafe_unwrap(),
+                            text_transformations=[
+                                wafv2.CfnWebACL.TextTransformationProperty(
+                                    priority=0,
+                                    type="NONE",
+                                ),
+                            ],
                         ),
                     ),
                     visibility_config=wafv2.CfnWebACL.VisibilityConfigProperty(
@@ -55,5 +76,20 @@ class WafConstruct(Construct):
                         allow=wafv2.CfnWebACL.AllowActionProperty(),
                     ),
                 ),
-            ],
+            )
+
+        self.webacl = wafv2.CfnWebACL(
+            scope_=self,
+            id="webacl",
+            default_action=wafv2.CfnWebACL.DefaultActionProperty(
+                block=wafv2.CfnWebACL.BlockActionProperty(),
+            ),
+            scope=paramater["waf"][construct_id]["scope"],
+            visibility_config=wafv2.CfnWebACL.VisibilityConfigProperty(
+                cloud_watch_metrics_enabled=True,
+                metric_name=paramater["waf"]["common"]["metric_name"],
+                sampled_requests_enabled=True,
+            ),
+            name=build_name("webacl", construct_id),
+            rules=rules,
         )
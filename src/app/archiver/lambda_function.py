@@ -0,0 +1,377 @@
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, NamedTuple
+
+import boto3
+import botocore
+from aws_lambda_powertools.logging import Logger
+from aws_lambda_powertools.utilities.typing import LambdaContext
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.config import Config
+from common import (
+    THROTTLING_ERROR_CODES,
+    ServerError,
+    ThrottlingError,
+    build_snapshot,
+    display_name,
+    log_exception,
+)
+from mypy_boto3_dynamodb import DynamoDBClient, DynamoDBServiceResource
+from mypy_boto3_dynamodb.type_defs import TransactWriteItemTypeDef
+from mypy_boto3_s3 import S3Client
+from profiler import profiled
+
+try:
+    # SnapStart 環境でのみ提供されるランタイムフック
+    import snapshot_restore_py
+except ImportError:
+    snapshot_restore_py = None
+
+logger = Logger()
+# adaptive モード: リトライ枠 (トークンバケット) とクライアント側のレート制限
+boto_config = Config(
+    retries={
+        "mode": "adaptive",
+        "max_attempts": int(os.environ.get("DYNAMODB_MAX_ATTEMPTS", "3")),
+    },
+)
+dynamodb_client = boto3.client("dynamodb", config=boto_config)
+dynamodb_resource = boto3.resource("dynamodb", config=boto_config)
+s3_client = boto3.client("s3", config=boto_config)
+
+ARCHIVE_PREFIX = "archive"
+# 1 トランザクションの上限 (100) から, プールの世代の確認分を除いた削除件数
+TRANSACT_DELETE_ITEMS = 99
+
+# DynamoDB の TTL 属性など, 退避先に含めない内部用の属性
+INTERNAL_ATTRIBUTES = ("expire_at", "content_hash")
+
+
+class EnvParam(NamedTuple):
+    POOL_TABLE_NAME: str
+    ITEM_TABLE_NAME: str
+
+    @classmethod
+    def from_env(cls: type["EnvParam"]) -> "EnvParam":
+        try:
+            return EnvParam(**{k: os.environ[k] for k in EnvParam._fields})
+        except Exception as e:
+            raise ServerError(
+                json.dumps(os.environ),
+                "Required environment variables are not set.",
+            ) from e
+
+
+class ArchiveParam(NamedTuple):
+    ARCHIVE_AFTER_SECONDS: int
+    SNAPSHOT_BUCKET_NAME: str
+    SNAPSHOT_DIR: str
+
+    @classmethod
+    def from_env(cls: type["ArchiveParam"]) -> "ArchiveParam":
+        return ArchiveParam(
+            ARCHIVE_AFTER_SECONDS=int(
+                os.environ.get("ARCHIVE_AFTER_SECONDS", str(30 * 24 * 60 * 60)),
+            ),
+            SNAPSHOT_BUCKET_NAME=os.environ.get("SNAPSHOT_BUCKET_NAME", ""),
+            SNAPSHOT_DIR=os.environ.get("SNAPSHOT_DIR", ""),
+        )
+
+
+def scan_stale_pools(
+    db_resource: DynamoDBServiceResource,
+    table_name: str,
+    threshold: int,
+) -> list[dict[str, Any]]:
+    # 最終参照時刻を持たない (記録前に作られた) プールは対象にしない
+    table = db_resource.Table(table_name)
+    kwargs: dict[str, Any] = {
+        "FilterExpression": Attr("last_accessed_at").lt(threshold)
+        & Attr("archived").not_exists(),
+    }
+    pools: list[dict[str, Any]] = []
+    try:
+        while True:
+            response = table.scan(**kwargs)
+            pools.extend(response["Items"])
+            if "LastEvaluatedKey" not in response:
+                return pools
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    except botocore.exceptions.ClientError as error:
+        if error.response["Error"]["Code"] in THROTTLING_ERROR_CODES:
+            raise ThrottlingError(
+                table_name,
+                error.response["Error"]["Message"],
+            ) from error
+        else:
+            raise ServerError(
+                table_name,
+                error.response["Error"]["Message"],
+            ) from error
+
+
+def query_pool_items(
+    db_resource: DynamoDBServiceResource,
+    table_name: str,
+    pool_name: str,
+) -> list[dict[str, Any]]:
+    table = db_resource.Table(table_name)
+    kwargs: dict[str, Any] = {"KeyConditionExpression": Key("pool_name").eq(pool_name)}
+    items: list[dict[str, Any]] = []
+    try:
+        while True:
+            response = table.query(**kwargs)
+            items.extend(response["Items"])
+            if "LastEvaluatedKey" not in response:
+                return items
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    except botocore.exceptions.ClientError as error:
+        if error.response["Error"]["Code"] in THROTTLING_ERROR_CODES:
+            raise ThrottlingError(
+                pool_name,
+                error.response["Error"]["Message"],
+            ) from error
+        else:
+            raise ServerError(
+                pool_name,
+                error.response["Error"]["Message"],
+            ) from error
+
+
+def put_archive(
+    client: S3Client,
+    param: ArchiveParam,
+    pool_name: str,
+    data: bytes,
+) -> None:
+    # 退避先が唯一の複製となるため, スナップショットと異なり失敗は処理を止める
+    key = f"{ARCHIVE_PREFIX}/{pool_name}.snapshot"
+    try:
+        if param.SNAPSHOT_BUCKET_NAME:
+            client.put_object(Bucket=param.SNAPSHOT_BUCKET_NAME, Key=key, Body=data)
+        elif param.SNAPSHOT_DIR:
+            path = Path(param.SNAPSHOT_DIR) / key
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(".tmp")
+            tmp.write_bytes(data)
+            tmp.replace(path)
+        else:
+            raise ServerError(key, "archive storage is not configured")
+    except (botocore.exceptions.ClientError, OSError) as error:
+        raise ServerError(key, str(error)) from error
+
+
+def mark_archived(
+    db_resource: DynamoDBServiceResource,
+    table_name: str,
+    pool: dict[str, Any],
+) -> int | None:
+    # 退避中に参照されたプールはアイテムを消さずに残す
+    table = db_resource.Table(table_name)
+    try:
+        response = table.update_item(
+            Key={"pool_name": pool["pool_name"]},
+            UpdateExpression=(
+                "SET archived = :true,"
+                " archive_generation = if_not_exists(archive_generation, :zero) + :one"
+            ),
+            ConditionExpression=(
+                "last_accessed_at = :seen AND attribute_not_exists(archived)"
+            ),
+            ExpressionAttributeValues={
+                ":true": True,
+                ":seen": pool["last_accessed_at"],
+                ":zero": 0,
+                ":one": 1,
+            },
+            ReturnValues="UPDATED_NEW",
+        )
+    except botocore.exceptions.ClientError as error:
+        if error.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return None
+        elif error.response["Error"]["Code"] in THROTTLING_ERROR_CODES:
+            raise ThrottlingError(
+                pool["pool_name"],
+                error.response["Error"]["Message"],
+            ) from error
+        else:
+            raise ServerError(
+                pool["pool_name"],
+                error.response["Error"]["Message"],
+            ) from error
+    return int(str(response["Attributes"]["archive_generation"]))
+
+
+def delete_archived_items(
+    db_client: DynamoDBClient,
+    env: EnvParam,
+    pool_name: str,
+    generation: int,
+    item_ids: list[int],
+) -> bool:
+    # 書き戻しは書き込みの前に世代を進めるため, 同じ世代の退避が続いている間だけ消す
+    condition: TransactWriteItemTypeDef = {
+        "ConditionCheck": {
+            "TableName": env.POOL_TABLE_NAME,
+            "Key": {"pool_name": {"S": pool_name}},
+            "ConditionExpression": (
+                "archived = :true AND archive_generation = :generation"
+            ),
+            "ExpressionAttributeValues": {
+                ":true": {"BOOL": True},
+                ":generation": {"N": str(generation)},
+            },
+        },
+    }
+    for start in range(0, len(item_ids), TRANSACT_DELETE_ITEMS):
+        try:
+            db_client.transact_write_items(
+                TransactItems=[
+                    condition,
+                    *[
+                        TransactWriteItemTypeDef(
+                            Delete={
+                                "TableName": env.ITEM_TABLE_NAME,
+                                "Key": {
+                                    "pool_name": {"S": pool_name},
+                                    "item_id": {"N": str(x)},
+                                },
+                            },
+                        )
+                        for x in item_ids[start : start + TRANSACT_DELETE_ITEMS]
+                    ],
+                ],
+            )
+        except botocore.exceptions.ClientError as error:
+            # 先頭は世代の確認. 書き戻しと競合したときは次の参照で書き戻される
+            codes = [
+                x.get("Code") for x in error.response.get("CancellationReasons", [])
+            ]
+            if codes[:1] == ["ConditionalCheckFailed"]:
+                return False
+            elif (
+                error.response["Error"]["Code"] in THROTTLING_ERROR_CODES
+                or "TransactionConflict" in codes
+            ):
+                raise ThrottlingError(
+                    pool_name,
+                    error.response["Error"]["Message"],
+                ) from error
+            else:
+                raise ServerError(
+                    pool_name,
+                    error.response["Error"]["Message"],
+                ) from error
+    return True
+
+
+def archive_pool(  # noqa: PLR0913
+    db_client: DynamoDBClient,
+    db_resource: DynamoDBServiceResource,
+    s3: S3Client,
+    env: EnvParam,
+    param: ArchiveParam,
+    pool: dict[str, Any],
+) -> bool:
+    pool_name = pool["pool_name"]
+    items = query_pool_items(
+        db_resource=db_resource,
+        table_name=env.ITEM_TABLE_NAME,
+        pool_name=pool_name,
+    )
+    items.sort(key=lambda x: int(x["item_id"]))
+    put_archive(
+        client=s3,
+        param=param,
+        pool_name=pool_name,
+        # 読み出しは稀なため, 常に圧縮して保存容量を抑える
+        data=build_snapshot(
+            [
+                {k: v for k, v in x.items() if k not in INTERNAL_ATTRIBUTES}
+                | {"pool_name": display_name(pool_name)}
+                for x in items
+            ],
+            compress=True,
+        ),
+    )
+    generation = mark_archived(db_resource, env.POOL_TABLE_NAME, pool)
+    if generation is None:
+        return False
+    return delete_archived_items(
+        db_client=db_client,
+        env=env,
+        pool_name=pool_name,
+        generation=generation,
+        item_ids=[int(x["item_id"]) for x in items],
+    )
+
+
+def service(  # noqa: PLR0913
+    db_client: DynamoDBClient,
+    db_resource: DynamoDBServiceResource,
+    s3: S3Client,
+    env: EnvParam,
+    param: ArchiveParam,
+    now: int,
+) -> list[str]:
+    archived: list[str] = []
+    pools = scan_stale_pools(
+        db_resource=db_resource,
+        table_name=env.POOL_TABLE_NAME,
+        threshold=now - param.ARCHIVE_AFTER_SECONDS,
+    )
+    for pool in pools:
+        # 1 プールの失敗で他のプールの退避を止めない. 次回の実行で再度対象となる
+        try:
+            if archive_pool(db_client, db_resource, s3, env, param, pool):
+                archived.append(pool["pool_name"])
+        except ThrottlingError:
+            log_exception(logger, logging.WARNING, "throttled")
+        except Exception:
+            log_exception(logger, logging.ERROR, "unexpected error")
+    return archived
+
+
+@profiled(logger)
+@logger.inject_lambda_context
+def lambda_handler(event: dict[str, Any], context: LambdaContext) -> dict[str, Any]:
+    archived = service(
+        db_client=dynamodb_client,
+        db_resource=dynamodb_resource,
+        s3=s3_client,
+        env=EnvParam.from_env(),
+        param=ArchiveParam.from_env(),
+        now=int(time.time()),
+    )
+    logger.info({"archived": archived})
+    return {"archived": archived}
+
+
+def warm_up() -> None:
+    # 認証情報の取得と TLS 接続の確立を初期化フェーズで済ませておく
+    try:
+        dynamodb_resource.Table(EnvParam.from_env().POOL_TABLE_NAME).get_item(
+            Key={"pool_name": "__warm_up__"},
+        )
+    except Exception:
+        log_exception(logger, logging.WARNING, "warm_up failed")
+
+
+def after_restore() -> None:
+    # スナップショットから復元されたインスタンス間で接続を共有しないようにする
+    global dynamodb_client, dynamodb_resource, s3_client  # noqa: PLW0603
+    dynamodb_client = boto3.client("dynamodb", config=boto_config)
+    dynamodb_resource = boto3.resource("dynamodb", config=boto_config)
+    s3_client = boto3.client("s3", config=boto_config)
+    warm_up()
+
+
+if os.environ.get("AWS_LAMBDA_INITIALIZATION_TYPE") == "provisioned-concurrency":
+    warm_up()
+
+if snapshot_restore_py is not None:
+    snapshot_restore_py.register_before_snapshot(warm_up)
+    snapshot_restore_py.register_after_restore(after_restore)
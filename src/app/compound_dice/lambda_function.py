@@ -0,0 +1,403 @@
+import json
+import logging
+import os
+import random
+import re
+import time
+from collections import Counter
+from typing import Any, NamedTuple, Self
+
+import boto3
+import botocore
+from aws_lambda_powertools.logging import Logger
+from aws_lambda_powertools.utilities.typing import LambdaContext
+from botocore.config import Config
+from common import (
+    TENANT_SEPARATOR,
+    THROTTLING_ERROR_CODES,
+    ClientError,
+    ServerError,
+    TenantLimiter,
+    ThrottlingError,
+    decimal_default_proc,
+    log_exception,
+    rehydrate_pool,
+    rest_event,
+    storage_name,
+    tenant_from_event,
+)
+from mypy_boto3_dynamodb import DynamoDBServiceResource
+from profiler import profiled
+
+try:
+    # SnapStart 環境でのみ提供されるランタイムフック
+    import snapshot_restore_py
+except ImportError:
+    snapshot_restore_py = None
+
+logger = Logger()
+# adaptive モード: リトライ枠 (トークンバケット) とクライアント側のレート制限
+boto_config = Config(
+    retries={
+        "mode": "adaptive",
+        "max_attempts": int(os.environ.get("DYNAMODB_MAX_ATTEMPTS", "3")),
+    },
+)
+dynamodb_resource = boto3.resource("dynamodb", config=boto_config)
+lambda_client = boto3.client("lambda")
+
+# BatchGetItem 1 回あたりのキー数の上限
+BATCH_GET_LIMIT = 100
+# UnprocessedKeys を再送する回数の上限
+BATCH_GET_MAX_ATTEMPTS = 5
+
+# DynamoDB の TTL 属性など, レスポンスに含めない内部用の属性
+INTERNAL_ATTRIBUTES = ("expire_at", "content_hash")
+# HTTP API / 関数 URL で受けるリソースパス
+ROUTE_PATTERN = re.compile(r"/dice$")
+
+
+class EnvParam(NamedTuple):
+    POOL_TABLE_NAME: str
+    ITEM_TABLE_NAME: str
+    STATS_TABLE_NAME: str
+
+    @classmethod
+    def from_env(cls: type["EnvParam"]) -> "EnvParam":
+        try:
+            return EnvParam(**{k: os.environ[k] for k in EnvParam._fields})
+        except Exception as e:
+            raise ServerError(
+                json.dumps(os.environ),
+                "Required environment variables are not set.",
+            ) from e
+
+
+class ArchiveParam(NamedTuple):
+    # 退避済みプールの書き戻しを依頼する関数. 空のときは書き戻さない
+    DICE_FUNCTION_NAME: str
+
+    @classmethod
+    def from_env(cls: type["ArchiveParam"]) -> "ArchiveParam":
+        return ArchiveParam(
+            DICE_FUNCTION_NAME=os.environ.get("DICE_FUNCTION_NAME", ""),
+        )
+
+
+class TenantParam(NamedTuple):
+    TENANT_HEADER: str
+    TENANT_RATE_LIMIT: float
+    TENANT_BURST: float
+
+    @classmethod
+    def from_env(cls: type["TenantParam"]) -> "TenantParam":
+        return TenantParam(
+            TENANT_HEADER=os.environ.get("TENANT_HEADER", "X-Tenant-Id"),
+            TENANT_RATE_LIMIT=float(os.environ.get("TENANT_RATE_LIMIT", "0")),
+            TENANT_BURST=float(os.environ.get("TENANT_BURST", "10")),
+        )
+
+
+tenant_limiter = TenantLimiter()
+
+
+class Roll(NamedTuple):
+    pool_name: str
+    times: int
+
+
+class ApiEvent(NamedTuple):
+    tenant_id: str
+    rolls: list[Roll]
+
+    @classmethod
+    def from_event(cls: type["ApiEvent"], event: dict[str, Any]) -> "ApiEvent":
+        event = rest_event(event, ROUTE_PATTERN)
+        try:
+            body = json.loads(event["body"])
+            rolls = [
+                Roll(pool_name=str(x["pool_name"]), times=int(x.get("count", 1)))
+                for x in body["rolls"]
+            ]
+        except Exception as e:
+            raise ClientError(event["body"], "Invalid parameter.") from e
+        max_rolls = int(os.environ.get("MAX_ROLLS", "100"))
+        if (
+            len(rolls) == 0
+            or any(x.times <= 0 for x in rolls)
+            or sum(x.times for x in rolls) > max_rolls
+            or any(TENANT_SEPARATOR in x.pool_name for x in rolls)
+        ):
+            raise ClientError(event["body"], "Invalid parameter.")
+        return ApiEvent(
+            tenant_id=tenant_from_event(event, TenantParam.from_env().TENANT_HEADER),
+            rolls=rolls,
+        )
+
+
+def batch_get_items(
+    db_resource: DynamoDBServiceResource,
+    table_name: str,
+    keys: list[dict[str, Any]],
+) -> list[dict[str, Any]]:
+    # 重複キーは BatchGetItem でエラーになるため呼び出し側で除いておくこと
+    items: list[dict[str, Any]] = []
+    try:
+        for start in range(0, len(keys), BATCH_GET_LIMIT):
+            request: dict[str, Any] = {
+                table_name: {"Keys": keys[start : start + BATCH_GET_LIMIT]},
+            }
+            for attempt in range(BATCH_GET_MAX_ATTEMPTS):
+                response = db_resource.batch_get_item(RequestItems=request)
+                items.extend(response["Responses"].get(table_name, []))
+                request = response.get("UnprocessedKeys") or {}
+                if not request:
+                    break
+                time.sleep(0.05 * 2**attempt)
+            if request:
+                raise ThrottlingError(
+                    json.dumps(request, default=str),
+                    "BatchGetItem keys remain unprocessed",
+                )
+    except botocore.exceptions.ClientError as error:
+        if error.response["Error"]["Code"] == "InternalServerError":
+            raise ServerError(
+                table_name,
+                error.response["Error"]["Message"],
+            ) from error
+        elif error.response["Error"]["Code"] in THROTTLING_ERROR_CODES:
+            raise ThrottlingError(
+                table_name,
+                error.response["Error"]["Message"],
+            ) from error
+        else:
+            raise ClientError(
+                table_name,
+                error.response["Error"]["Message"],
+            ) from error
+    return items
+
+
+def record_rolls(
+    db_resource: DynamoDBServiceResource,
+    table_name: str,
+    rolls: Counter[tuple[str, int]],
+) -> None:
+    # 出目の集計は結果の返却を妨げないよう, 失敗しても警告に留める
+    table = db_resource.Table(table_name)
+    for (pool_name, item_id), count in rolls.items():
+        try:
+            table.update_item(
+                Key={"pool_name": pool_name, "item_id": item_id},
+                UpdateExpression="ADD roll_count :count",
+                ExpressionAttributeValues={":count": count},
+            )
+        except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError):
+            log_exception(logger, logging.WARNING, "record_rolls failed")
+
+
+def dispatch_rolls(
+    db_resource: DynamoDBServiceResource,
+    env: EnvParam,
+    function_arn: str,
+    rolls: Counter[tuple[str, int]],
+) -> None:
+    # アイテムごとの UpdateItem はレスポンスを待たせないよう自身の非同期呼び出しに回す
+    # ARN が無い (ローカル実行) ときだけその場で集計する
+    if not function_arn:
+        record_rolls(db_resource, env.STATS_TABLE_NAME, rolls)
+        return
+    try:
+        lambda_client.invoke(
+            FunctionName=function_arn,
+            InvocationType="Event",
+            Payload=json.dumps(
+                {"record_rolls": [[p, i, c] for (p, i), c in rolls.items()]},
+            ).encode(),
+        )
+    except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError):
+        log_exception(logger, logging.WARNING, "dispatch_rolls failed")
+
+
+def public_item(item: dict[str, Any]) -> dict[str, Any]:
+    return {k: v for k, v in item.items() if k not in INTERNAL_ATTRIBUTES}
+
+
+class Response(NamedTuple):
+    status_code: int
+    message: str | list[dict]
+    retry_after: int | None = None
+
+    def data(self: Self) -> dict[str, Any]:
+        headers: dict[str, Any] = {
+            "Content-Type": "application/json",
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "GET, POST, DELETE",
+            "Access-Control-Allow-Credentials": True,
+            "Access-Control-Allow-Headers": "origin, x-requested-with",
+        }
+        if self.retry_after is not None:
+            headers["Retry-After"] = str(self.retry_after)
+        return {
+            "statusCode": self.status_code,
+            "headers": headers,
+            "body": json.dumps(
+                {
+                    "message": self.message,
+                },
+                default=decimal_default_proc,
+            ),
+            "isBase64Encoded": False,
+        }
+
+
+def service(
+    body: ApiEvent,
+    db_resource: DynamoDBServiceResource,
+    env: EnvParam,
+    archive_param: ArchiveParam,
+    function_arn: str = "",
+) -> Response:
+    # 1 往復目: 全プールのメタデータ
+    names = {x.pool_name: storage_name(body.tenant_id, x.pool_name) for x in body.rolls}
+    rows = batch_get_items(
+        db_resource=db_resource,
+        table_name=env.POOL_TABLE_NAME,
+        keys=[{"pool_name": x} for x in names.values()],
+    )
+    pools = {x["pool_name"]: int(x["num_item"]) for x in rows}
+    for row in rows:
+        if row.get("archived", False):
+            rehydrate_pool(
+                lambda_client,
+                archive_param.DICE_FUNCTION_NAME,
+                row["pool_name"],
+            )
+    for pool_name, name in names.items():
+        if pools.get(name, 0) <= 0:
+            raise ClientError(
+                input_param=name,
+                message=f"pool_name is empty: {pool_name}",
+            )
+    # 2 往復目: 抽選された全アイテム
+    chosen = [
+        (
+            roll.pool_name,
+            [random.randrange(pools[names[roll.pool_name]]) for _ in range(roll.times)],
+        )
+        for roll in body.rolls
+    ]
+    keys = list(
+        dict.fromkeys(
+            (names[pool_name], item_id) for pool_name, ids in chosen for item_id in ids
+        ),
+    )
+    items = {
+        (x["pool_name"], int(x["item_id"])): x
+        for x in batch_get_items(
+            db_resource=db_resource,
+            table_name=env.ITEM_TABLE_NAME,
+            keys=[{"pool_name": p, "item_id": i} for p, i in keys],
+        )
+    }
+    for key in keys:
+        if key not in items:
+            raise ServerError(
+                input_param=json.dumps(key),
+                message="item dose not exist",
+            )
+    dispatch_rolls(
+        db_resource=db_resource,
+        env=env,
+        function_arn=function_arn,
+        rolls=Counter((names[p], i) for p, ids in chosen for i in ids),
+    )
+    return Response(
+        status_code=200,
+        message=[
+            {
+                "pool_name": pool_name,
+                "items": [
+                    public_item(items[(names[pool_name], i)]) | {"pool_name": pool_name}
+                    for i in ids
+                ],
+            }
+            for pool_name, ids in chosen
+        ],
+    )
+
+
+@profiled(logger)
+@logger.inject_lambda_context(
+    correlation_id_path="requestContext.requestId",
+)
+def lambda_handler(event: dict[str, Any], context: LambdaContext) -> dict[str, Any]:
+    if "record_rolls" in event:
+        record_rolls(
+            db_resource=dynamodb_resource,
+            table_name=EnvParam.from_env().STATS_TABLE_NAME,
+            rolls=Counter({(p, int(i)): int(c) for p, i, c in event["record_rolls"]}),
+        )
+        return {}
+    try:
+        body = ApiEvent.from_event(event)
+        tenant_limiter.acquire(body.tenant_id, TenantParam.from_env())
+        return service(
+            body=body,
+            db_resource=dynamodb_resource,
+            env=EnvParam.from_env(),
+            archive_param=ArchiveParam.from_env(),
+            function_arn=context.invoked_function_arn,
+        ).data()
+    except ServerError:
+        log_exception(logger, logging.ERROR, "server error")
+        return Response(
+            status_code=500,
+            message="internal server error. Please access again after some time.",
+        ).data()
+    except ThrottlingError:
+        log_exception(logger, logging.WARNING, "throttled")
+        return Response(
+            status_code=429,
+            message="too many requests. Please retry after some time.",
+            retry_after=int(os.environ.get("RETRY_AFTER_SECONDS", "1")),
+        ).data()
+    except ClientError as ce:
+        log_exception(logger, logging.WARNING, "client error")
+        return Response(
+            status_code=400,
+            message=f"client error. {ce.message}",
+        ).data()
+    except Exception:
+        log_exception(logger, logging.ERROR, "unexpected error")
+        return Response(
+            status_code=500,
+            message="internal server error. Please contact the operator.",
+        ).data()
+
+
+def warm_up() -> None:
+    # 認証情報の取得と TLS 接続の確立を初期化フェーズで済ませておく
+    try:
+        dynamodb_resource.Table(EnvParam.from_env().POOL_TABLE_NAME).get_item(
+            Key={"pool_name": "__warm_up__"},
+        )
+    except Exception:
+        log_exception(logger, logging.WARNING, "warm_up failed")
+
+
+def after_restore() -> None:
+    # スナップショットから復元されたインスタンス間で乱数列と接続を共有しないようにする
+    global dynamodb_resource, lambda_client  # noqa: PLW0603
+    random.seed()
+    dynamodb_resource = boto3.resource("dynamodb", config=boto_config)
+    lambda_client = boto3.client("lambda")
+    warm_up()
+
+
+if os.environ.get("AWS_LAMBDA_INITIALIZATION_TYPE") == "provisioned-concurrency":
+    warm_up()
+
+if snapshot_restore_py is not None:
+    snapshot_restore_py.register_before_snapshot(warm_up)
+    snapshot_restore_py.register_after_restore(after_restore)
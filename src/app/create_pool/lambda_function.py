@@ -1,33 +1,92 @@
+import hashlib
 import json
+import logging
 import os
-import traceback
+import random
+import re
+import time
+import urllib.parse
+import urllib.request
+from collections.abc import Callable
+from decimal import Decimal
+from pathlib import Path
 from typing import Any, NamedTuple, Self
 
 import boto3
 import botocore
 from aws_lambda_powertools.logging import Logger
+from aws_lambda_powertools.utilities.idempotency import (
+    DynamoDBPersistenceLayer,
+    IdempotencyConfig,
+    idempotent_function,
+)
+from aws_lambda_powertools.utilities.idempotency.exceptions import (
+    IdempotencyAlreadyInProgressError,
+    IdempotencyValidationError,
+)
 from aws_lambda_powertools.utilities.typing import LambdaContext
+from botocore.config import Config
+from common import (
+    TENANT_SEPARATOR,
+    THROTTLING_ERROR_CODES,
+    ClientError,
+    ServerError,
+    TenantLimiter,
+    ThrottlingError,
+    build_snapshot,
+    decimal_default_proc,
+    log_exception,
+    refresh_cache,
+    rest_event,
+    storage_name,
+    tenant_from_event,
+)
 from mypy_boto3_dynamodb import DynamoDBClient, DynamoDBServiceResource
+from mypy_boto3_s3 import S3Client
+from profiler import profiled
 
-logger = Logger()
-dynamodb_client = boto3.client("dynamodb")
-dynamodb_resource = boto3.resource("dynamodb")
+try:
+    # SnapStart 環境でのみ提供されるランタイムフック
+    import snapshot_restore_py
+except ImportError:
+    snapshot_restore_py = None
 
+logger = Logger()
+# adaptive モード: リトライ枠 (トークンバケット) とクライアント側のレート制限
+boto_config = Config(
+    retries={
+        "mode": "adaptive",
+        "max_attempts": int(os.environ.get("DYNAMODB_MAX_ATTEMPTS", "3")),
+    },
+)
+dynamodb_client = boto3.client("dynamodb", config=boto_config)
+dynamodb_resource = boto3.resource("dynamodb", config=boto_config)
+s3_client = boto3.client("s3", config=boto_config)
 
-class ClientError(Exception):
-    def __init__(self: Self, input_param: str, message: str) -> None:
-        self.message = message
-        super().__init__(f"{message}: {input_param}")
-
+# archiver が退避したプールの置き場所
+ARCHIVE_PREFIX = "archive"
 
-class ServerError(Exception):
-    def __init__(self: Self, input_param: str, message: str) -> None:
-        super().__init__(f"{message}: {input_param}")
+# InfraConstruct で pool テーブルに定義するテナント別の GSI
+TENANT_INDEX_NAME = "tenant_id"
+# DynamoDB の TTL 属性など, レスポンスに含めない内部用の属性
+INTERNAL_ATTRIBUTES = ("expire_at", "content_hash")
+# create_pool が付与するため, アイテムに含めることを許さない属性
+RESERVED_ATTRIBUTES = ("pool_name", "item_id", *INTERNAL_ATTRIBUTES)
+# DynamoDB の項目サイズ, 入れ子の深さ, 数値の有効桁数の上限
+DYNAMODB_ITEM_MAX_BYTES = 400 * 1024
+DYNAMODB_MAX_DEPTH = 32
+DYNAMODB_NUMBER_MAX_DIGITS = 38
+DYNAMODB_NUMBER_MAX_EXPONENT = 125
+DYNAMODB_NUMBER_MIN_EXPONENT = -130
+CONTENT_HASH_BYTES = 16
+# HTTP API / 関数 URL で受けるリソースパス
+ROUTE_PATTERN = re.compile(r"/pools/(?P<pool_name>[^/]+)$")
 
 
 class EnvParam(NamedTuple):
     POOL_TABLE_NAME: str
     ITEM_TABLE_NAME: str
+    STATS_TABLE_NAME: str
 
     @classmethod
     def from_env(cls: type["EnvParam"]) -> "EnvParam":
@@ -40,35 +99,322 @@ class EnvParam(NamedTuple):
             ) from e
 
 
+class LogParam(NamedTuple):
+    # DEBUG 時に本文を出力する呼び出しの割合
+    LOG_PAYLOAD_SAMPLE_RATE: float
+
+    @classmethod
+    def from_env(cls: type["LogParam"]) -> "LogParam":
+        return LogParam(
+            LOG_PAYLOAD_SAMPLE_RATE=float(
+                os.environ.get("LOG_PAYLOAD_SAMPLE_RATE", "1"),
+            ),
+        )
+
+
+class SnapshotParam(NamedTuple):
+    SNAPSHOT_BUCKET_NAME: str
+    SNAPSHOT_DIR: str
+    SNAPSHOT_COMPRESS: bool
+    SNAPSHOT_COMPRESS_MIN_BYTES: int
+
+    @classmethod
+    def from_env(cls: type["SnapshotParam"]) -> "SnapshotParam":
+        return SnapshotParam(
+            SNAPSHOT_BUCKET_NAME=os.environ.get("SNAPSHOT_BUCKET_NAME", ""),
+            SNAPSHOT_DIR=os.environ.get("SNAPSHOT_DIR", ""),
+            SNAPSHOT_COMPRESS=os.environ.get("SNAPSHOT_COMPRESS", "false") == "true",
+            SNAPSHOT_COMPRESS_MIN_BYTES=int(
+                os.environ.get("SNAPSHOT_COMPRESS_MIN_BYTES", str(2**20)),
+            ),
+        )
+
+    def compress(self: Self, total_bytes: int) -> bool:
+        # 小さなプールは展開の手間を省き, 大きなプールは転送量を優先して圧縮する
+        return self.SNAPSHOT_COMPRESS or total_bytes >= self.SNAPSHOT_COMPRESS_MIN_BYTES
+
+
+class TenantParam(NamedTuple):
+    TENANT_HEADER: str
+    TENANT_RATE_LIMIT: float
+    TENANT_BURST: float
+    TENANT_MAX_ITEMS: int
+
+    @classmethod
+    def from_env(cls: type["TenantParam"]) -> "TenantParam":
+        return TenantParam(
+            TENANT_HEADER=os.environ.get("TENANT_HEADER", "X-Tenant-Id"),
+            TENANT_RATE_LIMIT=float(os.environ.get("TENANT_RATE_LIMIT", "0")),
+            TENANT_BURST=float(os.environ.get("TENANT_BURST", "10")),
+            TENANT_MAX_ITEMS=int(os.environ.get("TENANT_MAX_ITEMS", "0")),
+        )
+
+
+tenant_limiter = TenantLimiter()
+
+
+class IdempotencyParam(NamedTuple):
+    IDEMPOTENCY_TABLE_NAME: str
+    IDEMPOTENCY_HEADER: str
+    IDEMPOTENCY_TTL_SECONDS: int
+
+    @classmethod
+    def from_env(cls: type["IdempotencyParam"]) -> "IdempotencyParam":
+        return IdempotencyParam(
+            IDEMPOTENCY_TABLE_NAME=os.environ.get("IDEMPOTENCY_TABLE_NAME", ""),
+            IDEMPOTENCY_HEADER=os.environ.get("IDEMPOTENCY_HEADER", "Idempotency-Key"),
+            IDEMPOTENCY_TTL_SECONDS=int(
+                os.environ.get("IDEMPOTENCY_TTL_SECONDS", "3600"),
+            ),
+        )
+
+
+# 冪等性レコードに保存しない (再試行で結果が変わり得る) ステータスコード
+RETRYABLE_STATUS_CODES = (429, 500)
+
+
+class RetryableResponseError(Exception):
+    # 例外として扱うことで, 冪等性レコードを保存せずに破棄させる
+    def __init__(self: Self, response: dict[str, Any]) -> None:
+        self.response = response
+        super().__init__(response["statusCode"])
+
+
+def header_value(event: dict[str, Any], header: str) -> str | None:
+    headers = {k.lower(): v for k, v in (event.get("headers") or {}).items()}
+    return headers.get(header.lower())
+
+
+# テーブル名ごとに使い回し, 呼び出しのたびにクライアントを作らない
+idempotency_layers: dict[str, DynamoDBPersistenceLayer] = {}
+
+
+def idempotency_layer(table_name: str) -> DynamoDBPersistenceLayer:
+    layer = idempotency_layers.get(table_name)
+    if layer is None:
+        layer = DynamoDBPersistenceLayer(
+            table_name=table_name,
+            boto3_client=dynamodb_client,
+        )
+        idempotency_layers[table_name] = layer
+    return layer
+
+
+def attribute_size(value: Any, depth: int) -> int:  # noqa: ANN401
+    # DynamoDB の項目サイズの算出方法に従い, 型と入れ子の深さも同時に検査する
+    if depth > DYNAMODB_MAX_DEPTH:
+        raise ClientError(str(depth), "item is nested too deeply.")
+    if isinstance(value, str):
+        return len(value.encode())
+    if isinstance(value, bool) or value is None:
+        return 1
+    if isinstance(value, int | Decimal):
+        number = Decimal(value)
+        digits = len(number.normalize().as_tuple().digits)
+        if (
+            not number.is_finite()
+            or digits > DYNAMODB_NUMBER_MAX_DIGITS
+            or number.adjusted() > DYNAMODB_NUMBER_MAX_EXPONENT
+            or (number != 0 and number.adjusted() < DYNAMODB_NUMBER_MIN_EXPONENT)
+        ):
+            raise ClientError(str(value), "Invalid number.")
+        return (digits + 1) // 2 + 1
+    if isinstance(value, list):
+        return 3 + sum(attribute_size(x, depth + 1) + 1 for x in value)
+    if isinstance(value, dict):
+        return 3 + sum(
+            len(str(k).encode()) + attribute_size(v, depth + 1) + 1
+            for k, v in value.items()
+        )
+    raise ClientError(repr(value), "Invalid attribute type.")
+
+
+def validate_items(items: list[Any], reserved_bytes: int) -> int:
+    # 書き込みを始める前に 1 回の走査で全アイテムを検査し, 合計サイズを返す
+    total = 0
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ClientError(str(i), "item must be an object.")
+        size = reserved_bytes
+        for name, value in item.items():
+            if name == "" or name in RESERVED_ATTRIBUTES:
+                raise ClientError(str(i), f"reserved attribute name: {name}")
+            size += len(name.encode()) + attribute_size(value, 1)
+        if size > DYNAMODB_ITEM_MAX_BYTES:
+            raise ClientError(str(i), f"item is too large: {size} bytes")
+        total += size
+    return total
+
+
+def parse_ttl_seconds(value: Any) -> int:  # noqa: ANN401
+    # bool は int の派生型のため true を 1 秒と読まないよう除く
+    # 小数は切り捨てずに拒否する (60.0 のような整数値は受け付ける)
+    if (
+        isinstance(value, bool)
+        or not isinstance(value, int | Decimal)
+        or value != int(value)
+    ):
+        raise ClientError(repr(value), "Invalid parameter.")
+    return int(value)
+
+
 class ApiEvent(NamedTuple):
+    tenant_id: str
     pool_name: str
     items: list[dict]
+    ttl_seconds: int
+    total_bytes: int
+    replace: bool
 
     @classmethod
     def from_event(cls: type["ApiEvent"], event: dict[str, Any]) -> "ApiEvent":
+        event = rest_event(event, ROUTE_PATTERN)
         try:
-            body = json.loads(event["body"])
-            return ApiEvent(
-                pool_name=event["pathParameters"]["pool_name"],
-                items=body["items"],
+            # DynamoDB は float を受け付けないため, 小数は Decimal として読む
+            body = json.loads(event["body"], parse_float=Decimal)
+            pool_name = event["pathParameters"]["pool_name"]
+            items = body["items"]
+            ttl_seconds = (
+                parse_ttl_seconds(body["ttl_seconds"])
+                if "ttl_seconds" in body
+                else int(os.environ.get("POOL_TTL_SECONDS", "0"))
             )
+            replace = body.get("replace", False)
         except Exception as e:
             raise ClientError(event["body"], "Invalid parameter.") from e
+        if (
+            TENANT_SEPARATOR in pool_name
+            or ttl_seconds < 0
+            or not isinstance(replace, bool)
+        ):
+            raise ClientError(pool_name, "Invalid parameter.")
+        # 置き換えは作成時の有効期限を引き継ぐため, 期限の指定は受け付けない
+        if replace and "ttl_seconds" in body:
+            raise ClientError(pool_name, "ttl_seconds cannot be set with replace.")
+        if not isinstance(items, list):
+            raise ClientError(type(items).__name__, "items must be a list.")
+        tenant_id = tenant_from_event(event, TenantParam.from_env().TENANT_HEADER)
+        # 全アイテムに共通して付与する pool_name / item_id / expire_at の大きさ
+        reserved_bytes = (
+            len("pool_name")
+            + len(storage_name(tenant_id, pool_name).encode())
+            + len("item_id")
+            + attribute_size(len(items), 1)
+            + len("content_hash")
+            + CONTENT_HASH_BYTES * 2
+        )
+        if ttl_seconds > 0:
+            reserved_bytes += len("expire_at") + attribute_size(2**32, 1)
+        return ApiEvent(
+            tenant_id=tenant_id,
+            pool_name=pool_name,
+            items=items,
+            ttl_seconds=ttl_seconds,
+            total_bytes=validate_items(items, reserved_bytes),
+            replace=replace,
+        )
+
+    def storage_name(self: Self) -> str:
+        return storage_name(self.tenant_id, self.pool_name)
+
+    def expire_at(self: Self, now: int) -> dict[str, int]:
+        # 有効期限は DynamoDB の TTL 属性として pool / item の両テーブルに書く
+        if self.ttl_seconds == 0:
+            return {}
+        return {"expire_at": now + self.ttl_seconds}
 
-    def to_dynamo_items(self: Self) -> list[dict]:
+    def content_hashes(self: Self) -> list[str]:
+        return [content_hash(x) for x in self.items]
+
+    def to_dynamo_items(
+        self: Self,
+        item_ids: list[int],
+        hashes: list[str],
+        expire_at: dict[str, Any],
+    ) -> list[dict]:
         return [
-            d | {"pool_name": self.pool_name, "item_id": i}
+            d
+            | {
+                "pool_name": self.storage_name(),
+                "item_id": item_ids[i],
+                "content_hash": hashes[i],
+            }
+            | expire_at
             for i, d in enumerate(self.items)
         ]
 
 
+def content_hash(item: dict[str, Any]) -> str:
+    # キーの順序や空白に依存しないよう正規化した JSON から求める
+    data = json.dumps(
+        item,
+        sort_keys=True,
+        separators=(",", ":"),
+        default=decimal_default_proc,
+    )
+    return hashlib.blake2b(data.encode(), digest_size=CONTENT_HASH_BYTES).hexdigest()
+
+
+class ReplacePlan(NamedTuple):
+    item_ids: list[int]
+    writes: list[int]
+    deletes: list[int]
+
+
+def plan_replace(current: dict[int, str | None], hashes: list[str]) -> ReplacePlan:
+    # 内容の変わらないアイテムは元の item_id に残し, 空いた番号を変更分で埋めて
+    # item_id を 0 から件数 - 1 までの連番に保つ
+    n = len(hashes)
+    assigned: list[int | None] = [
+        i if current.get(i) == h else None for i, h in enumerate(hashes)
+    ]
+    claimed = {x for x in assigned if x is not None}
+    by_hash: dict[str, list[int]] = {}
+    for item_id in sorted(current, reverse=True):
+        h = current[item_id]
+        if item_id < n and item_id not in claimed and h is not None:
+            by_hash.setdefault(h, []).append(item_id)
+    for i, h in enumerate(hashes):
+        if assigned[i] is None and by_hash.get(h):
+            item_id = by_hash[h].pop()
+            assigned[i] = item_id
+            claimed.add(item_id)
+    free = (x for x in range(n) if x not in claimed)
+    item_ids: list[int] = []
+    writes: list[int] = []
+    for i, x in enumerate(assigned):
+        if x is None:
+            item_ids.append(next(free))
+            writes.append(i)
+        else:
+            item_ids.append(x)
+    return ReplacePlan(
+        item_ids=item_ids,
+        writes=writes,
+        deletes=sorted(x for x in current if x >= n),
+    )
+
+
+def log_payload(message: str, payload: Callable[[], str], param: LogParam) -> None:
+    # 本文の整形は DEBUG かつ抽出された呼び出しのときだけ行う
+    if logger.log_level > logging.DEBUG:
+        return
+    if random.random() >= param.LOG_PAYLOAD_SAMPLE_RATE:
+        return
+    logger.debug(message, extra={"payload": payload()})
+
+
 def put_items(
     db_resource: DynamoDBServiceResource,
     table_name: str,
     items: list[dict],
 ) -> None:
-    logger.info(json.dumps(items))
-    logger.info(table_name)
+    logger.info("put items", extra={"table_name": table_name, "count": len(items)})
+    log_payload(
+        "put items payload",
+        lambda: json.dumps(items, default=decimal_default_proc),
+        LogParam.from_env(),
+    )
     table = db_resource.Table(table_name)
     try:
         with table.batch_writer() as batch:
@@ -77,12 +423,17 @@ def put_items(
     except botocore.exceptions.ClientError as error:
         if error.response["Error"]["Code"] == "InternalServerError":
             raise ServerError(
-                json.dumps(item),
+                json.dumps(item, default=decimal_default_proc),
+                error.response["Error"]["Message"],
+            ) from error
+        elif error.response["Error"]["Code"] in THROTTLING_ERROR_CODES:
+            raise ThrottlingError(
+                json.dumps(item, default=decimal_default_proc),
                 error.response["Error"]["Message"],
             ) from error
         else:
             raise ClientError(
-                json.dumps(item),
+                json.dumps(item, default=decimal_default_proc),
                 error.response["Error"]["Message"],
             ) from error
 
@@ -105,6 +456,11 @@ def delete_items(
                 json.dumps(key),
                 error.response["Error"]["Message"],
             ) from error
+        elif error.response["Error"]["Code"] in THROTTLING_ERROR_CODES:
+            raise ThrottlingError(
+                json.dumps(key),
+                error.response["Error"]["Message"],
+            ) from error
         else:
             raise ClientError(
                 json.dumps(key),
@@ -125,6 +481,11 @@ def scan_items(client: DynamoDBClient, db_name: str, query: str) -> list[str]:
                 query,
                 error.response["Error"]["Message"],
             ) from error
+        elif error.response["Error"]["Code"] in THROTTLING_ERROR_CODES:
+            raise ThrottlingError(
+                query,
+                error.response["Error"]["Message"],
+            ) from error
         elif error.response["Error"]["Code"] == "ResourceNotFoundException":
             return []
         else:
@@ -156,6 +517,50 @@ def query_items(
                 query,
                 error.response["Error"]["Message"],
             ) from error
+        elif error.response["Error"]["Code"] in THROTTLING_ERROR_CODES:
+            raise ThrottlingError(
+                query,
+                error.response["Error"]["Message"],
+            ) from error
+        elif error.response["Error"]["Code"] == "ResourceNotFoundException":
+            return []
+        else:
+            raise ClientError(
+                query,
+                error.response["Error"]["Message"],
+            ) from error
+
+
+def query_tenant_pools(
+    client: DynamoDBClient,
+    db_name: str,
+    tenant_id: str,
+    query: str,
+) -> list[str]:
+    paginator = client.get_paginator("query")
+    response_iterator = paginator.paginate(
+        TableName=db_name,
+        IndexName=TENANT_INDEX_NAME,
+        KeyConditions={
+            "tenant_id": {
+                "ComparisonOperator": "EQ",
+                "AttributeValueList": [{"S": tenant_id}],
+            },
+        },
+    )
+    try:
+        return list(response_iterator.search(query))
+    except botocore.exceptions.ClientError as error:
+        if error.response["Error"]["Code"] == "InternalServerError":
+            raise ServerError(
+                query,
+                error.response["Error"]["Message"],
+            ) from error
+        elif error.response["Error"]["Code"] in THROTTLING_ERROR_CODES:
+            raise ThrottlingError(
+                query,
+                error.response["Error"]["Message"],
+            ) from error
         elif error.response["Error"]["Code"] == "ResourceNotFoundException":
             return []
         else:
@@ -179,6 +584,11 @@ def get_item(
                 json.dumps(key),
                 error.response["Error"]["Message"],
             ) from error
+        elif error.response["Error"]["Code"] in THROTTLING_ERROR_CODES:
+            raise ThrottlingError(
+                json.dumps(key),
+                error.response["Error"]["Message"],
+            ) from error
         elif error.response["Error"]["Code"] == "ResourceNotFoundException":
             return None
         else:
@@ -188,20 +598,60 @@ def get_item(
             ) from error
 
 
+def put_snapshot(
+    client: S3Client,
+    param: SnapshotParam,
+    pool_name: str,
+    data: bytes,
+) -> bool:
+    # スナップショットは起動高速化のための複製であり, 失敗しても警告に留める
+    key = f"pools/{pool_name}.snapshot"
+    try:
+        if param.SNAPSHOT_BUCKET_NAME:
+            client.put_object(Bucket=param.SNAPSHOT_BUCKET_NAME, Key=key, Body=data)
+        elif param.SNAPSHOT_DIR:
+            path = Path(param.SNAPSHOT_DIR) / key
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # 読み込み側が mmap 中のファイルを書き換えないよう置き換えで更新する
+            tmp = path.with_suffix(".tmp")
+            tmp.write_bytes(data)
+            tmp.replace(path)
+    except (botocore.exceptions.ClientError, OSError):
+        log_exception(logger, logging.WARNING, "put_snapshot failed")
+        # 前の世代が残ると dice が古い内容を返すため, 消して DynamoDB から読ませる
+        delete_snapshot(client, param, key)
+        return False
+    return True
+
+
+def delete_snapshot(client: S3Client, param: SnapshotParam, key: str) -> None:
+    try:
+        if param.SNAPSHOT_BUCKET_NAME:
+            client.delete_object(Bucket=param.SNAPSHOT_BUCKET_NAME, Key=key)
+        elif param.SNAPSHOT_DIR:
+            (Path(param.SNAPSHOT_DIR) / key).unlink(missing_ok=True)
+    except (botocore.exceptions.ClientError, OSError):
+        log_exception(logger, logging.WARNING, "delete_snapshot failed")
+
+
 class Response(NamedTuple):
     status_code: int
     message: str
+    retry_after: int | None = None
 
     def data(self: Self) -> dict[str, Any]:
+        headers: dict[str, Any] = {
+            "Content-Type": "application/json",
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "GET, POST, DELETE",
+            "Access-Control-Allow-Credentials": True,
+            "Access-Control-Allow-Headers": "origin, x-requested-with",
+        }
+        if self.retry_after is not None:
+            headers["Retry-After"] = str(self.retry_after)
         return {
             "statusCode": self.status_code,
-            "headers": {
-                "Content-Type": "application/json",
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Methods": "GET, POST, DELETE",
-                "Access-Control-Allow-Credentials": True,
-                "Access-Control-Allow-Headers": "origin, x-requested-with",
-            },
+            "headers": headers,
             "body": json.dumps(
                 {
                     "message": self.message,
@@ -211,76 +661,345 @@ class Response(NamedTuple):
         }
 
 
-def service(
+def service(  # noqa: PLR0913
     body: ApiEvent,
     db_client: DynamoDBClient,
     db_resource: DynamoDBServiceResource,
+    s3: S3Client,
     env: EnvParam,
+    snapshot_param: SnapshotParam,
+    tenant_param: TenantParam,
 ) -> Response:
+    pool_name = body.storage_name()
     response_pool = get_item(
         db_resource=db_resource,
         table_name=env.POOL_TABLE_NAME,
-        key={"pool_name": body.pool_name},
+        key={"pool_name": pool_name},
     )
-    if response_pool is not None:
+    if response_pool is not None and not body.replace:
         raise ClientError(
-            input_param=body.pool_name,
+            input_param=pool_name,
             message=f"pool_name is already exists: {body.pool_name}",
         )
-    response_items = query_items(
+    # 置き換えの場合は既存プールの件数を差し引いて上限と比べる
+    current_num = int(response_pool["num_item"]) if response_pool is not None else 0
+    if body.tenant_id != "" and tenant_param.TENANT_MAX_ITEMS > 0:
+        used = query_tenant_pools(
+            client=db_client,
+            db_name=env.POOL_TABLE_NAME,
+            tenant_id=body.tenant_id,
+            query="Items[].num_item.N",
+        )
+        if (
+            sum(int(x) for x in used) - current_num + len(body.items)
+            > tenant_param.TENANT_MAX_ITEMS
+        ):
+            raise ClientError(
+                input_param=body.tenant_id,
+                message=f"item quota exceeded: {tenant_param.TENANT_MAX_ITEMS}",
+            )
+    rows: list[Any] = query_items(
         client=db_client,
         db_name=env.ITEM_TABLE_NAME,
         key="pool_name",
-        value=body.pool_name,
-        query="Items[].item_id.N",
+        value=pool_name,
+        query="Items[].[item_id.N, content_hash.S]",
     )
-    delete_items(
+    current: dict[int, str | None] = {int(x[0]): x[1] for x in rows}
+    now = int(time.time())
+    hashes = body.content_hashes()
+    if response_pool is None:
+        # 作成途中で失敗したプールの残骸は内容を問わず書き直す
+        plan = plan_replace({x: None for x in current}, hashes)
+        expire_at = body.expire_at(now)
+    else:
+        # 置き換えでは有効期限を延ばさず, 作成時の期限を引き継ぐ
+        plan = plan_replace(current, hashes)
+        expire_at = (
+            {"expire_at": response_pool["expire_at"]}
+            if "expire_at" in response_pool
+            else {}
+        )
+    logger.info(
+        {
+            "pool_name": pool_name,
+            "num_item": len(hashes),
+            "total_bytes": body.total_bytes,
+            "writes": len(plan.writes),
+            "deletes": len(plan.deletes),
+        },
+    )
+    items = body.to_dynamo_items(plan.item_ids, hashes, expire_at)
+    put_items(
         db_resource=db_resource,
         table_name=env.ITEM_TABLE_NAME,
-        keys=[{"pool_name": body.pool_name, "item_id": int(x)} for x in response_items],
+        items=[items[i] for i in plan.writes],
     )
-    put_items(
+    # 縮小する置き換えでは, 先に件数を減らした pool の行を書いてから末尾を消す.
+    # 逆の順では, 古い件数で抽選した dice が消えたアイテムを引いてしまう
+    shrink = response_pool is not None and len(plan.deletes) > 0
+    tail = [] if shrink else plan.deletes
+    delete_items(
         db_resource=db_resource,
         table_name=env.ITEM_TABLE_NAME,
-        items=body.to_dynamo_items(),
+        keys=[{"pool_name": pool_name, "item_id": x} for x in tail],
+    )
+    # 前の世代の出目の集計が残らないよう, 作成時は全件, 置き換え時は変わった分を消す
+    if response_pool is None:
+        stale_stats = [
+            int(x)
+            for x in query_items(
+                client=db_client,
+                db_name=env.STATS_TABLE_NAME,
+                key="pool_name",
+                value=pool_name,
+                query="Items[].item_id.N",
+            )
+        ]
+    else:
+        stale_stats = [plan.item_ids[i] for i in plan.writes] + tail
+    delete_items(
+        db_resource=db_resource,
+        table_name=env.STATS_TABLE_NAME,
+        keys=[{"pool_name": pool_name, "item_id": x} for x in stale_stats],
+    )
+    items.sort(key=lambda x: int(x["item_id"]))
+    # スナップショットはテナントの接頭辞を除いた名前でレスポンスに使われる
+    snapshot = put_snapshot(
+        client=s3,
+        param=snapshot_param,
+        pool_name=pool_name,
+        data=build_snapshot(
+            [
+                {k: v for k, v in x.items() if k not in INTERNAL_ATTRIBUTES}
+                | {"pool_name": body.pool_name}
+                for x in items
+            ],
+            compress=snapshot_param.compress(body.total_bytes),
+        ),
     )
+    # スナップショットがないことは, 版数が進んでも配信しないようカタログを通じて伝える
+    pool: dict[str, Any] = (
+        {
+            "pool_name": pool_name,
+            "num_item": len(body.items),
+            "last_accessed_at": now,
+        }
+        | expire_at
+        | ({} if snapshot else {"no_snapshot": True})
+    )
+    if body.tenant_id != "":
+        pool["tenant_id"] = body.tenant_id
     put_items(
         db_resource=db_resource,
         table_name=env.POOL_TABLE_NAME,
-        items=[{"pool_name": body.pool_name, "num_item": len(body.items)}],
+        items=[pool],
     )
+    if shrink:
+        for table_name in [env.ITEM_TABLE_NAME, env.STATS_TABLE_NAME]:
+            delete_items(
+                db_resource=db_resource,
+                table_name=table_name,
+                keys=[{"pool_name": pool_name, "item_id": x} for x in plan.deletes],
+            )
+    if response_pool is not None and response_pool.get("archived", False):
+        # 置き換えで退避が解除されるため, 前の世代の退避先は不要になる
+        delete_snapshot(s3, snapshot_param, f"{ARCHIVE_PREFIX}/{pool_name}.snapshot")
     return Response(
         status_code=200,
         message="success",
     )
 
 
-@logger.inject_lambda_context(
-    correlation_id_path="requestContext.requestId",
-)
-def lambda_handler(event: dict[str, Any], context: LambdaContext) -> dict[str, Any]:
+def handle_request(event: dict[str, Any]) -> dict[str, Any]:
     try:
-        return service(
-            body=ApiEvent.from_event(event),
+        body = ApiEvent.from_event(event)
+        tenant_param = TenantParam.from_env()
+        tenant_limiter.acquire(body.tenant_id, tenant_param)
+        response = service(
+            body=body,
             db_client=dynamodb_client,
             db_resource=dynamodb_resource,
+            s3=s3_client,
             env=EnvParam.from_env(),
-        ).data()
+            snapshot_param=SnapshotParam.from_env(),
+            tenant_param=tenant_param,
+        )
+        invalidate_cache(
+            param=CacheParam.from_env(),
+            paths=cached_paths(body.pool_name),
+            tenant_header=tenant_param.TENANT_HEADER,
+            tenant_id=body.tenant_id,
+        )
+        return response.data()
     except ServerError:
-        logger.error(traceback.format_exc())
+        log_exception(logger, logging.ERROR, "server error")
         return Response(
             status_code=500,
             message="internal server error. Please access again after some time.",
         ).data()
+    except ThrottlingError:
+        log_exception(logger, logging.WARNING, "throttled")
+        return Response(
+            status_code=429,
+            message="too many requests. Please retry after some time.",
+            retry_after=int(os.environ.get("RETRY_AFTER_SECONDS", "1")),
+        ).data()
     except ClientError as ce:
-        logger.warning(traceback.format_exc())
+        log_exception(logger, logging.WARNING, "client error")
         return Response(
             status_code=400,
             message=f"client error. {ce.message}",
         ).data()
     except Exception:
-        logger.error(traceback.format_exc())
+        log_exception(logger, logging.ERROR, "unexpected error")
         return Response(
             status_code=500,
             message="internal server error. Please contact the operator.",
         ).data()
+
+
+def idempotent_request(
+    event: dict[str, Any],
+    context: LambdaContext,
+    param: IdempotencyParam,
+) -> dict[str, Any]:
+    key = header_value(event, param.IDEMPOTENCY_HEADER)
+    if key is None or not param.IDEMPOTENCY_TABLE_NAME:
+        return handle_request(event)
+    config = IdempotencyConfig(
+        event_key_jmespath="[key, tenant_id, pool_name]",
+        # 同じキーで内容の異なるリクエストが来た場合は保存済みの結果を返さない
+        payload_validation_jmespath="body",
+        expires_after_seconds=param.IDEMPOTENCY_TTL_SECONDS,
+    )
+    config.register_lambda_context(context)
+
+    @idempotent_function(
+        data_keyword_argument="request",
+        config=config,
+        persistence_store=idempotency_layer(param.IDEMPOTENCY_TABLE_NAME),
+    )
+    def process(request: dict[str, Any]) -> dict[str, Any]:
+        response = handle_request(event)
+        if response["statusCode"] in RETRYABLE_STATUS_CODES:
+            raise RetryableResponseError(response)
+        return response
+
+    try:
+        response: dict[str, Any] = process(
+            request={
+                "key": key,
+                "tenant_id": header_value(event, TenantParam.from_env().TENANT_HEADER),
+                "pool_name": (event.get("pathParameters") or {}).get("pool_name"),
+                "body": event.get("body"),
+            },
+        )
+    except RetryableResponseError as rr:
+        return rr.response
+    except IdempotencyValidationError:
+        log_exception(logger, logging.WARNING, "idempotency key reused")
+        return Response(
+            status_code=400,
+            message="client error. Idempotency key was used for another request.",
+        ).data()
+    except IdempotencyAlreadyInProgressError:
+        log_exception(logger, logging.WARNING, "request in progress")
+        return Response(
+            status_code=429,
+            message="too many requests. The same request is in progress.",
+            retry_after=int(os.environ.get("RETRY_AFTER_SECONDS", "1")),
+        ).data()
+    except Exception:
+        log_exception(logger, logging.ERROR, "unexpected error")
+        return Response(
+            status_code=500,
+            message="internal server error. Please access again after some time.",
+        ).data()
+    return response
+
+
+class CacheParam(NamedTuple):
+    # API Gateway のステージ URL (例: https://<id>.execute-api.<region>.amazonaws.com/v1)
+    API_CACHE_URL: str
+    API_CACHE_TIMEOUT_SECONDS: float
+
+    @classmethod
+    def from_env(cls: type["CacheParam"]) -> "CacheParam":
+        return CacheParam(
+            API_CACHE_URL=os.environ.get("API_CACHE_URL", ""),
+            API_CACHE_TIMEOUT_SECONDS=float(
+                os.environ.get("API_CACHE_TIMEOUT_SECONDS", "2"),
+            ),
+        )
+
+
+def cached_paths(pool_name: str) -> list[str]:
+    # プールの作成 / 削除で内容が変わる読み取り系のリソース.
+    # 版数付きの一覧 (?versions=true) は版数を進める stream_processor が取り直す
+    return [
+        "/pools",
+        f"/pools/{urllib.parse.quote(pool_name, safe='')}/stats",
+    ]
+
+
+def invalidate_cache(
+    param: CacheParam,
+    paths: list[str],
+    tenant_header: str,
+    tenant_id: str,
+) -> None:
+    if not param.API_CACHE_URL:
+        return
+    headers = {tenant_header: tenant_id} if tenant_id != "" else {}
+    refresh_cache(
+        logger,
+        [(param.API_CACHE_URL.rstrip("/") + x, headers) for x in paths],
+        param.API_CACHE_TIMEOUT_SECONDS,
+    )
+
+
+@profiled(logger)
+@logger.inject_lambda_context(
+    correlation_id_path="requestContext.requestId",
+)
+def lambda_handler(event: dict[str, Any], context: LambdaContext) -> dict[str, Any]:
+    # 冪等性キー付きの再試行には保存済みの結果を返し, 書き込みを繰り返さない
+    return idempotent_request(
+        rest_event(event, ROUTE_PATTERN),
+        context,
+        IdempotencyParam.from_env(),
+    )
+
+
+def warm_up() -> None:
+    # 認証情報の取得と TLS 接続の確立を初期化フェーズで済ませておく
+    try:
+        env = EnvParam.from_env()
+        dynamodb_client.get_item(
+            TableName=env.POOL_TABLE_NAME,
+            Key={"pool_name": {"S": "__warm_up__"}},
+        )
+        dynamodb_resource.Table(env.ITEM_TABLE_NAME).get_item(
+            Key={"pool_name": "__warm_up__", "item_id": 0},
+        )
+    except Exception:
+        log_exception(logger, logging.WARNING, "warm_up failed")
+
+
+def after_restore() -> None:
+    # スナップショットから復元されたインスタンス間で接続を共有しないようにする
+    global dynamodb_client, dynamodb_resource, s3_client  # noqa: PLW0603
+    dynamodb_client = boto3.client("dynamodb", config=boto_config)
+    dynamodb_resource = boto3.resource("dynamodb", config=boto_config)
+    s3_client = boto3.client("s3", config=boto_config)
+    idempotency_layers.clear()
+    warm_up()
+
+
+if os.environ.get("AWS_LAMBDA_INITIALIZATION_TYPE") == "provisioned-concurrency":
+    warm_up()
+
+if snapshot_restore_py is not None:
+    snapshot_restore_py.register_before_snapshot(warm_up)
+    snapshot_restore_py.register_after_restore(after_restore)
@@ -1,33 +1,68 @@
 import json
+import logging
 import os
-import traceback
+import re
+import urllib.parse
+import urllib.request
+from pathlib import Path
 from typing import Any, NamedTuple, Self
 
 import boto3
 import botocore
 from aws_lambda_powertools.logging import Logger
+from aws_lambda_powertools.utilities.idempotency import (
+    DynamoDBPersistenceLayer,
+    IdempotencyConfig,
+    idempotent_function,
+)
+from aws_lambda_powertools.utilities.idempotency.exceptions import (
+    IdempotencyAlreadyInProgressError,
+    IdempotencyValidationError,
+)
 from aws_lambda_powertools.utilities.typing import LambdaContext
+from botocore.config import Config
+from common import (
+    TENANT_SEPARATOR,
+    THROTTLING_ERROR_CODES,
+    ClientError,
+    ServerError,
+    ThrottlingError,
+    log_exception,
+    refresh_cache,
+    rest_event,
+    storage_name,
+    tenant_from_event,
+)
 from mypy_boto3_dynamodb import DynamoDBClient, DynamoDBServiceResource
+from mypy_boto3_s3 import S3Client
+from profiler import profiled
 
-logger = Logger()
-dynamodb_client = boto3.client("dynamodb")
-dynamodb_resource = boto3.resource("dynamodb")
-
-
-class ClientError(Exception):
-    def __init__(self: Self, input_param: str, message: str) -> None:
-        self.message = message
-        super().__init__(f"{message}: {input_param}")
+try:
+    # SnapStart 環境でのみ提供されるランタイムフック
+    import snapshot_restore_py
+except ImportError:
+    snapshot_restore_py = None
 
+logger = Logger()
+# adaptive モード: リトライ枠 (トークンバケット) とクライアント側のレート制限
+boto_config = Config(
+    retries={
+        "mode": "adaptive",
+        "max_attempts": int(os.environ.get("DYNAMODB_MAX_ATTEMPTS", "3")),
+    },
+)
+dynamodb_client = boto3.client("dynamodb", config=boto_config)
+dynamodb_resource = boto3.resource("dynamodb", config=boto_config)
+s3_client = boto3.client("s3", config=boto_config)
 
-class ServerError(Exception):
-    def __init__(self: Self, input_param: str, message: str) -> None:
-        super().__init__(f"{message}: {input_param}")
+# HTTP API / 関数 URL で受けるリソースパス
+ROUTE_PATTERN = re.compile(r"/pools/(?P<pool_name>[^/]+)$")
 
 
 class EnvParam(NamedTuple):
     POOL_TABLE_NAME: str
     ITEM_TABLE_NAME: str
+    STATS_TABLE_NAME: str
 
     @classmethod
     def from_env(cls: type["EnvParam"]) -> "EnvParam":
@@ -40,17 +75,95 @@ class EnvParam(NamedTuple):
             ) from e
 
 
+class SnapshotParam(NamedTuple):
+    SNAPSHOT_BUCKET_NAME: str
+    SNAPSHOT_DIR: str
+
+    @classmethod
+    def from_env(cls: type["SnapshotParam"]) -> "SnapshotParam":
+        return SnapshotParam(
+            SNAPSHOT_BUCKET_NAME=os.environ.get("SNAPSHOT_BUCKET_NAME", ""),
+            SNAPSHOT_DIR=os.environ.get("SNAPSHOT_DIR", ""),
+        )
+
+
+class TenantParam(NamedTuple):
+    TENANT_HEADER: str
+
+    @classmethod
+    def from_env(cls: type["TenantParam"]) -> "TenantParam":
+        return TenantParam(
+            TENANT_HEADER=os.environ.get("TENANT_HEADER", "X-Tenant-Id"),
+        )
+
+
+class IdempotencyParam(NamedTuple):
+    IDEMPOTENCY_TABLE_NAME: str
+    IDEMPOTENCY_HEADER: str
+    IDEMPOTENCY_TTL_SECONDS: int
+
+    @classmethod
+    def from_env(cls: type["IdempotencyParam"]) -> "IdempotencyParam":
+        return IdempotencyParam(
+            IDEMPOTENCY_TABLE_NAME=os.environ.get("IDEMPOTENCY_TABLE_NAME", ""),
+            IDEMPOTENCY_HEADER=os.environ.get("IDEMPOTENCY_HEADER", "Idempotency-Key"),
+            IDEMPOTENCY_TTL_SECONDS=int(
+                os.environ.get("IDEMPOTENCY_TTL_SECONDS", "3600"),
+            ),
+        )
+
+
+# 冪等性レコードに保存しない (再試行で結果が変わり得る) ステータスコード
+RETRYABLE_STATUS_CODES = (429, 500)
+
+
+class RetryableResponseError(Exception):
+    # 例外として扱うことで, 冪等性レコードを保存せずに破棄させる
+    def __init__(self: Self, response: dict[str, Any]) -> None:
+        self.response = response
+        super().__init__(response["statusCode"])
+
+
+def header_value(event: dict[str, Any], header: str) -> str | None:
+    headers = {k.lower(): v for k, v in (event.get("headers") or {}).items()}
+    return headers.get(header.lower())
+
+
+# テーブル名ごとに使い回し, 呼び出しのたびにクライアントを作らない
+idempotency_layers: dict[str, DynamoDBPersistenceLayer] = {}
+
+
+def idempotency_layer(table_name: str) -> DynamoDBPersistenceLayer:
+    layer = idempotency_layers.get(table_name)
+    if layer is None:
+        layer = DynamoDBPersistenceLayer(
+            table_name=table_name,
+            boto3_client=dynamodb_client,
+        )
+        idempotency_layers[table_name] = layer
+    return layer
+
+
 class ApiEvent(NamedTuple):
+    tenant_id: str
     pool_name: str
 
     @classmethod
     def from_event(cls: type["ApiEvent"], event: dict[str, Any]) -> "ApiEvent":
+        event = rest_event(event, ROUTE_PATTERN)
         try:
-            return ApiEvent(
-                pool_name=event["pathParameters"]["pool_name"],
-            )
+            pool_name = event["pathParameters"]["pool_name"]
         except Exception as e:
             raise ClientError(event["body"], "Invalid parameter.") from e
+        if TENANT_SEPARATOR in pool_name:
+            raise ClientError(pool_name, "Invalid parameter.")
+        return ApiEvent(
+            tenant_id=tenant_from_event(event, TenantParam.from_env().TENANT_HEADER),
+            pool_name=pool_name,
+        )
+
+    def storage_name(self: Self) -> str:
+        return storage_name(self.tenant_id, self.pool_name)
 
 
 def delete_items(
@@ -71,6 +184,11 @@ def delete_items(
                 json.dumps(key),
                 error.response["Error"]["Message"],
             ) from error
+        elif error.response["Error"]["Code"] in THROTTLING_ERROR_CODES:
+            raise ThrottlingError(
+                json.dumps(key),
+                error.response["Error"]["Message"],
+            ) from error
         else:
             raise ClientError(
                 json.dumps(key),
@@ -100,6 +218,11 @@ def query_items(
                 query,
                 error.response["Error"]["Message"],
             ) from error
+        elif error.response["Error"]["Code"] in THROTTLING_ERROR_CODES:
+            raise ThrottlingError(
+                query,
+                error.response["Error"]["Message"],
+            ) from error
         elif error.response["Error"]["Code"] == "ResourceNotFoundException":
             return []
         else:
@@ -123,6 +246,11 @@ def get_item(
                 json.dumps(key),
                 error.response["Error"]["Message"],
             ) from error
+        elif error.response["Error"]["Code"] in THROTTLING_ERROR_CODES:
+            raise ThrottlingError(
+                json.dumps(key),
+                error.response["Error"]["Message"],
+            ) from error
         elif error.response["Error"]["Code"] == "ResourceNotFoundException":
             return None
         else:
@@ -132,20 +260,35 @@ def get_item(
             ) from error
 
 
+def delete_snapshot(client: S3Client, param: SnapshotParam, key: str) -> None:
+    # 残っても再作成時に上書きされるため, 失敗しても警告に留める
+    try:
+        if param.SNAPSHOT_BUCKET_NAME:
+            client.delete_object(Bucket=param.SNAPSHOT_BUCKET_NAME, Key=key)
+        elif param.SNAPSHOT_DIR:
+            (Path(param.SNAPSHOT_DIR) / key).unlink(missing_ok=True)
+    except (botocore.exceptions.ClientError, OSError):
+        log_exception(logger, logging.WARNING, "delete_snapshot failed")
+
+
 class Response(NamedTuple):
     status_code: int
     message: str
+    retry_after: int | None = None
 
     def data(self: Self) -> dict[str, Any]:
+        headers: dict[str, Any] = {
+            "Content-Type": "application/json",
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "GET, POST, DELETE",
+            "Access-Control-Allow-Credentials": True,
+            "Access-Control-Allow-Headers": "origin, x-requested-with",
+        }
+        if self.retry_after is not None:
+            headers["Retry-After"] = str(self.retry_after)
         return {
             "statusCode": self.status_code,
-            "headers": {
-                "Content-Type": "application/json",
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Methods": "GET, POST, DELETE",
-                "Access-Control-Allow-Credentials": True,
-                "Access-Control-Allow-Headers": "origin, x-requested-with",
-            },
+            "headers": headers,
             "body": json.dumps(
                 {
                     "message": self.message,
@@ -155,38 +298,60 @@ class Response(NamedTuple):
         }
 
 
-def service(
+def service(  # noqa: PLR0913
     body: ApiEvent,
     db_client: DynamoDBClient,
     db_resource: DynamoDBServiceResource,
+    s3: S3Client,
     env: EnvParam,
+    snapshot_param: SnapshotParam,
 ) -> Response:
+    pool_name = body.storage_name()
     response_pool = get_item(
         db_resource=db_resource,
         table_name=env.POOL_TABLE_NAME,
-        key={"pool_name": body.pool_name},
+        key={"pool_name": pool_name},
     )
     if response_pool is None:
         raise ClientError(
-            input_param=body.pool_name,
+            input_param=pool_name,
             message=f"pool_name is empty: {body.pool_name}",
         )
     response_items = query_items(
         client=db_client,
         db_name=env.ITEM_TABLE_NAME,
         key="pool_name",
-        value=body.pool_name,
+        value=pool_name,
         query="Items[].item_id.N",
     )
     delete_items(
         db_resource=db_resource,
         table_name=env.ITEM_TABLE_NAME,
-        keys=[{"pool_name": body.pool_name, "item_id": x} for x in response_items],
+        keys=[{"pool_name": pool_name, "item_id": int(x)} for x in response_items],
+    )
+    response_stats = query_items(
+        client=db_client,
+        db_name=env.STATS_TABLE_NAME,
+        key="pool_name",
+        value=pool_name,
+        query="Items[].item_id.N",
     )
+    delete_items(
+        db_resource=db_resource,
+        table_name=env.STATS_TABLE_NAME,
+        keys=[{"pool_name": pool_name, "item_id": int(x)} for x in response_stats],
+    )
+    # archiver が退避したアイテムも同じ形式で置かれている
+    for key in [f"pools/{pool_name}.snapshot", f"archive/{pool_name}.snapshot"]:
+        delete_snapshot(
+            client=s3,
+            param=snapshot_param,
+            key=key,
+        )
     delete_items(
         db_resource=db_resource,
         table_name=env.POOL_TABLE_NAME,
-        keys=[{"pool_name": body.pool_name}],
+        keys=[{"pool_name": pool_name}],
     )
     return Response(
         status_code=200,
@@ -194,32 +359,192 @@ def service(
     )
 
 
-@logger.inject_lambda_context(
-    correlation_id_path="requestContext.requestId",
-)
-def lambda_handler(event: dict[str, Any], context: LambdaContext) -> dict[str, Any]:
+def handle_request(event: dict[str, Any]) -> dict[str, Any]:
     try:
-        return service(
-            body=ApiEvent.from_event(event),
+        body = ApiEvent.from_event(event)
+        response = service(
+            body=body,
             db_client=dynamodb_client,
             db_resource=dynamodb_resource,
+            s3=s3_client,
             env=EnvParam.from_env(),
-        ).data()
+            snapshot_param=SnapshotParam.from_env(),
+        )
+        invalidate_cache(
+            param=CacheParam.from_env(),
+            paths=cached_paths(body.pool_name),
+            tenant_header=TenantParam.from_env().TENANT_HEADER,
+            tenant_id=body.tenant_id,
+        )
+        return response.data()
     except ServerError:
-        logger.error(traceback.format_exc())
+        log_exception(logger, logging.ERROR, "server error")
         return Response(
             status_code=500,
             message="internal server error. Please access again after some time.",
         ).data()
+    except ThrottlingError:
+        log_exception(logger, logging.WARNING, "throttled")
+        return Response(
+            status_code=429,
+            message="too many requests. Please retry after some time.",
+            retry_after=int(os.environ.get("RETRY_AFTER_SECONDS", "1")),
+        ).data()
     except ClientError as ce:
-        logger.warning(traceback.format_exc())
+        log_exception(logger, logging.WARNING, "client error")
         return Response(
             status_code=400,
             message=f"client error. {ce.message}",
         ).data()
     except Exception:
-        logger.error(traceback.format_exc())
+        log_exception(logger, logging.ERROR, "unexpected error")
         return Response(
             status_code=500,
             message="internal server error. Please contact the operator.",
         ).data()
+
+
+def idempotent_request(
+    event: dict[str, Any],
+    context: LambdaContext,
+    param: IdempotencyParam,
+) -> dict[str, Any]:
+    key = header_value(event, param.IDEMPOTENCY_HEADER)
+    if key is None or not param.IDEMPOTENCY_TABLE_NAME:
+        return handle_request(event)
+    config = IdempotencyConfig(
+        event_key_jmespath="[key, tenant_id, pool_name]",
+        # 同じキーで内容の異なるリクエストが来た場合は保存済みの結果を返さない
+        payload_validation_jmespath="body",
+        expires_after_seconds=param.IDEMPOTENCY_TTL_SECONDS,
+    )
+    config.register_lambda_context(context)
+
+    @idempotent_function(
+        data_keyword_argument="request",
+        config=config,
+        persistence_store=idempotency_layer(param.IDEMPOTENCY_TABLE_NAME),
+    )
+    def process(request: dict[str, Any]) -> dict[str, Any]:
+        response = handle_request(event)
+        if response["statusCode"] in RETRYABLE_STATUS_CODES:
+            raise RetryableResponseError(response)
+        return response
+
+    try:
+        response: dict[str, Any] = process(
+            request={
+                "key": key,
+                "tenant_id": header_value(event, TenantParam.from_env().TENANT_HEADER),
+                "pool_name": (event.get("pathParameters") or {}).get("pool_name"),
+                "body": event.get("body"),
+            },
+        )
+    except RetryableResponseError as rr:
+        return rr.response
+    except IdempotencyValidationError:
+        log_exception(logger, logging.WARNING, "idempotency key reused")
+        return Response(
+            status_code=400,
+            message="client error. Idempotency key was used for another request.",
+        ).data()
+    except IdempotencyAlreadyInProgressError:
+        log_exception(logger, logging.WARNING, "request in progress")
+        return Response(
+            status_code=429,
+            message="too many requests. The same request is in progress.",
+            retry_after=int(os.environ.get("RETRY_AFTER_SECONDS", "1")),
+        ).data()
+    except Exception:
+        log_exception(logger, logging.ERROR, "unexpected error")
+        return Response(
+            status_code=500,
+            message="internal server error. Please access again after some time.",
+        ).data()
+    return response
+
+
+class CacheParam(NamedTuple):
+    # API Gateway のステージ URL (例: https://<id>.execute-api.<region>.amazonaws.com/v1)
+    API_CACHE_URL: str
+    API_CACHE_TIMEOUT_SECONDS: float
+
+    @classmethod
+    def from_env(cls: type["CacheParam"]) -> "CacheParam":
+        return CacheParam(
+            API_CACHE_URL=os.environ.get("API_CACHE_URL", ""),
+            API_CACHE_TIMEOUT_SECONDS=float(
+                os.environ.get("API_CACHE_TIMEOUT_SECONDS", "2"),
+            ),
+        )
+
+
+def cached_paths(pool_name: str) -> list[str]:
+    # プールの作成 / 削除で内容が変わる読み取り系のリソース.
+    # 版数付きの一覧 (?versions=true) は版数を進める stream_processor が取り直す
+    return [
+        "/pools",
+        f"/pools/{urllib.parse.quote(pool_name, safe='')}/stats",
+    ]
+
+
+def invalidate_cache(
+    param: CacheParam,
+    paths: list[str],
+    tenant_header: str,
+    tenant_id: str,
+) -> None:
+    if not param.API_CACHE_URL:
+        return
+    headers = {tenant_header: tenant_id} if tenant_id != "" else {}
+    refresh_cache(
+        logger,
+        [(param.API_CACHE_URL.rstrip("/") + x, headers) for x in paths],
+        param.API_CACHE_TIMEOUT_SECONDS,
+    )
+
+
+@profiled(logger)
+@logger.inject_lambda_context(
+    correlation_id_path="requestContext.requestId",
+)
+def lambda_handler(event: dict[str, Any], context: LambdaContext) -> dict[str, Any]:
+    # 冪等性キー付きの再試行には保存済みの結果を返し, 書き込みを繰り返さない
+    return idempotent_request(
+        rest_event(event, ROUTE_PATTERN),
+        context,
+        IdempotencyParam.from_env(),
+    )
+
+
+def warm_up() -> None:
+    # 認証情報の取得と TLS 接続の確立を初期化フェーズで済ませておく
+    try:
+        env = EnvParam.from_env()
+        dynamodb_client.get_item(
+            TableName=env.POOL_TABLE_NAME,
+            Key={"pool_name": {"S": "__warm_up__"}},
+        )
+        dynamodb_resource.Table(env.ITEM_TABLE_NAME).get_item(
+            Key={"pool_name": "__warm_up__", "item_id": 0},
+        )
+    except Exception:
+        log_exception(logger, logging.WARNING, "warm_up failed")
+
+
+def after_restore() -> None:
+    # スナップショットから復元されたインスタンス間で接続を共有しないようにする
+    global dynamodb_client, dynamodb_resource, s3_client  # noqa: PLW0603
+    dynamodb_client = boto3.client("dynamodb", config=boto_config)
+    dynamodb_resource = boto3.resource("dynamodb", config=boto_config)
+    s3_client = boto3.client("s3", config=boto_config)
+    idempotency_layers.clear()
+    warm_up()
+
+
+if os.environ.get("AWS_LAMBDA_INITIALIZATION_TYPE") == "provisioned-concurrency":
+    warm_up()
+
+if snapshot_restore_py is not None:
+    snapshot_restore_py.register_before_snapshot(warm_up)
+    snapshot_restore_py.register_after_restore(after_restore)
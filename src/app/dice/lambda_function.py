@@ -1,34 +1,77 @@
 import json
+import logging
+import mmap
 import os
 import random
-import traceback
+import re
+import struct
+import time
+from collections import Counter, OrderedDict
 from decimal import Decimal
-from typing import Any, NamedTuple, Self
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, NamedTuple, Self
 
 import boto3
 import botocore
 from aws_lambda_powertools.logging import Logger
 from aws_lambda_powertools.utilities.typing import LambdaContext
+from boto3.dynamodb.conditions import Key
+from botocore.config import Config
+from common import (
+    TENANT_SEPARATOR,
+    THROTTLING_ERROR_CODES,
+    ClientError,
+    ServerError,
+    TenantLimiter,
+    ThrottlingError,
+    decimal_default_proc,
+    display_name,
+    log_exception,
+    pack_items,
+    read_snapshot,
+    rest_event,
+    storage_name,
+    tenant_from_event,
+)
 from mypy_boto3_dynamodb import DynamoDBServiceResource
+from mypy_boto3_s3 import S3Client
+from profiler import profiled
 
-logger = Logger()
-dynamodb_resource = boto3.resource("dynamodb")
+if TYPE_CHECKING:
+    from array import array
 
+try:
+    # SnapStart 環境でのみ提供されるランタイムフック
+    import snapshot_restore_py
+except ImportError:
+    snapshot_restore_py = None
 
-class ClientError(Exception):
-    def __init__(self: Self, input_param: str, message: str) -> None:
-        self.message = message
-        super().__init__(f"{message}: {input_param}")
+logger = Logger()
+# adaptive モード: リトライ枠 (トークンバケット) とクライアント側のレート制限
+boto_config = Config(
+    retries={
+        "mode": "adaptive",
+        "max_attempts": int(os.environ.get("DYNAMODB_MAX_ATTEMPTS", "3")),
+    },
+)
+dynamodb_resource = boto3.resource("dynamodb", config=boto_config)
+s3_client = boto3.client("s3", config=boto_config)
+lambda_client = boto3.client("lambda")
 
+SNAPSHOT_TMP_DIR = Path("/tmp/snapshots")  # noqa: S108
+# archiver が退避したプールの置き場所. 形式はスナップショットと同じ
+ARCHIVE_PREFIX = "archive"
+# DynamoDB の TTL 属性など, レスポンスに含めない内部用の属性
+INTERNAL_ATTRIBUTES = ("expire_at", "content_hash")
 
-class ServerError(Exception):
-    def __init__(self: Self, input_param: str, message: str) -> None:
-        super().__init__(f"{message}: {input_param}")
+# HTTP API / 関数 URL で受けるリソースパス
+ROUTE_PATTERN = re.compile(r"/pools/(?P<pool_name>[^/]+)/dice$")
 
 
 class EnvParam(NamedTuple):
     POOL_TABLE_NAME: str
     ITEM_TABLE_NAME: str
+    STATS_TABLE_NAME: str
 
     @classmethod
     def from_env(cls: type["EnvParam"]) -> "EnvParam":
@@ -41,7 +84,25 @@ class EnvParam(NamedTuple):
             ) from e
 
 
+class TenantParam(NamedTuple):
+    TENANT_HEADER: str
+    TENANT_RATE_LIMIT: float
+    TENANT_BURST: float
+
+    @classmethod
+    def from_env(cls: type["TenantParam"]) -> "TenantParam":
+        return TenantParam(
+            TENANT_HEADER=os.environ.get("TENANT_HEADER", "X-Tenant-Id"),
+            TENANT_RATE_LIMIT=float(os.environ.get("TENANT_RATE_LIMIT", "0")),
+            TENANT_BURST=float(os.environ.get("TENANT_BURST", "10")),
+        )
+
+
+tenant_limiter = TenantLimiter()
+
+
 class ApiEvent(NamedTuple):
+    tenant_id: str
     pool_name: str
 
     @classmethod
@@ -49,12 +110,144 @@ class ApiEvent(NamedTuple):
         cls: type["ApiEvent"],
         event: dict[str, Any],
     ) -> "ApiEvent":
+        event = rest_event(event, ROUTE_PATTERN)
         try:
-            return ApiEvent(
-                pool_name=event["pathParameters"]["pool_name"],
-            )
+            pool_name = event["pathParameters"]["pool_name"]
         except Exception as e:
             raise ClientError(event["body"], "Invalid parameter.") from e
+        if TENANT_SEPARATOR in pool_name:
+            raise ClientError(pool_name, "Invalid parameter.")
+        return ApiEvent(
+            tenant_id=tenant_from_event(event, TenantParam.from_env().TENANT_HEADER),
+            pool_name=pool_name,
+        )
+
+    def storage_name(self: Self) -> str:
+        return storage_name(self.tenant_id, self.pool_name)
+
+
+class CacheParam(NamedTuple):
+    HOT_POOLS: list[str]
+    CACHE_TTL_SECONDS: float
+    CACHE_MAX_BYTES: int
+    SNAPSHOT_BUCKET_NAME: str
+    SNAPSHOT_DIR: str
+
+    @classmethod
+    def from_env(cls: type["CacheParam"]) -> "CacheParam":
+        return CacheParam(
+            HOT_POOLS=[x for x in os.environ.get("HOT_POOLS", "").split(",") if x],
+            CACHE_TTL_SECONDS=float(os.environ.get("CACHE_TTL_SECONDS", "60")),
+            CACHE_MAX_BYTES=int(os.environ.get("CACHE_MAX_BYTES", str(16 * 2**20))),
+            SNAPSHOT_BUCKET_NAME=os.environ.get("SNAPSHOT_BUCKET_NAME", ""),
+            SNAPSHOT_DIR=os.environ.get("SNAPSHOT_DIR", ""),
+        )
+
+
+class StatsParam(NamedTuple):
+    # 空のときはローカル実行として, 出目をその場で集計する
+    STATS_FUNCTION_NAME: str
+
+    @classmethod
+    def from_env(cls: type["StatsParam"]) -> "StatsParam":
+        return StatsParam(
+            STATS_FUNCTION_NAME=os.environ.get("STATS_FUNCTION_NAME", ""),
+        )
+
+
+class ArchiveParam(NamedTuple):
+    ACCESS_TOUCH_SECONDS: int
+
+    @classmethod
+    def from_env(cls: type["ArchiveParam"]) -> "ArchiveParam":
+        return ArchiveParam(
+            ACCESS_TOUCH_SECONDS=int(os.environ.get("ACCESS_TOUCH_SECONDS", "3600")),
+        )
+
+
+def public_item(item: dict[str, Any]) -> dict[str, Any]:
+    return {k: v for k, v in item.items() if k not in INTERNAL_ATTRIBUTES}
+
+
+class CompactPool:
+    # 直列化済みのアイテムを 1 つのバッファに連結し, 境界をオフセット配列で持つ
+    def __init__(
+        self: Self,
+        buffer: bytes | memoryview,
+        offsets: "array[int] | memoryview",
+        item_ids: "array[int] | memoryview",
+    ) -> None:
+        self.buffer = buffer
+        self.offsets = offsets
+        self.item_ids = item_ids
+
+    @classmethod
+    def from_items(
+        cls: type["CompactPool"],
+        items: list[dict[str, Any]],
+    ) -> "CompactPool":
+        return cls(*pack_items(items))
+
+    @classmethod
+    def from_snapshot(cls: type["CompactPool"], data: mmap.mmap) -> "CompactPool":
+        return cls(*read_snapshot(memoryview(data)))
+
+    def __len__(self: Self) -> int:
+        return len(self.item_ids)
+
+    def item(self: Self, index: int) -> bytes:
+        return bytes(self.buffer[self.offsets[index] : self.offsets[index + 1]])
+
+    def nbytes(self: Self) -> int:
+        return (
+            len(self.buffer)
+            + self.offsets.itemsize * len(self.offsets)
+            + self.item_ids.itemsize * len(self.item_ids)
+        )
+
+
+class PoolCache:
+    # 上限はエントリ数ではなくバイト数で持ち, 超えた分は最も古く使われたプールから捨てる
+    def __init__(self: Self) -> None:
+        self._pools: OrderedDict[str, tuple[float, CompactPool]] = OrderedDict()
+        # 上限を超えるプールは読み込んだ時刻だけ覚え, TTL の間は通常の経路で引かせる
+        self._oversized: dict[str, float] = {}
+        self.nbytes = 0
+
+    def get(self: Self, pool_name: str, ttl: float) -> CompactPool | None:
+        cached = self._pools.get(pool_name)
+        if cached is None or time.monotonic() - cached[0] > ttl:
+            return None
+        self._pools.move_to_end(pool_name)
+        return cached[1]
+
+    def oversized(self: Self, pool_name: str, ttl: float) -> bool:
+        loaded_at = self._oversized.get(pool_name)
+        return loaded_at is not None and time.monotonic() - loaded_at <= ttl
+
+    def put(self: Self, pool_name: str, pool: CompactPool, max_bytes: int) -> None:
+        self.discard(pool_name)
+        self._oversized.pop(pool_name, None)
+        if pool.nbytes() > max_bytes:
+            self._oversized[pool_name] = time.monotonic()
+            return
+        while self._pools and self.nbytes + pool.nbytes() > max_bytes:
+            self.discard(next(iter(self._pools)))
+        self._pools[pool_name] = (time.monotonic(), pool)
+        self.nbytes += pool.nbytes()
+
+    def discard(self: Self, pool_name: str) -> None:
+        cached = self._pools.pop(pool_name, None)
+        if cached is not None:
+            self.nbytes -= cached[1].nbytes()
+
+    def clear(self: Self) -> None:
+        self._pools.clear()
+        self._oversized.clear()
+        self.nbytes = 0
+
+
+pool_cache = PoolCache()
 
 
 def get_item(
@@ -71,6 +264,11 @@ def get_item(
                 json.dumps(key),
                 error.response["Error"]["Message"],
             ) from error
+        elif error.response["Error"]["Code"] in THROTTLING_ERROR_CODES:
+            raise ThrottlingError(
+                json.dumps(key),
+                error.response["Error"]["Message"],
+            ) from error
         elif error.response["Error"]["Code"] == "ResourceNotFoundException":
             return None
         else:
@@ -80,54 +278,331 @@ def get_item(
             ) from error
 
 
-def decimal_default_proc(obj: Any) -> int:  # noqa: ANN401
-    if isinstance(obj, Decimal):
-        return int(obj)
-    raise TypeError
+def query_pool_items(
+    db_resource: DynamoDBServiceResource,
+    table_name: str,
+    pool_name: str,
+) -> list[dict[str, Any]]:
+    table = db_resource.Table(table_name)
+    kwargs: dict[str, Any] = {"KeyConditionExpression": Key("pool_name").eq(pool_name)}
+    items: list[dict[str, Any]] = []
+    try:
+        while True:
+            response = table.query(**kwargs)
+            items.extend(response["Items"])
+            if "LastEvaluatedKey" not in response:
+                return items
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    except botocore.exceptions.ClientError as error:
+        if error.response["Error"]["Code"] == "InternalServerError":
+            raise ServerError(
+                pool_name,
+                error.response["Error"]["Message"],
+            ) from error
+        elif error.response["Error"]["Code"] in THROTTLING_ERROR_CODES:
+            raise ThrottlingError(
+                pool_name,
+                error.response["Error"]["Message"],
+            ) from error
+        elif error.response["Error"]["Code"] == "ResourceNotFoundException":
+            return []
+        else:
+            raise ClientError(
+                pool_name,
+                error.response["Error"]["Message"],
+            ) from error
+
+
+def load_snapshot(
+    client: S3Client,
+    cache_param: CacheParam,
+    key: str,
+) -> CompactPool | None:
+    # スナップショットは 1 回の転送でまとめて取得し, mmap で参照する
+    try:
+        if cache_param.SNAPSHOT_BUCKET_NAME:
+            path = SNAPSHOT_TMP_DIR / key
+            path.parent.mkdir(parents=True, exist_ok=True)
+            client.download_file(cache_param.SNAPSHOT_BUCKET_NAME, key, str(path))
+        elif cache_param.SNAPSHOT_DIR:
+            path = Path(cache_param.SNAPSHOT_DIR) / key
+        else:
+            return None
+        with path.open("rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return CompactPool.from_snapshot(data)
+    except (botocore.exceptions.ClientError, OSError, ValueError, struct.error):
+        log_exception(logger, logging.WARNING, "load_snapshot failed")
+        return None
+
+
+def load_hot_pool(
+    pool_name: str,
+    db_resource: DynamoDBServiceResource,
+    s3: S3Client,
+    env: EnvParam,
+    cache_param: CacheParam,
+) -> CompactPool:
+    pool = load_snapshot(s3, cache_param, f"pools/{pool_name}.snapshot")
+    if pool is None:
+        items = query_pool_items(
+            db_resource=db_resource,
+            table_name=env.ITEM_TABLE_NAME,
+            pool_name=pool_name,
+        )
+        pool = CompactPool.from_items(
+            [public_item(x) | {"pool_name": display_name(pool_name)} for x in items],
+        )
+    # キャッシュから引く間は pool テーブルを読まないため, 読み込み時に参照を記録する
+    touch_pool(
+        db_resource=db_resource,
+        table_name=env.POOL_TABLE_NAME,
+        pool_name=pool_name,
+        now=int(time.time()),
+        touch_seconds=0,
+    )
+    pool_cache.put(pool_name, pool, cache_param.CACHE_MAX_BYTES)
+    return pool
+
+
+def touch_pool(
+    db_resource: DynamoDBServiceResource,
+    table_name: str,
+    pool_name: str,
+    now: int,
+    touch_seconds: int,
+) -> None:
+    # 最終参照時刻は archiver の判定にのみ使うため, 失敗しても警告に留める
+    table = db_resource.Table(table_name)
+    try:
+        table.update_item(
+            Key={"pool_name": pool_name},
+            UpdateExpression="SET last_accessed_at = :now",
+            ConditionExpression=(
+                "attribute_exists(pool_name) AND "
+                "(attribute_not_exists(last_accessed_at) OR last_accessed_at < :stale)"
+            ),
+            ExpressionAttributeValues={":now": now, ":stale": now - touch_seconds},
+        )
+    except botocore.exceptions.ClientError as error:
+        if error.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            log_exception(logger, logging.WARNING, "touch_pool failed")
+
+
+def rehydrate_pool(
+    db_resource: DynamoDBServiceResource,
+    s3: S3Client,
+    env: EnvParam,
+    cache_param: CacheParam,
+    pool: dict[str, Any],
+) -> CompactPool | None:
+    # 退避済みのアイテムを item テーブルへ書き戻し, 書き戻した内容で今回の出目を返す
+    pool_name = pool["pool_name"]
+    archive_key = f"{ARCHIVE_PREFIX}/{pool_name}.snapshot"
+    archive = load_snapshot(s3, cache_param, archive_key)
+    if archive is None:
+        return None
+    expire_at = {"expire_at": pool["expire_at"]} if "expire_at" in pool else {}
+    table = db_resource.Table(env.ITEM_TABLE_NAME)
+    try:
+        # 書き込む前に世代を進め, 同じ退避の archiver がこの後に消すのを止める
+        db_resource.Table(env.POOL_TABLE_NAME).update_item(
+            Key={"pool_name": pool_name},
+            UpdateExpression=(
+                "SET archive_generation = if_not_exists(archive_generation, :zero)"
+                " + :one"
+            ),
+            ConditionExpression="archived = :true",
+            ExpressionAttributeValues={":true": True, ":zero": 0, ":one": 1},
+        )
+        with table.batch_writer() as batch:
+            for i in range(len(archive)):
+                item = json.loads(archive.item(i), parse_float=Decimal)
+                batch.put_item(
+                    Item=item
+                    | {"pool_name": pool_name, "item_id": archive.item_ids[i]}
+                    | expire_at,
+                )
+        db_resource.Table(env.POOL_TABLE_NAME).update_item(
+            Key={"pool_name": pool_name},
+            UpdateExpression="SET last_accessed_at = :now REMOVE archived",
+            ConditionExpression="attribute_exists(pool_name)",
+            ExpressionAttributeValues={":now": int(time.time())},
+        )
+    except botocore.exceptions.ClientError as error:
+        if error.response["Error"]["Code"] in THROTTLING_ERROR_CODES:
+            raise ThrottlingError(
+                pool_name,
+                error.response["Error"]["Message"],
+            ) from error
+        elif error.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return None
+        else:
+            raise ServerError(
+                pool_name,
+                error.response["Error"]["Message"],
+            ) from error
+    # 書き戻しが確定してから退避先を消す. 残っても次の退避で上書きされる
+    delete_snapshot(s3, cache_param, archive_key)
+    logger.info({"rehydrated": pool_name, "num_item": len(archive)})
+    return archive
+
+
+def delete_snapshot(client: S3Client, cache_param: CacheParam, key: str) -> None:
+    try:
+        if cache_param.SNAPSHOT_BUCKET_NAME:
+            client.delete_object(Bucket=cache_param.SNAPSHOT_BUCKET_NAME, Key=key)
+        elif cache_param.SNAPSHOT_DIR:
+            (Path(cache_param.SNAPSHOT_DIR) / key).unlink(missing_ok=True)
+    except (botocore.exceptions.ClientError, OSError):
+        log_exception(logger, logging.WARNING, "delete_snapshot failed")
+
+
+def record_rolls(
+    db_resource: DynamoDBServiceResource,
+    table_name: str,
+    rolls: Counter[tuple[str, int]],
+) -> None:
+    # 出目の集計は結果の返却を妨げないよう, 失敗しても警告に留める
+    table = db_resource.Table(table_name)
+    for (pool_name, item_id), count in rolls.items():
+        try:
+            table.update_item(
+                Key={"pool_name": pool_name, "item_id": item_id},
+                UpdateExpression="ADD roll_count :count",
+                ExpressionAttributeValues={":count": count},
+            )
+        except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError):
+            log_exception(logger, logging.WARNING, "record_rolls failed")
+
+
+def dispatch_roll(
+    db_resource: DynamoDBServiceResource,
+    env: EnvParam,
+    stats_param: StatsParam,
+    pool_name: str,
+    item_id: int,
+) -> None:
+    # UpdateItem はレスポンスを待たせないよう dice 関数の非同期呼び出しに回す
+    # 関数名が無い (ローカル実行) ときだけその場で集計する
+    rolls = Counter({(pool_name, item_id): 1})
+    if not stats_param.STATS_FUNCTION_NAME:
+        record_rolls(db_resource, env.STATS_TABLE_NAME, rolls)
+        return
+    try:
+        lambda_client.invoke(
+            FunctionName=stats_param.STATS_FUNCTION_NAME,
+            InvocationType="Event",
+            Payload=json.dumps(
+                {"record_rolls": [[p, i, c] for (p, i), c in rolls.items()]},
+            ).encode(),
+        )
+    except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError):
+        log_exception(logger, logging.WARNING, "dispatch_roll failed")
 
 
 class Response(NamedTuple):
     status_code: int
-    message: str | dict
+    # bytes は直列化済みの JSON としてそのまま埋め込む
+    message: str | dict | bytes
+    retry_after: int | None = None
 
     def data(self: Self) -> dict[str, Any]:
-        return {
-            "statusCode": self.status_code,
-            "headers": {
-                "Content-Type": "application/json",
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Methods": "GET, POST, DELETE",
-                "Access-Control-Allow-Credentials": True,
-                "Access-Control-Allow-Headers": "origin, x-requested-with",
-            },
-            "body": json.dumps(
+        headers: dict[str, Any] = {
+            "Content-Type": "application/json",
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "GET, POST, DELETE",
+            "Access-Control-Allow-Credentials": True,
+            "Access-Control-Allow-Headers": "origin, x-requested-with",
+        }
+        if self.retry_after is not None:
+            headers["Retry-After"] = str(self.retry_after)
+        if isinstance(self.message, bytes):
+            body = (b'{"message": ' + self.message + b"}").decode()
+        else:
+            body = json.dumps(
                 {
                     "message": self.message,
                 },
                 default=decimal_default_proc,
-            ),
+            )
+        return {
+            "statusCode": self.status_code,
+            "headers": headers,
+            "body": body,
             "isBase64Encoded": False,
         }
 
 
-def service(
+def service(  # noqa: PLR0913
     body: ApiEvent,
     db_resource: DynamoDBServiceResource,
+    s3: S3Client,
     env: EnvParam,
+    cache_param: CacheParam,
+    archive_param: ArchiveParam,
+    stats_param: StatsParam,
 ) -> Response:
+    pool_name = body.storage_name()
+    if pool_name in cache_param.HOT_POOLS and not pool_cache.oversized(
+        pool_name,
+        cache_param.CACHE_TTL_SECONDS,
+    ):
+        pool = pool_cache.get(pool_name, cache_param.CACHE_TTL_SECONDS)
+        if pool is None:
+            pool = load_hot_pool(pool_name, db_resource, s3, env, cache_param)
+        if len(pool) > 0:
+            index = random.randrange(len(pool))
+            dispatch_roll(
+                db_resource,
+                env,
+                stats_param,
+                pool_name,
+                pool.item_ids[index],
+            )
+            return Response(
+                status_code=200,
+                message=pool.item(index),
+            )
     response_pool = get_item(
         db_resource=db_resource,
         table_name=env.POOL_TABLE_NAME,
-        key={"pool_name": body.pool_name},
+        key={"pool_name": pool_name},
     )
     if response_pool is None:
         raise ClientError(
-            input_param=body.pool_name,
+            input_param=pool_name,
             message=f"pool_name is empty: {body.pool_name}",
         )
-    key = {
-        "pool_name": body.pool_name,
-        "item_id": random.randint(0, response_pool["num_item"] - 1),
+    now = int(time.time())
+    # 読み込んだ行で判定し, 記録が新しいうちは書き込みを送らない
+    if int(response_pool.get("last_accessed_at", 0)) < (
+        now - archive_param.ACCESS_TOUCH_SECONDS
+    ):
+        touch_pool(
+            db_resource=db_resource,
+            table_name=env.POOL_TABLE_NAME,
+            pool_name=pool_name,
+            now=now,
+            touch_seconds=archive_param.ACCESS_TOUCH_SECONDS,
+        )
+    if response_pool.get("archived", False):
+        # 退避中のプールは退避先から書き戻す
+        archive = rehydrate_pool(db_resource, s3, env, cache_param, response_pool)
+        if archive is None or len(archive) == 0:
+            raise ServerError(
+                input_param=pool_name,
+                message="archive dose not exist",
+            )
+        index = random.randrange(len(archive))
+        dispatch_roll(db_resource, env, stats_param, pool_name, archive.item_ids[index])
+        return Response(
+            status_code=200,
+            message=archive.item(index),
+        )
+    key: dict[str, Any] = {
+        "pool_name": pool_name,
+        "item_id": random.randint(0, int(response_pool["num_item"]) - 1),
     }
     response_items = get_item(
         db_resource=db_resource,
@@ -139,37 +614,118 @@ def service(
             input_param=json.dumps(key),
             message="item dose not exist",
         )
+    dispatch_roll(db_resource, env, stats_param, pool_name, key["item_id"])
     return Response(
         status_code=200,
-        message=response_items,
+        message=public_item(response_items) | {"pool_name": body.pool_name},
     )
 
 
-@logger.inject_lambda_context(
-    correlation_id_path="requestContext.requestId",
-)
-def lambda_handler(event: dict[str, Any], context: LambdaContext) -> dict[str, Any]:
+def rehydrate_request(pool_name: str) -> dict[str, Any]:
+    # compound_dice / simulate から退避済みプールの書き戻しを依頼される
+    env = EnvParam.from_env()
+    pool = get_item(
+        db_resource=dynamodb_resource,
+        table_name=env.POOL_TABLE_NAME,
+        key={"pool_name": pool_name},
+    )
+    if pool is None or not pool.get("archived", False):
+        return {"archived": False}
+    archive = rehydrate_pool(
+        db_resource=dynamodb_resource,
+        s3=s3_client,
+        env=env,
+        cache_param=CacheParam.from_env(),
+        pool=pool,
+    )
+    return {"archived": archive is None}
+
+
+def handle_request(event: dict[str, Any]) -> dict[str, Any]:
     try:
+        body = ApiEvent.from_event(event)
+        tenant_limiter.acquire(body.tenant_id, TenantParam.from_env())
         return service(
-            body=ApiEvent.from_event(event),
+            body=body,
             db_resource=dynamodb_resource,
+            s3=s3_client,
             env=EnvParam.from_env(),
+            cache_param=CacheParam.from_env(),
+            archive_param=ArchiveParam.from_env(),
+            stats_param=StatsParam.from_env(),
         ).data()
     except ServerError:
-        logger.error(traceback.format_exc())
+        log_exception(logger, logging.ERROR, "server error")
         return Response(
             status_code=500,
             message="internal server error. Please access again after some time.",
         ).data()
+    except ThrottlingError:
+        log_exception(logger, logging.WARNING, "throttled")
+        return Response(
+            status_code=429,
+            message="too many requests. Please retry after some time.",
+            retry_after=int(os.environ.get("RETRY_AFTER_SECONDS", "1")),
+        ).data()
     except ClientError as ce:
-        logger.warning(traceback.format_exc())
+        log_exception(logger, logging.WARNING, "client error")
         return Response(
             status_code=400,
             message=f"client error. {ce.message}",
         ).data()
     except Exception:
-        logger.error(traceback.format_exc())
+        log_exception(logger, logging.ERROR, "unexpected error")
         return Response(
             status_code=500,
             message="internal server error. Please contact the operator.",
         ).data()
+
+
+@profiled(logger)
+@logger.inject_lambda_context(
+    correlation_id_path="requestContext.requestId",
+)
+def lambda_handler(event: dict[str, Any], context: LambdaContext) -> dict[str, Any]:
+    # compound_dice / simulate からの書き戻しと, 自身からの出目の集計の依頼
+    if "rehydrate_pool" in event:
+        return rehydrate_request(event["rehydrate_pool"])
+    if "record_rolls" in event:
+        record_rolls(
+            db_resource=dynamodb_resource,
+            table_name=EnvParam.from_env().STATS_TABLE_NAME,
+            rolls=Counter({(p, int(i)): int(c) for p, i, c in event["record_rolls"]}),
+        )
+        return {}
+    return handle_request(event)
+
+
+def warm_up() -> None:
+    # 認証情報の取得, TLS 接続の確立, ホットプールの読み込みを初期化時に済ませる
+    try:
+        env = EnvParam.from_env()
+        dynamodb_resource.Table(env.POOL_TABLE_NAME).get_item(
+            Key={"pool_name": "__warm_up__"},
+        )
+        cache_param = CacheParam.from_env()
+        for pool_name in cache_param.HOT_POOLS:
+            load_hot_pool(pool_name, dynamodb_resource, s3_client, env, cache_param)
+    except Exception:
+        log_exception(logger, logging.WARNING, "warm_up failed")
+
+
+def after_restore() -> None:
+    # スナップショットから復元されたインスタンス間で乱数列と接続を共有しないようにする
+    global dynamodb_resource, s3_client, lambda_client  # noqa: PLW0603
+    random.seed()
+    dynamodb_resource = boto3.resource("dynamodb", config=boto_config)
+    s3_client = boto3.client("s3", config=boto_config)
+    lambda_client = boto3.client("lambda")
+    warm_up()
+
+
+if os.environ.get("AWS_LAMBDA_INITIALIZATION_TYPE") == "provisioned-concurrency":
+    warm_up()
+
+if snapshot_restore_py is not None:
+    snapshot_restore_py.register_before_snapshot(warm_up)
+    snapshot_restore_py.register_after_restore(after_restore)
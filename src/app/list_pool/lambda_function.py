@@ -1,27 +1,50 @@
 import json
+import logging
 import os
-import traceback
+import re
+import urllib.parse
 from typing import Any, NamedTuple, Self
 
 import boto3
 import botocore
 from aws_lambda_powertools.logging import Logger
 from aws_lambda_powertools.utilities.typing import LambdaContext
+from botocore.config import Config
+from common import (
+    TENANT_SEPARATOR,
+    THROTTLING_ERROR_CODES,
+    ClientError,
+    ServerError,
+    TenantLimiter,
+    ThrottlingError,
+    log_exception,
+    rest_event,
+    tenant_from_event,
+)
 from mypy_boto3_dynamodb import DynamoDBClient
+from profiler import profiled
 
-logger = Logger()
-dynamodb_client = boto3.client("dynamodb")
-
-
-class ClientError(Exception):
-    def __init__(self: Self, input_param: str, message: str) -> None:
-        self.message = message
-        super().__init__(f"{message}: {input_param}")
+try:
+    # SnapStart 環境でのみ提供されるランタイムフック
+    import snapshot_restore_py
+except ImportError:
+    snapshot_restore_py = None
 
+logger = Logger()
+# adaptive モード: リトライ枠 (トークンバケット) とクライアント側のレート制限
+boto_config = Config(
+    retries={
+        "mode": "adaptive",
+        "max_attempts": int(os.environ.get("DYNAMODB_MAX_ATTEMPTS", "3")),
+    },
+)
+dynamodb_client = boto3.client("dynamodb", config=boto_config)
 
-class ServerError(Exception):
-    def __init__(self: Self, input_param: str, message: str) -> None:
-        super().__init__(f"{message}: {input_param}")
+BATCH_GET_MAX_KEYS = 100
+# InfraConstruct で pool テーブルに定義するテナント別の GSI
+TENANT_INDEX_NAME = "tenant_id"
+# HTTP API / 関数 URL で受けるリソースパス
+ROUTE_PATTERN = re.compile(r"/pools$")
 
 
 class EnvParam(NamedTuple):
@@ -38,6 +61,55 @@ class EnvParam(NamedTuple):
             ) from e
 
 
+class CatalogParam(NamedTuple):
+    # 空のときはプールの版数を返さない
+    CATALOG_TABLE_NAME: str
+    SNAPSHOT_PATH_PREFIX: str
+
+    @classmethod
+    def from_env(cls: type["CatalogParam"]) -> "CatalogParam":
+        return CatalogParam(
+            CATALOG_TABLE_NAME=os.environ.get("CATALOG_TABLE_NAME", ""),
+            SNAPSHOT_PATH_PREFIX=os.environ.get("SNAPSHOT_PATH_PREFIX", "/snapshots"),
+        )
+
+    def snapshot_path(self: Self, storage_name: str, version: int) -> str:
+        # 版数をキャッシュキーに含め, 内容が変わるたびに別の URL として配信させる
+        name = urllib.parse.quote(storage_name, safe="")
+        return f"{self.SNAPSHOT_PATH_PREFIX}/{name}.snapshot?v={version}"
+
+
+class TenantParam(NamedTuple):
+    TENANT_HEADER: str
+    TENANT_RATE_LIMIT: float
+    TENANT_BURST: float
+
+    @classmethod
+    def from_env(cls: type["TenantParam"]) -> "TenantParam":
+        return TenantParam(
+            TENANT_HEADER=os.environ.get("TENANT_HEADER", "X-Tenant-Id"),
+            TENANT_RATE_LIMIT=float(os.environ.get("TENANT_RATE_LIMIT", "0")),
+            TENANT_BURST=float(os.environ.get("TENANT_BURST", "10")),
+        )
+
+
+tenant_limiter = TenantLimiter()
+
+
+class ApiEvent(NamedTuple):
+    tenant_id: str
+    versions: bool
+
+    @classmethod
+    def from_event(cls: type["ApiEvent"], event: dict[str, Any]) -> "ApiEvent":
+        event = rest_event(event, ROUTE_PATTERN)
+        query = event.get("queryStringParameters") or {}
+        return ApiEvent(
+            tenant_id=tenant_from_event(event, TenantParam.from_env().TENANT_HEADER),
+            versions=query.get("versions", "false") == "true",
+        )
+
+
 def scan_items(client: DynamoDBClient, db_name: str, query: str) -> list[str]:
     paginator = client.get_paginator("scan")
     response_iterator = paginator.paginate(
@@ -51,6 +123,11 @@ def scan_items(client: DynamoDBClient, db_name: str, query: str) -> list[str]:
                 query,
                 error.response["Error"]["Message"],
             ) from error
+        elif error.response["Error"]["Code"] in THROTTLING_ERROR_CODES:
+            raise ThrottlingError(
+                query,
+                error.response["Error"]["Message"],
+            ) from error
         elif error.response["Error"]["Code"] == "ResourceNotFoundException":
             return []
         else:
@@ -60,20 +137,109 @@ def scan_items(client: DynamoDBClient, db_name: str, query: str) -> list[str]:
             ) from error
 
 
+def query_tenant_pools(
+    client: DynamoDBClient,
+    db_name: str,
+    tenant_id: str,
+    query: str,
+) -> list[str]:
+    paginator = client.get_paginator("query")
+    response_iterator = paginator.paginate(
+        TableName=db_name,
+        IndexName=TENANT_INDEX_NAME,
+        KeyConditions={
+            "tenant_id": {
+                "ComparisonOperator": "EQ",
+                "AttributeValueList": [{"S": tenant_id}],
+            },
+        },
+    )
+    try:
+        return list(response_iterator.search(query))
+    except botocore.exceptions.ClientError as error:
+        if error.response["Error"]["Code"] == "InternalServerError":
+            raise ServerError(
+                query,
+                error.response["Error"]["Message"],
+            ) from error
+        elif error.response["Error"]["Code"] in THROTTLING_ERROR_CODES:
+            raise ThrottlingError(
+                query,
+                error.response["Error"]["Message"],
+            ) from error
+        elif error.response["Error"]["Code"] == "ResourceNotFoundException":
+            return []
+        else:
+            raise ClientError(
+                query,
+                error.response["Error"]["Message"],
+            ) from error
+
+
+def get_versions(
+    client: DynamoDBClient,
+    db_name: str,
+    pool_names: list[str],
+) -> dict[str, tuple[int, bool]]:
+    # カタログの版数 (プールの世代) とスナップショットの書き込みに失敗したかどうか.
+    # カタログ未反映のプールは 0 とする
+    versions = {x: (0, False) for x in pool_names}
+    for i in range(0, len(pool_names), BATCH_GET_MAX_KEYS):
+        request: dict[str, Any] = {
+            db_name: {
+                "Keys": [
+                    {"pool_name": {"S": x}}
+                    for x in pool_names[i : i + BATCH_GET_MAX_KEYS]
+                ],
+                "ProjectionExpression": "pool_name, version, no_snapshot",
+            },
+        }
+        while request:
+            try:
+                response = client.batch_get_item(RequestItems=request)
+            except botocore.exceptions.ClientError as error:
+                if error.response["Error"]["Code"] == "InternalServerError":
+                    raise ServerError(
+                        db_name,
+                        error.response["Error"]["Message"],
+                    ) from error
+                elif error.response["Error"]["Code"] in THROTTLING_ERROR_CODES:
+                    raise ThrottlingError(
+                        db_name,
+                        error.response["Error"]["Message"],
+                    ) from error
+                else:
+                    raise ClientError(
+                        db_name,
+                        error.response["Error"]["Message"],
+                    ) from error
+            for row in response["Responses"].get(db_name, []):
+                versions[row["pool_name"]["S"]] = (
+                    int(row["version"]["N"]),
+                    row.get("no_snapshot", {}).get("BOOL", False),
+                )
+            request = dict(response.get("UnprocessedKeys") or {})
+    return versions
+
+
 class Response(NamedTuple):
     status_code: int
-    message: str | list[str]
+    message: str | list[str] | list[dict[str, Any]]
+    retry_after: int | None = None
 
     def data(self: Self) -> dict[str, Any]:
+        headers: dict[str, Any] = {
+            "Content-Type": "application/json",
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "GET, POST, DELETE",
+            "Access-Control-Allow-Credentials": True,
+            "Access-Control-Allow-Headers": "origin, x-requested-with",
+        }
+        if self.retry_after is not None:
+            headers["Retry-After"] = str(self.retry_after)
         return {
             "statusCode": self.status_code,
-            "headers": {
-                "Content-Type": "application/json",
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Methods": "GET, POST, DELETE",
-                "Access-Control-Allow-Credentials": True,
-                "Access-Control-Allow-Headers": "origin, x-requested-with",
-            },
+            "headers": headers,
             "body": json.dumps(
                 {
                     "message": self.message,
@@ -84,44 +250,119 @@ class Response(NamedTuple):
 
 
 def service(
+    body: ApiEvent,
     db_client: DynamoDBClient,
     env: EnvParam,
+    catalog_param: CatalogParam,
 ) -> Response:
-    response_items = scan_items(
-        client=db_client,
-        db_name=env.POOL_TABLE_NAME,
-        query="Items[].pool_name.S",
-    )
+    if body.tenant_id == "":
+        # テナント未指定の場合は接頭辞のない (テナントに属さない) プールのみ返す
+        prefix = ""
+        pool_names = [
+            x
+            for x in scan_items(
+                client=db_client,
+                db_name=env.POOL_TABLE_NAME,
+                query="Items[].pool_name.S",
+            )
+            if TENANT_SEPARATOR not in x
+        ]
+    else:
+        prefix = f"{body.tenant_id}{TENANT_SEPARATOR}"
+        pool_names = query_tenant_pools(
+            client=db_client,
+            db_name=env.POOL_TABLE_NAME,
+            tenant_id=body.tenant_id,
+            query="Items[].pool_name.S",
+        )
+    if not body.versions or not catalog_param.CATALOG_TABLE_NAME:
+        return Response(
+            status_code=200,
+            message=[x.removeprefix(prefix) for x in pool_names],
+        )
+    versions = get_versions(db_client, catalog_param.CATALOG_TABLE_NAME, pool_names)
+    # 版数ごとの URL は長期キャッシュされるため, 内容が版数と対応しないものは返さない.
+    # カタログ未反映の 0 は置き換えても変わらず, 書き込みに失敗したものは中身がない
     return Response(
         status_code=200,
-        message=response_items,
+        message=[
+            {
+                "pool_name": x.removeprefix(prefix),
+                "version": version,
+                "snapshot": (
+                    catalog_param.snapshot_path(x, version)
+                    if version > 0 and not no_snapshot
+                    else None
+                ),
+            }
+            for x in pool_names
+            for version, no_snapshot in [versions[x]]
+        ],
     )
 
 
+@profiled(logger)
 @logger.inject_lambda_context(
     correlation_id_path="requestContext.requestId",
 )
 def lambda_handler(event: dict[str, Any], context: LambdaContext) -> dict[str, Any]:
     try:
+        body = ApiEvent.from_event(event)
+        tenant_limiter.acquire(body.tenant_id, TenantParam.from_env())
         return service(
+            body=body,
             db_client=dynamodb_client,
             env=EnvParam.from_env(),
+            catalog_param=CatalogParam.from_env(),
         ).data()
     except ServerError:
-        logger.error(traceback.format_exc())
+        log_exception(logger, logging.ERROR, "server error")
         return Response(
             status_code=500,
             message="internal server error. Please access again after some time.",
         ).data()
+    except ThrottlingError:
+        log_exception(logger, logging.WARNING, "throttled")
+        return Response(
+            status_code=429,
+            message="too many requests. Please retry after some time.",
+            retry_after=int(os.environ.get("RETRY_AFTER_SECONDS", "1")),
+        ).data()
     except ClientError as ce:
-        logger.warning(traceback.format_exc())
+        log_exception(logger, logging.WARNING, "client error")
         return Response(
             status_code=400,
             message=f"client error. {ce.message}",
         ).data()
     except Exception:
-        logger.error(traceback.format_exc())
+        log_exception(logger, logging.ERROR, "unexpected error")
         return Response(
             status_code=500,
             message="internal server error. Please contact the operator.",
         ).data()
+
+
+def warm_up() -> None:
+    # 認証情報の取得と TLS 接続の確立を初期化フェーズで済ませておく
+    try:
+        dynamodb_client.get_item(
+            TableName=EnvParam.from_env().POOL_TABLE_NAME,
+            Key={"pool_name": {"S": "__warm_up__"}},
+        )
+    except Exception:
+        log_exception(logger, logging.WARNING, "warm_up failed")
+
+
+def after_restore() -> None:
+    # スナップショットから復元されたインスタンス間で接続を共有しないようにする
+    global dynamodb_client  # noqa: PLW0603
+    dynamodb_client = boto3.client("dynamodb", config=boto_config)
+    warm_up()
+
+
+if os.environ.get("AWS_LAMBDA_INITIALIZATION_TYPE") == "provisioned-concurrency":
+    warm_up()
+
+if snapshot_restore_py is not None:
+    snapshot_restore_py.register_before_snapshot(warm_up)
+    snapshot_restore_py.register_after_restore(after_restore)
@@ -0,0 +1,40 @@
+import hmac
+import logging
+from typing import Any
+
+import botocore
+from aws_lambda_powertools.logging import Logger
+from aws_lambda_powertools.utilities.typing import LambdaContext
+from common import OriginParam, log_exception, origin_secret
+from profiler import profiled
+
+logger = Logger()
+
+
+def verify(headers: dict[str, str], param: OriginParam) -> bool:
+    # ヘッダ名は HTTP API で小文字に揃えられる. 値は比較時間から推測されないよう比べる
+    value = {k.lower(): v for k, v in headers.items()}.get(
+        param.ORIGIN_VERIFY_HEADER.lower(),
+        "",
+    )
+    return hmac.compare_digest(
+        value.encode(),
+        origin_secret(param.ORIGIN_SECRET_ARN).encode(),
+    )
+
+
+@profiled(logger)
+@logger.inject_lambda_context(
+    correlation_id_path="requestContext.requestId",
+)
+def lambda_handler(event: dict[str, Any], context: LambdaContext) -> dict[str, Any]:
+    # HTTP API の Lambda オーソライザー (簡易レスポンス).
+    # CloudFront を経由した要求だけを通す
+    try:
+        authorized = verify(event.get("headers") or {}, OriginParam.from_env())
+    except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError):
+        log_exception(logger, logging.ERROR, "origin_secret failed")
+        authorized = False
+    if not authorized:
+        logger.warning("origin verify failed")
+    return {"isAuthorized": authorized}
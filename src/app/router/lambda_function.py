@@ -0,0 +1,128 @@
+import importlib
+import json
+import os
+import re
+from types import ModuleType
+from typing import Any, NamedTuple, Self
+
+from aws_lambda_powertools.logging import Logger
+from aws_lambda_powertools.utilities.typing import LambdaContext
+
+try:
+    # SnapStart 環境でのみ提供されるランタイムフック
+    import snapshot_restore_py
+except ImportError:
+    snapshot_restore_py = None
+
+logger = Logger()
+
+# (メソッド, リソースパス, 委譲先の関数). 各関数の lambda_handler をそのまま呼び出す
+ROUTES = [
+    ("GET", re.compile(r"/pools$"), "list_pool"),
+    ("POST", re.compile(r"/pools/[^/]+$"), "create_pool"),
+    ("DELETE", re.compile(r"/pools/[^/]+$"), "delete_pool"),
+    ("GET", re.compile(r"/pools/[^/]+/dice$"), "dice"),
+]
+# 関数ごとに値の異なる環境変数は "<関数名の大文字>__<変数名>" で渡される
+ROUTE_ENV_SEPARATOR = "__"
+# 1 つのクライアント (接続プール) をすべてのルートで使い回す
+SHARED_CLIENTS = ["dynamodb_client", "dynamodb_resource", "s3_client"]
+
+
+class Response(NamedTuple):
+    status_code: int
+    message: str
+
+    def data(self: Self) -> dict[str, Any]:
+        return {
+            "statusCode": self.status_code,
+            "headers": {
+                "Content-Type": "application/json",
+                "Access-Control-Allow-Origin": "*",
+                "Access-Control-Allow-Methods": "GET, POST, DELETE",
+                "Access-Control-Allow-Credentials": True,
+                "Access-Control-Allow-Headers": "origin, x-requested-with",
+            },
+            "body": json.dumps(
+                {
+                    "message": self.message,
+                },
+            ),
+        }
+
+
+def load_routes() -> dict[str, ModuleType]:
+    # デプロイ時は src/app 直下がルート, テストでは src.app パッケージ配下となる
+    package = __name__.rpartition(".")[0].rpartition(".")[0]
+    prefix = f"{package}." if package else ""
+    return {
+        name: importlib.import_module(f"{prefix}{name}.lambda_function")
+        for name in dict.fromkeys(x[2] for x in ROUTES)
+    }
+
+
+def route_environment(environ: dict[str, str]) -> dict[str, dict[str, str]]:
+    overrides: dict[str, dict[str, str]] = {x[2]: {} for x in ROUTES}
+    for key, value in environ.items():
+        name, separator, base = key.partition(ROUTE_ENV_SEPARATOR)
+        if separator and name.lower() in overrides:
+            overrides[name.lower()][base] = value
+    return overrides
+
+
+def apply_environment(name: str, overrides: dict[str, dict[str, str]]) -> None:
+    # 前のルートの値が残らないよう, 上書き対象の変数はルートごとに入れ替える
+    for key in set().union(*overrides.values()):
+        if key in overrides[name]:
+            os.environ[key] = overrides[name][key]
+        else:
+            os.environ.pop(key, None)
+
+
+def share_clients(modules: dict[str, ModuleType]) -> None:
+    for client_name in SHARED_CLIENTS:
+        owners = [x for x in modules.values() if hasattr(x, client_name)]
+        for module in owners[1:]:
+            setattr(module, client_name, getattr(owners[0], client_name))
+
+
+def resolve(event: dict[str, Any]) -> str | None:
+    # REST API (1.0) と HTTP API / 関数 URL (2.0) のどちらのイベントも受け付ける
+    if event.get("version") == "2.0":
+        method = event["requestContext"]["http"]["method"]
+        path = event.get("rawPath", "")
+    else:
+        method = event.get("httpMethod", "")
+        path = event.get("path", "")
+    for route_method, pattern, name in ROUTES:
+        if method == route_method and pattern.search(path):
+            return name
+    return None
+
+
+route_modules = load_routes()
+route_overrides = route_environment(dict(os.environ))
+share_clients(route_modules)
+
+
+@logger.inject_lambda_context(
+    correlation_id_path="requestContext.requestId",
+)
+def lambda_handler(event: dict[str, Any], context: LambdaContext) -> dict[str, Any]:
+    name = resolve(event)
+    if name is None:
+        path = event.get("path", event.get("rawPath"))
+        logger.warning("route not found", extra={"path": path})
+        return Response(status_code=404, message="not found.").data()
+    apply_environment(name, route_overrides)
+    response: dict[str, Any] = route_modules[name].lambda_handler(event, context)
+    return response
+
+
+def after_restore() -> None:
+    # 各関数が復元後に作り直したクライアントを改めて共有する
+    share_clients(route_modules)
+
+
+if snapshot_restore_py is not None:
+    snapshot_restore_py.register_after_restore(after_restore)
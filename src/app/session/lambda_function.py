@@ -0,0 +1,442 @@
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, NamedTuple, Self
+
+import boto3
+import botocore
+from aws_lambda_powertools.logging import Logger
+from aws_lambda_powertools.utilities.typing import LambdaContext
+from boto3.dynamodb.conditions import Key
+from botocore.config import Config
+from common import (
+    TENANT_SEPARATOR,
+    THROTTLING_ERROR_CODES,
+    ClientError,
+    ServerError,
+    ThrottlingError,
+    log_exception,
+    tenant_from_event,
+)
+from mypy_boto3_apigatewaymanagementapi import ApiGatewayManagementApiClient
+from mypy_boto3_dynamodb import DynamoDBServiceResource
+from mypy_boto3_lambda import LambdaClient
+from profiler import profiled
+
+try:
+    # SnapStart 環境でのみ提供されるランタイムフック
+    import snapshot_restore_py
+except ImportError:
+    snapshot_restore_py = None
+
+logger = Logger()
+# adaptive モード: リトライ枠 (トークンバケット) とクライアント側のレート制限
+boto_config = Config(
+    retries={
+        "mode": "adaptive",
+        "max_attempts": int(os.environ.get("DYNAMODB_MAX_ATTEMPTS", "3")),
+    },
+)
+dynamodb_resource = boto3.resource("dynamodb", config=boto_config)
+lambda_client = boto3.client("lambda")
+
+SESSION_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+# InfraConstruct で connection テーブルに定義するセッション別の GSI
+SESSION_INDEX_NAME = "session_key"
+
+
+class EnvParam(NamedTuple):
+    CONNECTION_TABLE_NAME: str
+    DICE_FUNCTION_NAME: str
+
+    @classmethod
+    def from_env(cls: type["EnvParam"]) -> "EnvParam":
+        try:
+            return EnvParam(**{k: os.environ[k] for k in EnvParam._fields})
+        except Exception as e:
+            raise ServerError(
+                json.dumps(os.environ),
+                "Required environment variables are not set.",
+            ) from e
+
+
+class SessionParam(NamedTuple):
+    TENANT_HEADER: str
+    CONNECTION_TTL_SECONDS: int
+    BROADCAST_BATCH_SIZE: int
+    BROADCAST_CONCURRENCY: int
+    WEBSOCKET_ENDPOINT_URL: str
+
+    @classmethod
+    def from_env(cls: type["SessionParam"]) -> "SessionParam":
+        return SessionParam(
+            TENANT_HEADER=os.environ.get("TENANT_HEADER", "X-Tenant-Id"),
+            # API Gateway の WebSocket 接続は最長 2 時間で切断される
+            CONNECTION_TTL_SECONDS=int(
+                os.environ.get("CONNECTION_TTL_SECONDS", "7200"),
+            ),
+            BROADCAST_BATCH_SIZE=int(os.environ.get("BROADCAST_BATCH_SIZE", "100")),
+            BROADCAST_CONCURRENCY=int(os.environ.get("BROADCAST_CONCURRENCY", "16")),
+            WEBSOCKET_ENDPOINT_URL=os.environ.get("WEBSOCKET_ENDPOINT_URL", ""),
+        )
+
+
+class Connection(NamedTuple):
+    connection_id: str
+    tenant_id: str
+    pool_name: str
+    session_id: str
+
+    @classmethod
+    def from_connect(
+        cls: type["Connection"],
+        event: dict[str, Any],
+        param: SessionParam,
+    ) -> "Connection":
+        query = event.get("queryStringParameters") or {}
+        try:
+            pool_name = query["pool_name"]
+            session_id = query["session_id"]
+        except Exception as e:
+            raise ClientError(json.dumps(query), "Invalid parameter.") from e
+        if (
+            TENANT_SEPARATOR in pool_name
+            or SESSION_ID_PATTERN.fullmatch(session_id) is None
+        ):
+            raise ClientError(pool_name, "Invalid parameter.")
+        return Connection(
+            connection_id=event["requestContext"]["connectionId"],
+            tenant_id=tenant_from_event(event, param.TENANT_HEADER),
+            pool_name=pool_name,
+            session_id=session_id,
+        )
+
+    def session_key(self: Self) -> str:
+        # テナント, プール, セッションの組で購読者をまとめる
+        return TENANT_SEPARATOR.join([self.tenant_id, self.pool_name, self.session_id])
+
+
+def endpoint_url(event: dict[str, Any], param: SessionParam) -> str:
+    if param.WEBSOCKET_ENDPOINT_URL:
+        return param.WEBSOCKET_ENDPOINT_URL
+    context = event["requestContext"]
+    return f"https://{context['domainName']}/{context['stage']}"
+
+
+# エンドポイントごとに使い回し, 呼び出しのたびにクライアントを作らない
+management_clients: dict[str, ApiGatewayManagementApiClient] = {}
+
+
+def management_client(url: str) -> ApiGatewayManagementApiClient:
+    client = management_clients.get(url)
+    if client is None:
+        client = boto3.client("apigatewaymanagementapi", endpoint_url=url)
+        management_clients[url] = client
+    return client
+
+
+def put_connection(
+    db_resource: DynamoDBServiceResource,
+    table_name: str,
+    connection: Connection,
+    expire_at: int,
+) -> None:
+    table = db_resource.Table(table_name)
+    try:
+        table.put_item(
+            Item=connection._asdict()
+            | {"session_key": connection.session_key(), "expire_at": expire_at},
+        )
+    except botocore.exceptions.ClientError as error:
+        if error.response["Error"]["Code"] in THROTTLING_ERROR_CODES:
+            raise ThrottlingError(
+                connection.connection_id,
+                error.response["Error"]["Message"],
+            ) from error
+        else:
+            raise ServerError(
+                connection.connection_id,
+                error.response["Error"]["Message"],
+            ) from error
+
+
+def get_connection(
+    db_resource: DynamoDBServiceResource,
+    table_name: str,
+    connection_id: str,
+) -> Connection | None:
+    table = db_resource.Table(table_name)
+    try:
+        item = table.get_item(Key={"connection_id": connection_id}).get("Item")
+    except botocore.exceptions.ClientError as error:
+        if error.response["Error"]["Code"] in THROTTLING_ERROR_CODES:
+            raise ThrottlingError(
+                connection_id,
+                error.response["Error"]["Message"],
+            ) from error
+        else:
+            raise ServerError(
+                connection_id,
+                error.response["Error"]["Message"],
+            ) from error
+    if item is None:
+        return None
+    return Connection(**{k: str(item[k]) for k in Connection._fields})
+
+
+def delete_connections(
+    db_resource: DynamoDBServiceResource,
+    table_name: str,
+    connection_ids: list[str],
+) -> None:
+    # 切断済みの接続は TTL でも消えるため, 失敗しても警告に留める
+    table = db_resource.Table(table_name)
+    try:
+        with table.batch_writer() as batch:
+            for connection_id in connection_ids:
+                batch.delete_item(Key={"connection_id": connection_id})
+    except botocore.exceptions.ClientError:
+        log_exception(logger, logging.WARNING, "delete_connections failed")
+
+
+def query_session(
+    db_resource: DynamoDBServiceResource,
+    table_name: str,
+    session_key: str,
+) -> list[str]:
+    table = db_resource.Table(table_name)
+    kwargs: dict[str, Any] = {
+        "IndexName": SESSION_INDEX_NAME,
+        "KeyConditionExpression": Key("session_key").eq(session_key),
+    }
+    connection_ids: list[str] = []
+    try:
+        while True:
+            response = table.query(**kwargs)
+            connection_ids.extend(str(x["connection_id"]) for x in response["Items"])
+            if "LastEvaluatedKey" not in response:
+                return connection_ids
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    except botocore.exceptions.ClientError as error:
+        if error.response["Error"]["Code"] in THROTTLING_ERROR_CODES:
+            raise ThrottlingError(
+                session_key,
+                error.response["Error"]["Message"],
+            ) from error
+        else:
+            raise ServerError(
+                session_key,
+                error.response["Error"]["Message"],
+            ) from error
+
+
+def invoke_dice(
+    client: LambdaClient,
+    function_name: str,
+    connection: Connection,
+    param: SessionParam,
+) -> dict[str, Any]:
+    # 出目は dice 関数に 1 回だけ振らせ, キャッシュや集計の処理をそのまま使う
+    headers = (
+        {param.TENANT_HEADER: connection.tenant_id} if connection.tenant_id else {}
+    )
+    response = client.invoke(
+        FunctionName=function_name,
+        Payload=json.dumps(
+            {
+                "headers": headers,
+                "pathParameters": {"pool_name": connection.pool_name},
+                "body": None,
+            },
+        ).encode(),
+    )
+    payload = json.loads(response["Payload"].read())
+    if "FunctionError" in response or "statusCode" not in payload:
+        raise ServerError(json.dumps(payload), "dice invocation failed")
+    result: dict[str, Any] = payload
+    return result
+
+
+def broadcast(
+    client: ApiGatewayManagementApiClient,
+    connection_ids: list[str],
+    data: bytes,
+    param: SessionParam,
+) -> list[str]:
+    # 一定数ずつ並列に送信し, 切断済みの接続 ID を返す
+    def post(connection_id: str) -> str | None:
+        try:
+            client.post_to_connection(ConnectionId=connection_id, Data=data)
+        except client.exceptions.GoneException:
+            return connection_id
+        except botocore.exceptions.ClientError:
+            log_exception(logger, logging.WARNING, "broadcast failed")
+        return None
+
+    gone: list[str] = []
+    with ThreadPoolExecutor(max_workers=param.BROADCAST_CONCURRENCY) as executor:
+        for start in range(0, len(connection_ids), param.BROADCAST_BATCH_SIZE):
+            batch = connection_ids[start : start + param.BROADCAST_BATCH_SIZE]
+            gone.extend(x for x in executor.map(post, batch) if x is not None)
+    return gone
+
+
+class Response(NamedTuple):
+    status_code: int
+    message: str | dict
+    retry_after: int | None = None
+
+    def data(self: Self) -> dict[str, Any]:
+        headers: dict[str, Any] = {"Content-Type": "application/json"}
+        if self.retry_after is not None:
+            headers["Retry-After"] = str(self.retry_after)
+        return {
+            "statusCode": self.status_code,
+            "headers": headers,
+            "body": json.dumps(
+                {
+                    "message": self.message,
+                },
+            ),
+            "isBase64Encoded": False,
+        }
+
+
+def roll(
+    event: dict[str, Any],
+    db_resource: DynamoDBServiceResource,
+    env: EnvParam,
+    param: SessionParam,
+) -> Response:
+    connection = get_connection(
+        db_resource=db_resource,
+        table_name=env.CONNECTION_TABLE_NAME,
+        connection_id=event["requestContext"]["connectionId"],
+    )
+    if connection is None:
+        raise ClientError(event["requestContext"]["connectionId"], "not connected")
+    result = invoke_dice(lambda_client, env.DICE_FUNCTION_NAME, connection, param)
+    client = management_client(endpoint_url(event, param))
+    if result["statusCode"] != 200:  # noqa: PLR2004
+        # 失敗はセッション全体に流さず, 振った本人にだけ返す
+        broadcast(client, [connection.connection_id], result["body"].encode(), param)
+        return Response(status_code=result["statusCode"], message="roll failed")
+    data = json.dumps(
+        {
+            "action": "roll",
+            "pool_name": connection.pool_name,
+            "session_id": connection.session_id,
+            "result": json.loads(result["body"])["message"],
+        },
+    ).encode()
+    connection_ids = query_session(
+        db_resource=db_resource,
+        table_name=env.CONNECTION_TABLE_NAME,
+        session_key=connection.session_key(),
+    )
+    gone = broadcast(client, connection_ids, data, param)
+    delete_connections(db_resource, env.CONNECTION_TABLE_NAME, gone)
+    logger.info(
+        {
+            "session_key": connection.session_key(),
+            "subscribers": len(connection_ids),
+            "gone": len(gone),
+        },
+    )
+    return Response(status_code=200, message="success")
+
+
+def service(
+    event: dict[str, Any],
+    db_resource: DynamoDBServiceResource,
+    env: EnvParam,
+    param: SessionParam,
+) -> Response:
+    route_key = event["requestContext"]["routeKey"]
+    if route_key == "$connect":
+        put_connection(
+            db_resource=db_resource,
+            table_name=env.CONNECTION_TABLE_NAME,
+            connection=Connection.from_connect(event, param),
+            expire_at=int(time.time()) + param.CONNECTION_TTL_SECONDS,
+        )
+        return Response(status_code=200, message="connected")
+    if route_key == "$disconnect":
+        delete_connections(
+            db_resource=db_resource,
+            table_name=env.CONNECTION_TABLE_NAME,
+            connection_ids=[event["requestContext"]["connectionId"]],
+        )
+        return Response(status_code=200, message="disconnected")
+    if route_key == "roll":
+        return roll(event, db_resource, env, param)
+    raise ClientError(route_key, "unknown action")
+
+
+@profiled(logger)
+@logger.inject_lambda_context(
+    correlation_id_path="requestContext.requestId",
+)
+def lambda_handler(event: dict[str, Any], context: LambdaContext) -> dict[str, Any]:
+    try:
+        return service(
+            event=event,
+            db_resource=dynamodb_resource,
+            env=EnvParam.from_env(),
+            param=SessionParam.from_env(),
+        ).data()
+    except ServerError:
+        log_exception(logger, logging.ERROR, "server error")
+        return Response(
+            status_code=500,
+            message="internal server error. Please access again after some time.",
+        ).data()
+    except ThrottlingError:
+        log_exception(logger, logging.WARNING, "throttled")
+        return Response(
+            status_code=429,
+            message="too many requests. Please retry after some time.",
+            retry_after=int(os.environ.get("RETRY_AFTER_SECONDS", "1")),
+        ).data()
+    except ClientError as ce:
+        log_exception(logger, logging.WARNING, "client error")
+        return Response(
+            status_code=400,
+            message=f"client error. {ce.message}",
+        ).data()
+    except Exception:
+        log_exception(logger, logging.ERROR, "unexpected error")
+        return Response(
+            status_code=500,
+            message="internal server error. Please contact the operator.",
+        ).data()
+
+
+def warm_up() -> None:
+    # 認証情報の取得と TLS 接続の確立を初期化フェーズで済ませておく
+    try:
+        dynamodb_resource.Table(EnvParam.from_env().CONNECTION_TABLE_NAME).get_item(
+            Key={"connection_id": "__warm_up__"},
+        )
+    except Exception:
+        log_exception(logger, logging.WARNING, "warm_up failed")
+
+
+def after_restore() -> None:
+    # スナップショットから復元されたインスタンス間で接続を共有しないようにする
+    global dynamodb_resource, lambda_client  # noqa: PLW0603
+    dynamodb_resource = boto3.resource("dynamodb", config=boto_config)
+    lambda_client = boto3.client("lambda")
+    management_clients.clear()
+    warm_up()
+
+
+if os.environ.get("AWS_LAMBDA_INITIALIZATION_TYPE") == "provisioned-concurrency":
+    warm_up()
+
+if snapshot_restore_py is not None:
+    snapshot_restore_py.register_before_snapshot(warm_up)
+    snapshot_restore_py.register_after_restore(after_restore)
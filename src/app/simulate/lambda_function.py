@@ -0,0 +1,529 @@
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, NamedTuple, Self
+
+import boto3
+import botocore
+import numpy as np
+from aws_lambda_powertools.logging import Logger
+from aws_lambda_powertools.utilities.typing import LambdaContext
+from boto3.dynamodb.conditions import Key
+from botocore.config import Config
+from common import (
+    TENANT_SEPARATOR,
+    THROTTLING_ERROR_CODES,
+    ClientError,
+    ServerError,
+    ThrottlingError,
+    decimal_default_proc,
+    log_exception,
+    rehydrate_pool,
+    rest_event,
+    storage_name,
+    tenant_from_event,
+)
+from mypy_boto3_dynamodb import DynamoDBServiceResource
+from mypy_boto3_lambda import LambdaClient
+from profiler import profiled
+
+try:
+    # SnapStart 環境でのみ提供されるランタイムフック
+    import snapshot_restore_py
+except ImportError:
+    snapshot_restore_py = None
+
+logger = Logger()
+# adaptive モード: リトライ枠 (トークンバケット) とクライアント側のレート制限
+boto_config = Config(
+    retries={
+        "mode": "adaptive",
+        "max_attempts": int(os.environ.get("DYNAMODB_MAX_ATTEMPTS", "3")),
+    },
+)
+dynamodb_resource = boto3.resource("dynamodb", config=boto_config)
+lambda_client = boto3.client("lambda")
+
+# 1 回の乱数生成で確保する配列の長さ (メモリ使用量を一定に保つ)
+DRAW_BATCH_SIZE = 1_000_000
+
+# DynamoDB の TTL 属性など, レスポンスに含めない内部用の属性
+INTERNAL_ATTRIBUTES = ("expire_at", "content_hash")
+# HTTP API / 関数 URL で受けるリソースパス
+ROUTE_PATTERN = re.compile(r"/pools/(?P<pool_name>[^/]+)/simulate$")
+
+
+class EnvParam(NamedTuple):
+    POOL_TABLE_NAME: str
+    ITEM_TABLE_NAME: str
+
+    @classmethod
+    def from_env(cls: type["EnvParam"]) -> "EnvParam":
+        try:
+            return EnvParam(**{k: os.environ[k] for k in EnvParam._fields})
+        except Exception as e:
+            raise ServerError(
+                json.dumps(os.environ),
+                "Required environment variables are not set.",
+            ) from e
+
+
+class SimulateParam(NamedTuple):
+    MAX_TRIALS: int
+    TRIALS_PER_INVOCATION: int
+    MAX_SAMPLES: int
+    CACHE_TTL_SECONDS: float
+
+    @classmethod
+    def from_env(cls: type["SimulateParam"]) -> "SimulateParam":
+        return SimulateParam(
+            MAX_TRIALS=int(os.environ.get("MAX_TRIALS", "1000000000")),
+            TRIALS_PER_INVOCATION=int(
+                os.environ.get("TRIALS_PER_INVOCATION", "50000000"),
+            ),
+            MAX_SAMPLES=int(os.environ.get("MAX_SAMPLES", "100")),
+            CACHE_TTL_SECONDS=float(os.environ.get("CACHE_TTL_SECONDS", "60")),
+        )
+
+
+class ArchiveParam(NamedTuple):
+    # 退避済みプールの書き戻しを依頼する関数. 空のときは書き戻さない
+    DICE_FUNCTION_NAME: str
+
+    @classmethod
+    def from_env(cls: type["ArchiveParam"]) -> "ArchiveParam":
+        return ArchiveParam(
+            DICE_FUNCTION_NAME=os.environ.get("DICE_FUNCTION_NAME", ""),
+        )
+
+
+class TenantParam(NamedTuple):
+    TENANT_HEADER: str
+
+    @classmethod
+    def from_env(cls: type["TenantParam"]) -> "TenantParam":
+        return TenantParam(
+            TENANT_HEADER=os.environ.get("TENANT_HEADER", "X-Tenant-Id"),
+        )
+
+
+class ApiEvent(NamedTuple):
+    tenant_id: str
+    pool_name: str
+    trials: int
+    weighted: bool
+    samples: int
+    seed: int | None
+
+    @classmethod
+    def from_event(cls: type["ApiEvent"], event: dict[str, Any]) -> "ApiEvent":
+        event = rest_event(event, ROUTE_PATTERN)
+        try:
+            body = json.loads(event["body"]) if event.get("body") else {}
+            api_event = ApiEvent(
+                tenant_id=tenant_from_event(
+                    event,
+                    TenantParam.from_env().TENANT_HEADER,
+                ),
+                pool_name=event["pathParameters"]["pool_name"],
+                trials=int(body["trials"]),
+                weighted=body.get("weighted", False),
+                samples=int(body.get("samples", 0)),
+                seed=int(body["seed"]) if body.get("seed") is not None else None,
+            )
+        except Exception as e:
+            raise ClientError(event["body"], "Invalid parameter.") from e
+        # "false" のような文字列を真とみなさないよう, JSON の真偽値だけを受け付ける
+        if (
+            api_event.trials <= 0
+            or not isinstance(api_event.weighted, bool)
+            or api_event.samples < 0
+            or TENANT_SEPARATOR in api_event.pool_name
+        ):
+            raise ClientError(event["body"], "Invalid parameter.")
+        return api_event
+
+    def storage_name(self: Self) -> str:
+        return storage_name(self.tenant_id, self.pool_name)
+
+
+class PoolCache:
+    def __init__(self: Self) -> None:
+        self._pools: dict[str, tuple[float, list[dict[str, Any]]]] = {}
+
+    def get(self: Self, pool_name: str, ttl: float) -> list[dict[str, Any]] | None:
+        cached = self._pools.get(pool_name)
+        if cached is None or time.monotonic() - cached[0] > ttl:
+            return None
+        return cached[1]
+
+    def put(self: Self, pool_name: str, items: list[dict[str, Any]]) -> None:
+        self._pools[pool_name] = (time.monotonic(), items)
+
+    def discard(self: Self, pool_name: str) -> None:
+        self._pools.pop(pool_name, None)
+
+    def clear(self: Self) -> None:
+        self._pools.clear()
+
+
+pool_cache = PoolCache()
+
+
+def get_item(
+    db_resource: DynamoDBServiceResource,
+    table_name: str,
+    key: dict,
+) -> dict[str, Any] | None:
+    table = db_resource.Table(table_name)
+    try:
+        return table.get_item(Key=key).get("Item")
+    except botocore.exceptions.ClientError as error:
+        if error.response["Error"]["Code"] == "InternalServerError":
+            raise ServerError(
+                json.dumps(key),
+                error.response["Error"]["Message"],
+            ) from error
+        elif error.response["Error"]["Code"] in THROTTLING_ERROR_CODES:
+            raise ThrottlingError(
+                json.dumps(key),
+                error.response["Error"]["Message"],
+            ) from error
+        elif error.response["Error"]["Code"] == "ResourceNotFoundException":
+            return None
+        else:
+            raise ClientError(
+                json.dumps(key),
+                error.response["Error"]["Message"],
+            ) from error
+
+
+def query_pool_items(
+    db_resource: DynamoDBServiceResource,
+    table_name: str,
+    pool_name: str,
+) -> list[dict[str, Any]]:
+    table = db_resource.Table(table_name)
+    kwargs: dict[str, Any] = {"KeyConditionExpression": Key("pool_name").eq(pool_name)}
+    items: list[dict[str, Any]] = []
+    try:
+        while True:
+            response = table.query(**kwargs)
+            items.extend(response["Items"])
+            if "LastEvaluatedKey" not in response:
+                return items
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    except botocore.exceptions.ClientError as error:
+        if error.response["Error"]["Code"] == "InternalServerError":
+            raise ServerError(
+                pool_name,
+                error.response["Error"]["Message"],
+            ) from error
+        elif error.response["Error"]["Code"] in THROTTLING_ERROR_CODES:
+            raise ThrottlingError(
+                pool_name,
+                error.response["Error"]["Message"],
+            ) from error
+        elif error.response["Error"]["Code"] == "ResourceNotFoundException":
+            return []
+        else:
+            raise ClientError(
+                pool_name,
+                error.response["Error"]["Message"],
+            ) from error
+
+
+def load_pool(
+    pool_name: str,
+    db_resource: DynamoDBServiceResource,
+    env: EnvParam,
+    ttl: float,
+) -> list[dict[str, Any]]:
+    items = pool_cache.get(pool_name, ttl)
+    if items is None:
+        items = query_pool_items(
+            db_resource=db_resource,
+            table_name=env.ITEM_TABLE_NAME,
+            pool_name=pool_name,
+        )
+        items.sort(key=lambda x: int(x["item_id"]))
+        pool_cache.put(pool_name, items)
+    return items
+
+
+def probabilities(
+    items: list[dict[str, Any]],
+    *,
+    weighted: bool,
+) -> np.ndarray | None:
+    # 一様分布の場合は None (integers による高速な生成を使う)
+    if not weighted:
+        return None
+    weights = np.array([float(x.get("weight", 1)) for x in items], dtype=np.float64)
+    if np.any(weights < 0) or weights.sum() <= 0:
+        raise ClientError(json.dumps(weights.tolist()), "Invalid weight.")
+    p: np.ndarray = weights / weights.sum()
+    return p
+
+
+def draw_counts(
+    num_item: int,
+    trials: int,
+    p: np.ndarray | None,
+    rng: np.random.Generator,
+) -> np.ndarray:
+    counts = np.zeros(num_item, dtype=np.int64)
+    remaining = trials
+    while remaining > 0:
+        size = min(remaining, DRAW_BATCH_SIZE)
+        if p is None:
+            draws = rng.integers(0, num_item, size=size)
+        else:
+            draws = rng.choice(num_item, size=size, p=p)
+        counts += np.bincount(draws, minlength=num_item)
+        remaining -= size
+    return counts
+
+
+def fan_out(
+    client: LambdaClient,
+    function_arn: str,
+    body: ApiEvent,
+    chunk_trials: int,
+) -> np.ndarray:
+    # 試行回数を分割し, 同じ関数を並列に同期呼び出しして頻度表を合算する
+    chunks = [
+        min(chunk_trials, body.trials - start)
+        for start in range(0, body.trials, chunk_trials)
+    ]
+    seeds = np.random.SeedSequence(body.seed).spawn(len(chunks))
+
+    def invoke(args: tuple[int, np.random.SeedSequence]) -> list[int]:
+        trials, seed = args
+        response = client.invoke(
+            FunctionName=function_arn,
+            Payload=json.dumps(
+                {
+                    "simulate_chunk": {
+                        "pool_name": body.storage_name(),
+                        "trials": trials,
+                        "weighted": body.weighted,
+                        "seed": int(seed.generate_state(1)[0]),
+                    },
+                },
+            ).encode(),
+        )
+        payload = json.loads(response["Payload"].read())
+        if "FunctionError" in response or "counts" not in payload:
+            raise ServerError(json.dumps(payload), "simulation chunk failed")
+        counts: list[int] = payload["counts"]
+        return counts
+
+    with ThreadPoolExecutor(max_workers=min(len(chunks), 32)) as executor:
+        results = list(executor.map(invoke, zip(chunks, seeds, strict=True)))
+    counts: np.ndarray = np.array(results, dtype=np.int64).sum(axis=0)
+    return counts
+
+
+def public_item(item: dict[str, Any]) -> dict[str, Any]:
+    return {k: v for k, v in item.items() if k not in INTERNAL_ATTRIBUTES}
+
+
+class Response(NamedTuple):
+    status_code: int
+    message: str | dict
+    retry_after: int | None = None
+
+    def data(self: Self) -> dict[str, Any]:
+        headers: dict[str, Any] = {
+            "Content-Type": "application/json",
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "GET, POST, DELETE",
+            "Access-Control-Allow-Credentials": True,
+            "Access-Control-Allow-Headers": "origin, x-requested-with",
+        }
+        if self.retry_after is not None:
+            headers["Retry-After"] = str(self.retry_after)
+        return {
+            "statusCode": self.status_code,
+            "headers": headers,
+            "body": json.dumps(
+                {
+                    "message": self.message,
+                },
+                default=decimal_default_proc,
+            ),
+            "isBase64Encoded": False,
+        }
+
+
+def service(  # noqa: PLR0913
+    body: ApiEvent,
+    db_resource: DynamoDBServiceResource,
+    env: EnvParam,
+    param: SimulateParam,
+    archive_param: ArchiveParam,
+    function_arn: str,
+) -> Response:
+    if body.trials > param.MAX_TRIALS or body.samples > param.MAX_SAMPLES:
+        raise ClientError(
+            input_param=body.pool_name,
+            message=f"trials or samples is too large: {body.trials}, {body.samples}",
+        )
+    items = load_pool(body.storage_name(), db_resource, env, param.CACHE_TTL_SECONDS)
+    if len(items) == 0:
+        pool = get_item(
+            db_resource=db_resource,
+            table_name=env.POOL_TABLE_NAME,
+            key={"pool_name": body.storage_name()},
+        )
+        if pool is not None and pool.get("archived", False):
+            rehydrate_pool(
+                lambda_client,
+                archive_param.DICE_FUNCTION_NAME,
+                body.storage_name(),
+            )
+            pool_cache.discard(body.storage_name())
+            items = load_pool(
+                body.storage_name(),
+                db_resource,
+                env,
+                param.CACHE_TTL_SECONDS,
+            )
+    if len(items) == 0:
+        raise ClientError(
+            input_param=body.pool_name,
+            message=f"pool_name is empty: {body.pool_name}",
+        )
+    p = probabilities(items, weighted=body.weighted)
+    rng = np.random.default_rng(body.seed)
+    if function_arn and body.trials > param.TRIALS_PER_INVOCATION:
+        counts = fan_out(
+            lambda_client,
+            function_arn,
+            body,
+            param.TRIALS_PER_INVOCATION,
+        )
+    else:
+        counts = draw_counts(len(items), body.trials, p, rng)
+    expected = (
+        np.full(len(items), body.trials / len(items)) if p is None else p * body.trials
+    )
+    sample_ids = (
+        rng.integers(0, len(items), size=body.samples)
+        if p is None
+        else rng.choice(len(items), size=body.samples, p=p)
+    )
+    return Response(
+        status_code=200,
+        message={
+            "pool_name": body.pool_name,
+            "trials": body.trials,
+            "weighted": body.weighted,
+            "frequencies": [
+                {
+                    "item_id": int(items[i]["item_id"]),
+                    "count": int(counts[i]),
+                    "ratio": float(counts[i] / body.trials),
+                    "expected": float(expected[i]),
+                }
+                for i in range(len(items))
+            ],
+            "samples": [
+                public_item(items[i]) | {"pool_name": body.pool_name}
+                for i in sample_ids
+            ],
+        },
+    )
+
+
+def simulate_chunk(chunk: dict[str, Any]) -> dict[str, Any]:
+    # fan_out から呼び出される内部用の処理 (API Gateway からは到達しない)
+    env = EnvParam.from_env()
+    param = SimulateParam.from_env()
+    items = load_pool(
+        chunk["pool_name"],
+        dynamodb_resource,
+        env,
+        param.CACHE_TTL_SECONDS,
+    )
+    counts = draw_counts(
+        len(items),
+        int(chunk["trials"]),
+        probabilities(items, weighted=chunk["weighted"] is True),
+        np.random.default_rng(chunk["seed"]),
+    )
+    return {"counts": counts.tolist()}
+
+
+@profiled(logger)
+@logger.inject_lambda_context(
+    correlation_id_path="requestContext.requestId",
+)
+def lambda_handler(event: dict[str, Any], context: LambdaContext) -> dict[str, Any]:
+    if "simulate_chunk" in event:
+        return simulate_chunk(event["simulate_chunk"])
+    try:
+        return service(
+            body=ApiEvent.from_event(event),
+            db_resource=dynamodb_resource,
+            env=EnvParam.from_env(),
+            param=SimulateParam.from_env(),
+            archive_param=ArchiveParam.from_env(),
+            function_arn=context.invoked_function_arn,
+        ).data()
+    except ServerError:
+        log_exception(logger, logging.ERROR, "server error")
+        return Response(
+            status_code=500,
+            message="internal server error. Please access again after some time.",
+        ).data()
+    except ThrottlingError:
+        log_exception(logger, logging.WARNING, "throttled")
+        return Response(
+            status_code=429,
+            message="too many requests. Please retry after some time.",
+            retry_after=int(os.environ.get("RETRY_AFTER_SECONDS", "1")),
+        ).data()
+    except ClientError as ce:
+        log_exception(logger, logging.WARNING, "client error")
+        return Response(
+            status_code=400,
+            message=f"client error. {ce.message}",
+        ).data()
+    except Exception:
+        log_exception(logger, logging.ERROR, "unexpected error")
+        return Response(
+            status_code=500,
+            message="internal server error. Please contact the operator.",
+        ).data()
+
+
+def warm_up() -> None:
+    # 認証情報の取得と TLS 接続の確立を初期化フェーズで済ませておく
+    # (読み取りを許可しているのは item テーブルのみ)
+    try:
+        dynamodb_resource.Table(EnvParam.from_env().ITEM_TABLE_NAME).get_item(
+            Key={"pool_name": "__warm_up__", "item_id": 0},
+        )
+    except Exception:
+        log_exception(logger, logging.WARNING, "warm_up failed")
+
+
+def after_restore() -> None:
+    # スナップショットから復元されたインスタンス間で接続を共有しないようにする
+    global dynamodb_resource, lambda_client  # noqa: PLW0603
+    dynamodb_resource = boto3.resource("dynamodb", config=boto_config)
+    lambda_client = boto3.client("lambda")
+    warm_up()
+
+
+if os.environ.get("AWS_LAMBDA_INITIALIZATION_TYPE") == "provisioned-concurrency":
+    warm_up()
+
+if snapshot_restore_py is not None:
+    snapshot_restore_py.register_before_snapshot(warm_up)
+    snapshot_restore_py.register_after_restore(after_restore)
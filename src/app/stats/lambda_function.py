@@ -0,0 +1,381 @@
+import json
+import logging
+import math
+import os
+import re
+from array import array
+from typing import Any, NamedTuple, Self
+
+import boto3
+import botocore
+from aws_lambda_powertools.logging import Logger
+from aws_lambda_powertools.utilities.typing import LambdaContext
+from boto3.dynamodb.conditions import Key
+from botocore.config import Config
+from common import (
+    TENANT_SEPARATOR,
+    THROTTLING_ERROR_CODES,
+    ClientError,
+    ServerError,
+    ThrottlingError,
+    log_exception,
+    rest_event,
+    storage_name,
+    tenant_from_event,
+)
+from mypy_boto3_dynamodb import DynamoDBServiceResource
+from profiler import profiled
+
+try:
+    # SnapStart 環境でのみ提供されるランタイムフック
+    import snapshot_restore_py
+except ImportError:
+    snapshot_restore_py = None
+
+logger = Logger()
+# adaptive モード: リトライ枠 (トークンバケット) とクライアント側のレート制限
+boto_config = Config(
+    retries={
+        "mode": "adaptive",
+        "max_attempts": int(os.environ.get("DYNAMODB_MAX_ATTEMPTS", "3")),
+    },
+)
+dynamodb_resource = boto3.resource("dynamodb", config=boto_config)
+
+# 有意水準 5% における KS 統計量の漸近臨界値の係数
+KS_CRITICAL_COEFFICIENT = 1.358
+
+# HTTP API / 関数 URL で受けるリソースパス
+ROUTE_PATTERN = re.compile(r"/pools/(?P<pool_name>[^/]+)/stats$")
+
+
+class EnvParam(NamedTuple):
+    POOL_TABLE_NAME: str
+    STATS_TABLE_NAME: str
+
+    @classmethod
+    def from_env(cls: type["EnvParam"]) -> "EnvParam":
+        try:
+            return EnvParam(**{k: os.environ[k] for k in EnvParam._fields})
+        except Exception as e:
+            raise ServerError(
+                json.dumps(os.environ),
+                "Required environment variables are not set.",
+            ) from e
+
+
+class TenantParam(NamedTuple):
+    TENANT_HEADER: str
+
+    @classmethod
+    def from_env(cls: type["TenantParam"]) -> "TenantParam":
+        return TenantParam(
+            TENANT_HEADER=os.environ.get("TENANT_HEADER", "X-Tenant-Id"),
+        )
+
+
+class ApiEvent(NamedTuple):
+    tenant_id: str
+    pool_name: str
+
+    @classmethod
+    def from_event(cls: type["ApiEvent"], event: dict[str, Any]) -> "ApiEvent":
+        event = rest_event(event, ROUTE_PATTERN)
+        try:
+            pool_name = event["pathParameters"]["pool_name"]
+        except Exception as e:
+            raise ClientError(event["body"], "Invalid parameter.") from e
+        if TENANT_SEPARATOR in pool_name:
+            raise ClientError(pool_name, "Invalid parameter.")
+        return ApiEvent(
+            tenant_id=tenant_from_event(event, TenantParam.from_env().TENANT_HEADER),
+            pool_name=pool_name,
+        )
+
+    def storage_name(self: Self) -> str:
+        return storage_name(self.tenant_id, self.pool_name)
+
+
+class RollHistogram:
+    # 出目ごとの回数を固定長配列に持ち, カイ二乗統計量に必要な和を逐次更新する
+    def __init__(self: Self, num_item: int) -> None:
+        self.counts = array("Q", bytes(8 * num_item))
+        self.total = 0
+        self.sum_squares = 0
+
+    def add(self: Self, item_id: int, count: int) -> None:
+        if not 0 <= item_id < len(self.counts):
+            return
+        before = self.counts[item_id]
+        self.counts[item_id] = before + count
+        self.total += count
+        self.sum_squares += (before + count) ** 2 - before**2
+
+    def chi_square(self: Self) -> float:
+        # sum((c - e)^2 / e) を e = total / k で展開した形
+        if self.total == 0:
+            return 0.0
+        return len(self.counts) * self.sum_squares / self.total - self.total
+
+    def ks_statistic(self: Self) -> float:
+        if self.total == 0:
+            return 0.0
+        num_item = len(self.counts)
+        cumulative = 0
+        statistic = 0.0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            statistic = max(
+                statistic,
+                abs(cumulative / self.total - (i + 1) / num_item),
+            )
+        return statistic
+
+    def summary(self: Self) -> dict[str, Any]:
+        degrees_of_freedom = len(self.counts) - 1
+        chi_square = self.chi_square()
+        ks_statistic = self.ks_statistic()
+        ks_critical = (
+            KS_CRITICAL_COEFFICIENT / math.sqrt(self.total) if self.total > 0 else 0.0
+        )
+        return {
+            "num_item": len(self.counts),
+            "total": self.total,
+            "chi_square": {
+                "statistic": chi_square,
+                "degrees_of_freedom": degrees_of_freedom,
+                "p_value": chi_square_p_value(chi_square, degrees_of_freedom),
+            },
+            "ks": {
+                "statistic": ks_statistic,
+                "critical_value_5": ks_critical,
+            },
+        }
+
+
+def chi_square_p_value(statistic: float, degrees_of_freedom: int) -> float:
+    # 上側正則化不完全ガンマ関数 Q(k/2, x/2)
+    if degrees_of_freedom <= 0 or statistic <= 0:
+        return 1.0
+    a = degrees_of_freedom / 2
+    x = statistic / 2
+    log_prefix = a * math.log(x) - x - math.lgamma(a)
+    if x < a + 1:
+        # 級数展開で P(a, x) を求める
+        term = 1 / a
+        total = term
+        n = a
+        while abs(term) > abs(total) * 1e-15:
+            n += 1
+            term *= x / n
+            total += term
+        return max(0.0, 1 - total * math.exp(log_prefix))
+    # 連分数展開 (Lentz 法) で Q(a, x) を求める
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    h = d
+    i = 0
+    while True:
+        i += 1
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-15:  # noqa: PLR2004
+            break
+    return min(1.0, h * math.exp(log_prefix))
+
+
+def get_item(
+    db_resource: DynamoDBServiceResource,
+    table_name: str,
+    key: dict,
+) -> dict[str, Any] | None:
+    table = db_resource.Table(table_name)
+    try:
+        return table.get_item(Key=key).get("Item")
+    except botocore.exceptions.ClientError as error:
+        if error.response["Error"]["Code"] == "InternalServerError":
+            raise ServerError(
+                json.dumps(key),
+                error.response["Error"]["Message"],
+            ) from error
+        elif error.response["Error"]["Code"] in THROTTLING_ERROR_CODES:
+            raise ThrottlingError(
+                json.dumps(key),
+                error.response["Error"]["Message"],
+            ) from error
+        elif error.response["Error"]["Code"] == "ResourceNotFoundException":
+            return None
+        else:
+            raise ClientError(
+                json.dumps(key),
+                error.response["Error"]["Message"],
+            ) from error
+
+
+def load_histogram(
+    db_resource: DynamoDBServiceResource,
+    table_name: str,
+    pool_name: str,
+    num_item: int,
+) -> RollHistogram:
+    # ページ単位で集計し, 全件をメモリに保持しない
+    histogram = RollHistogram(num_item)
+    table = db_resource.Table(table_name)
+    kwargs: dict[str, Any] = {
+        "KeyConditionExpression": Key("pool_name").eq(pool_name),
+        "ProjectionExpression": "item_id, roll_count",
+    }
+    try:
+        while True:
+            response = table.query(**kwargs)
+            rows: list[dict[str, Any]] = response["Items"]
+            for row in rows:
+                histogram.add(int(row["item_id"]), int(row.get("roll_count", 0)))
+            if "LastEvaluatedKey" not in response:
+                return histogram
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    except botocore.exceptions.ClientError as error:
+        if error.response["Error"]["Code"] == "InternalServerError":
+            raise ServerError(
+                pool_name,
+                error.response["Error"]["Message"],
+            ) from error
+        elif error.response["Error"]["Code"] in THROTTLING_ERROR_CODES:
+            raise ThrottlingError(
+                pool_name,
+                error.response["Error"]["Message"],
+            ) from error
+        elif error.response["Error"]["Code"] == "ResourceNotFoundException":
+            return histogram
+        else:
+            raise ClientError(
+                pool_name,
+                error.response["Error"]["Message"],
+            ) from error
+
+
+class Response(NamedTuple):
+    status_code: int
+    message: str | dict
+    retry_after: int | None = None
+
+    def data(self: Self) -> dict[str, Any]:
+        headers: dict[str, Any] = {
+            "Content-Type": "application/json",
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "GET, POST, DELETE",
+            "Access-Control-Allow-Credentials": True,
+            "Access-Control-Allow-Headers": "origin, x-requested-with",
+        }
+        if self.retry_after is not None:
+            headers["Retry-After"] = str(self.retry_after)
+        return {
+            "statusCode": self.status_code,
+            "headers": headers,
+            "body": json.dumps(
+                {
+                    "message": self.message,
+                },
+            ),
+            "isBase64Encoded": False,
+        }
+
+
+def service(
+    body: ApiEvent,
+    db_resource: DynamoDBServiceResource,
+    env: EnvParam,
+) -> Response:
+    pool_name = body.storage_name()
+    response_pool = get_item(
+        db_resource=db_resource,
+        table_name=env.POOL_TABLE_NAME,
+        key={"pool_name": pool_name},
+    )
+    if response_pool is None:
+        raise ClientError(
+            input_param=pool_name,
+            message=f"pool_name is empty: {body.pool_name}",
+        )
+    histogram = load_histogram(
+        db_resource=db_resource,
+        table_name=env.STATS_TABLE_NAME,
+        pool_name=pool_name,
+        num_item=int(response_pool["num_item"]),
+    )
+    return Response(
+        status_code=200,
+        message=histogram.summary(),
+    )
+
+
+@profiled(logger)
+@logger.inject_lambda_context(
+    correlation_id_path="requestContext.requestId",
+)
+def lambda_handler(event: dict[str, Any], context: LambdaContext) -> dict[str, Any]:
+    try:
+        return service(
+            body=ApiEvent.from_event(event),
+            db_resource=dynamodb_resource,
+            env=EnvParam.from_env(),
+        ).data()
+    except ServerError:
+        log_exception(logger, logging.ERROR, "server error")
+        return Response(
+            status_code=500,
+            message="internal server error. Please access again after some time.",
+        ).data()
+    except ThrottlingError:
+        log_exception(logger, logging.WARNING, "throttled")
+        return Response(
+            status_code=429,
+            message="too many requests. Please retry after some time.",
+            retry_after=int(os.environ.get("RETRY_AFTER_SECONDS", "1")),
+        ).data()
+    except ClientError as ce:
+        log_exception(logger, logging.WARNING, "client error")
+        return Response(
+            status_code=400,
+            message=f"client error. {ce.message}",
+        ).data()
+    except Exception:
+        log_exception(logger, logging.ERROR, "unexpected error")
+        return Response(
+            status_code=500,
+            message="internal server error. Please contact the operator.",
+        ).data()
+
+
+def warm_up() -> None:
+    # 認証情報の取得と TLS 接続の確立を初期化フェーズで済ませておく
+    try:
+        dynamodb_resource.Table(EnvParam.from_env().POOL_TABLE_NAME).get_item(
+            Key={"pool_name": "__warm_up__"},
+        )
+    except Exception:
+        log_exception(logger, logging.WARNING, "warm_up failed")
+
+
+def after_restore() -> None:
+    # スナップショットから復元されたインスタンス間で接続を共有しないようにする
+    global dynamodb_resource  # noqa: PLW0603
+    dynamodb_resource = boto3.resource("dynamodb", config=boto_config)
+    warm_up()
+
+
+if os.environ.get("AWS_LAMBDA_INITIALIZATION_TYPE") == "provisioned-concurrency":
+    warm_up()
+
+if snapshot_restore_py is not None:
+    snapshot_restore_py.register_before_snapshot(warm_up)
+    snapshot_restore_py.register_after_restore(after_restore)
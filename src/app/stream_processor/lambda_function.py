@@ -0,0 +1,330 @@
+import json
+import logging
+import os
+from typing import Any, NamedTuple, Self
+
+import boto3
+import botocore
+from aws_lambda_powertools.logging import Logger
+from aws_lambda_powertools.utilities.typing import LambdaContext
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.config import Config
+from common import (
+    TENANT_SEPARATOR,
+    THROTTLING_ERROR_CODES,
+    ClientError,
+    ServerError,
+    ThrottlingError,
+    log_exception,
+    refresh_cache,
+)
+from mypy_boto3_dynamodb import DynamoDBServiceResource
+from profiler import profiled
+
+try:
+    # SnapStart 環境でのみ提供されるランタイムフック
+    import snapshot_restore_py
+except ImportError:
+    snapshot_restore_py = None
+
+logger = Logger()
+# adaptive モード: リトライ枠 (トークンバケット) とクライアント側のレート制限
+boto_config = Config(
+    retries={
+        "mode": "adaptive",
+        "max_attempts": int(os.environ.get("DYNAMODB_MAX_ATTEMPTS", "3")),
+    },
+)
+dynamodb_resource = boto3.resource("dynamodb", config=boto_config)
+deserializer = TypeDeserializer()
+
+# シーケンス番号は桁数が揃わないため, 0 埋めして文字列として大小比較する
+SEQUENCE_WIDTH = 40
+VERSIONS_PATH = "/pools?versions=true"
+
+
+class ConflictError(Exception):
+    def __init__(self: Self, input_param: str, message: str) -> None:
+        super().__init__(f"{message}: {input_param}")
+
+
+class EnvParam(NamedTuple):
+    POOL_TABLE_NAME: str
+    ITEM_TABLE_NAME: str
+    CATALOG_TABLE_NAME: str
+
+    @classmethod
+    def from_env(cls: type["EnvParam"]) -> "EnvParam":
+        try:
+            return EnvParam(**{k: os.environ[k] for k in EnvParam._fields})
+        except Exception as e:
+            raise ServerError(
+                json.dumps(os.environ),
+                "Required environment variables are not set.",
+            ) from e
+
+
+class Change(NamedTuple):
+    source: str
+    pool_name: str
+    event_name: str
+    sequence_number: str
+    new_image: dict[str, Any] | None
+
+    @classmethod
+    def from_record(
+        cls: type["Change"],
+        record: dict[str, Any],
+        env: EnvParam,
+    ) -> "Change":
+        # eventSourceARN は arn:aws:dynamodb:...:table/<テーブル名>/stream/<ラベル>
+        table_name = record["eventSourceARN"].split("/")[1]
+        if table_name == env.POOL_TABLE_NAME:
+            source = "pool"
+        elif table_name == env.ITEM_TABLE_NAME:
+            source = "item"
+        else:
+            raise ClientError(table_name, "unknown event source")
+        stream_record = record["dynamodb"]
+        new_image = stream_record.get("NewImage")
+        return Change(
+            source=source,
+            pool_name=deserializer.deserialize(stream_record["Keys"]["pool_name"]),
+            event_name=record["eventName"],
+            sequence_number=stream_record["SequenceNumber"],
+            new_image=(
+                {k: deserializer.deserialize(v) for k, v in new_image.items()}
+                if new_image is not None
+                else None
+            ),
+        )
+
+    def sequence(self: Self) -> str:
+        return self.sequence_number.zfill(SEQUENCE_WIDTH)
+
+
+def group_by_pool(changes: list[Change]) -> dict[str, list[Change]]:
+    # 同一プールの変更は同じシャードに順序どおり届くため, 到着順を保ったまままとめる
+    groups: dict[str, list[Change]] = {}
+    for change in changes:
+        groups.setdefault(change.pool_name, []).append(change)
+    return groups
+
+
+def apply_changes(
+    current: dict[str, Any] | None,
+    changes: list[Change],
+) -> dict[str, Any] | None:
+    # 反映済みのシーケンス番号以前のレコードは読み飛ばし, 再送されても結果を変えない
+    row = dict(current) if current is not None else {}
+    applied = False
+    for change in changes:
+        seq_key = f"{change.source}_seq"
+        if change.sequence() <= row.get(seq_key, ""):
+            continue
+        if change.source == "pool":
+            if change.event_name == "REMOVE" or change.new_image is None:
+                row.pop("num_item", None)
+                row["deleted"] = True
+            else:
+                row["num_item"] = int(change.new_image["num_item"])
+                row["deleted"] = False
+                row["no_snapshot"] = bool(change.new_image.get("no_snapshot", False))
+        elif change.event_name == "INSERT":
+            row["item_count"] = int(row.get("item_count", 0)) + 1
+        elif change.event_name == "REMOVE":
+            row["item_count"] = int(row.get("item_count", 0)) - 1
+        row[seq_key] = change.sequence()
+        applied = True
+    if not applied:
+        return None
+    # キャッシュの無効化に用いる版数. プールを削除しても単調増加させる
+    row["version"] = int(row.get("version", 0)) + 1
+    return row
+
+
+def get_item(
+    db_resource: DynamoDBServiceResource,
+    table_name: str,
+    key: dict,
+) -> dict[str, Any] | None:
+    table = db_resource.Table(table_name)
+    try:
+        return table.get_item(Key=key, ConsistentRead=True).get("Item")
+    except botocore.exceptions.ClientError as error:
+        if error.response["Error"]["Code"] == "InternalServerError":
+            raise ServerError(
+                json.dumps(key),
+                error.response["Error"]["Message"],
+            ) from error
+        elif error.response["Error"]["Code"] in THROTTLING_ERROR_CODES:
+            raise ThrottlingError(
+                json.dumps(key),
+                error.response["Error"]["Message"],
+            ) from error
+        else:
+            raise ClientError(
+                json.dumps(key),
+                error.response["Error"]["Message"],
+            ) from error
+
+
+def put_catalog(
+    db_resource: DynamoDBServiceResource,
+    table_name: str,
+    row: dict[str, Any],
+    expected_version: int | None,
+) -> None:
+    # 版数による楽観ロック. pool / item 両ストリームからの同時更新を取りこぼさない
+    table = db_resource.Table(table_name)
+    kwargs: dict[str, Any] = (
+        {"ConditionExpression": "attribute_not_exists(pool_name)"}
+        if expected_version is None
+        else {
+            "ConditionExpression": "version = :version",
+            "ExpressionAttributeValues": {":version": expected_version},
+        }
+    )
+    try:
+        table.put_item(Item=row, **kwargs)
+    except botocore.exceptions.ClientError as error:
+        if error.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            raise ConflictError(
+                row["pool_name"],
+                error.response["Error"]["Message"],
+            ) from error
+        elif error.response["Error"]["Code"] == "InternalServerError":
+            raise ServerError(
+                row["pool_name"],
+                error.response["Error"]["Message"],
+            ) from error
+        elif error.response["Error"]["Code"] in THROTTLING_ERROR_CODES:
+            raise ThrottlingError(
+                row["pool_name"],
+                error.response["Error"]["Message"],
+            ) from error
+        else:
+            raise ClientError(
+                row["pool_name"],
+                error.response["Error"]["Message"],
+            ) from error
+
+
+def process_pool(
+    db_resource: DynamoDBServiceResource,
+    env: EnvParam,
+    pool_name: str,
+    changes: list[Change],
+) -> bool:
+    current = get_item(
+        db_resource=db_resource,
+        table_name=env.CATALOG_TABLE_NAME,
+        key={"pool_name": pool_name},
+    )
+    row = apply_changes(current, changes)
+    if row is None:
+        return False
+    put_catalog(
+        db_resource=db_resource,
+        table_name=env.CATALOG_TABLE_NAME,
+        row=row | {"pool_name": pool_name},
+        expected_version=int(current["version"]) if current is not None else None,
+    )
+    return True
+
+
+class CacheParam(NamedTuple):
+    # API Gateway のステージ URL (例: https://<id>.execute-api.<region>.amazonaws.com/v1)
+    API_CACHE_URL: str
+    API_CACHE_TIMEOUT_SECONDS: float
+    TENANT_HEADER: str
+
+    @classmethod
+    def from_env(cls: type["CacheParam"]) -> "CacheParam":
+        return CacheParam(
+            API_CACHE_URL=os.environ.get("API_CACHE_URL", ""),
+            API_CACHE_TIMEOUT_SECONDS=float(
+                os.environ.get("API_CACHE_TIMEOUT_SECONDS", "2"),
+            ),
+            TENANT_HEADER=os.environ.get("TENANT_HEADER", "X-Tenant-Id"),
+        )
+
+
+def invalidate_cache(param: CacheParam, tenant_ids: list[str]) -> None:
+    # テナントごとの版数付きの一覧だけを取り直させる
+    if not param.API_CACHE_URL:
+        return
+    url = param.API_CACHE_URL.rstrip("/") + VERSIONS_PATH
+    refresh_cache(
+        logger,
+        [(url, {param.TENANT_HEADER: x} if x != "" else {}) for x in tenant_ids],
+        param.API_CACHE_TIMEOUT_SECONDS,
+    )
+
+
+def tenant_of(pool_name: str) -> str:
+    # 保存名は "<テナント>#<プール名>", テナントに属さないプールは接頭辞なし
+    tenant_id, separator, _ = pool_name.partition(TENANT_SEPARATOR)
+    return tenant_id if separator else ""
+
+
+def service(
+    records: list[dict[str, Any]],
+    db_resource: DynamoDBServiceResource,
+    env: EnvParam,
+    cache_param: CacheParam,
+) -> list[str]:
+    changes = [Change.from_record(x, env) for x in records]
+    failures: list[str] = []
+    tenants: set[str] = set()
+    for pool_name, pool_changes in group_by_pool(changes).items():
+        try:
+            if process_pool(db_resource, env, pool_name, pool_changes):
+                tenants.add(tenant_of(pool_name))
+        except (ConflictError, ThrottlingError):
+            log_exception(logger, logging.WARNING, "retry later")
+            failures.append(pool_changes[0].sequence_number)
+        except Exception:
+            log_exception(logger, logging.ERROR, "unexpected error")
+            failures.append(pool_changes[0].sequence_number)
+    # 版数付きの一覧は版数が進んでから取り直す. create_pool の時点では古い版数のまま
+    invalidate_cache(cache_param, sorted(tenants))
+    return failures
+
+
+@profiled(logger)
+@logger.inject_lambda_context
+def lambda_handler(event: dict[str, Any], context: LambdaContext) -> dict[str, Any]:
+    # 失敗したプールの先頭レコードを返し, そこから先をシャード単位で再送させる
+    failures = service(
+        records=event["Records"],
+        db_resource=dynamodb_resource,
+        env=EnvParam.from_env(),
+        cache_param=CacheParam.from_env(),
+    )
+    return {"batchItemFailures": [{"itemIdentifier": x} for x in failures]}
+
+
+def warm_up() -> None:
+    # 認証情報の取得と TLS 接続の確立を初期化フェーズで済ませておく
+    try:
+        dynamodb_resource.Table(EnvParam.from_env().CATALOG_TABLE_NAME).get_item(
+            Key={"pool_name": "__warm_up__"},
+        )
+    except Exception:
+        log_exception(logger, logging.WARNING, "warm_up failed")
+
+
+def after_restore() -> None:
+    # スナップショットから復元されたインスタンス間で接続を共有しないようにする
+    global dynamodb_resource  # noqa: PLW0603
+    dynamodb_resource = boto3.resource("dynamodb", config=boto_config)
+    warm_up()
+
+
+if os.environ.get("AWS_LAMBDA_INITIALIZATION_TYPE") == "provisioned-concurrency":
+    warm_up()
+
+if snapshot_restore_py is not None:
+    snapshot_restore_py.register_before_snapshot(warm_up)
+    snapshot_restore_py.register_after_restore(after_restore)
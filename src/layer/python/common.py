@@ -0,0 +1,304 @@
+"""各関数に共通する例外, イベントの正規化, テナント, キャッシュ, スナップショット形式.
+
+全関数に共通のレイヤーとして配置し, 各関数からは次のように使う.
+
+    from common import ClientError, log_exception, rest_event
+"""
+import base64
+import functools
+import json
+import logging
+import os
+import re
+import struct
+import sys
+import time
+import urllib.parse
+import urllib.request
+import zlib
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from typing import Any, NamedTuple, Protocol, Self
+
+import boto3
+import botocore
+from aws_lambda_powertools.logging import Logger
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from mypy_boto3_lambda import LambdaClient
+
+TENANT_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+TENANT_SEPARATOR = "#"
+# コンテナ内で保持するテナントごとのトークンバケット数の上限
+TENANT_BUCKETS_MAX = 1024
+
+THROTTLING_ERROR_CODES = [
+    "ProvisionedThroughputExceededException",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+]
+
+# create_pool / archiver が書き出し, dice が読み込むスナップショットの形式
+# ヘッダ (マジック, 版, フラグ, 件数), オフセット索引, item_id 配列,
+# 直列化済みアイテムを連結したペイロードの順に並べる
+SNAPSHOT_MAGIC = b"DDPS"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct("<4sHHQ")
+SNAPSHOT_FLAG_ZLIB = 1
+
+
+class ClientError(Exception):
+    def __init__(self: Self, input_param: str, message: str) -> None:
+        self.message = message
+        super().__init__(f"{message}: {input_param}")
+
+
+class ServerError(Exception):
+    def __init__(self: Self, input_param: str, message: str) -> None:
+        super().__init__(f"{message}: {input_param}")
+
+
+class ThrottlingError(Exception):
+    def __init__(self: Self, input_param: str, message: str) -> None:
+        super().__init__(f"{message}: {input_param}")
+
+
+def log_exception(logger: Logger, level: int, message: str) -> None:
+    # 出力されるときだけ整形する. 想定内の WARNING は DEBUG 時を除き例外の要約にとどめる
+    if level < logger.log_level:
+        return
+    # level は ERROR メトリクスフィルタが参照するため, ERROR はそのまま ERROR で出す
+    log = logger.error if level >= logging.ERROR else logger.warning
+    log(
+        "%s: %r",
+        message,
+        sys.exc_info()[1],
+        exc_info=level >= logging.ERROR or logger.log_level <= logging.DEBUG,
+        stacklevel=3,
+    )
+
+
+def rest_event(event: dict[str, Any], route_pattern: re.Pattern) -> dict[str, Any]:
+    # HTTP API / 関数 URL (ペイロード形式 2.0) のイベントを REST API (1.0) の形に揃える
+    if event.get("version") != "2.0":
+        return event
+    body = event.get("body")
+    if body is not None and event.get("isBase64Encoded", False):
+        body = base64.b64decode(body).decode()
+    path_parameters = event.get("pathParameters")
+    if path_parameters is None:
+        # 関数 URL はパスパラメータを持たないため, パスから取り出す
+        match = route_pattern.search(event.get("rawPath", ""))
+        if match is not None and match.groupdict():
+            path_parameters = {
+                k: urllib.parse.unquote(v) for k, v in match.groupdict().items()
+            }
+    return event | {
+        "version": "1.0",
+        "httpMethod": event["requestContext"]["http"]["method"],
+        "path": event.get("rawPath", ""),
+        "headers": event.get("headers") or {},
+        "queryStringParameters": event.get("queryStringParameters"),
+        "pathParameters": path_parameters,
+        "body": body,
+        "isBase64Encoded": False,
+    }
+
+
+def tenant_from_event(event: dict[str, Any], header: str) -> str:
+    headers = {k.lower(): v for k, v in (event.get("headers") or {}).items()}
+    tenant_id: str = headers.get(header.lower(), "")
+    if tenant_id and TENANT_ID_PATTERN.fullmatch(tenant_id) is None:
+        raise ClientError(tenant_id, "Invalid tenant.")
+    return tenant_id
+
+
+def storage_name(tenant_id: str, pool_name: str) -> str:
+    # テナント未指定のプールは従来どおり接頭辞なしの名前空間に置く
+    if tenant_id == "":
+        return pool_name
+    return f"{tenant_id}{TENANT_SEPARATOR}{pool_name}"
+
+
+def display_name(pool_name: str) -> str:
+    return pool_name.rsplit(TENANT_SEPARATOR, 1)[-1]
+
+
+class TenantRateParam(Protocol):
+    # 各関数の TenantParam のうち, レート制限に使う項目
+    @property
+    def TENANT_RATE_LIMIT(self: Self) -> float:  # noqa: N802
+        ...
+
+    @property
+    def TENANT_BURST(self: Self) -> float:  # noqa: N802
+        ...
+
+
+class TokenBucket:
+    def __init__(self: Self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self: Self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class TenantLimiter:
+    # コンテナ内で完結するため, 実効的な上限は同時実行数の分だけ緩くなる
+    def __init__(self: Self) -> None:
+        self._buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+
+    def acquire(self: Self, tenant_id: str, param: TenantRateParam) -> None:
+        # テナント未指定の呼び出しは従来どおりテナント単位の制限をかけない
+        if tenant_id == "" or param.TENANT_RATE_LIMIT <= 0:
+            return
+        bucket = self._buckets.get(tenant_id)
+        if bucket is None:
+            bucket = TokenBucket(param.TENANT_RATE_LIMIT, param.TENANT_BURST)
+            self._buckets[tenant_id] = bucket
+            if len(self._buckets) > TENANT_BUCKETS_MAX:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(tenant_id)
+        if not bucket.take():
+            raise ThrottlingError(tenant_id, "tenant rate limit exceeded")
+
+
+def rehydrate_pool(client: LambdaClient, function_name: str, pool_name: str) -> None:
+    # 書き戻しは dice の実装に任せ, 完了を待ってからアイテムを読む
+    if not function_name:
+        raise ServerError(pool_name, "pool is archived")
+    try:
+        response = client.invoke(
+            FunctionName=function_name,
+            Payload=json.dumps({"rehydrate_pool": pool_name}).encode(),
+        )
+    except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
+        raise ServerError(pool_name, "rehydrate_pool failed") from e
+    payload = json.loads(response["Payload"].read() or b"{}")
+    if "FunctionError" in response or payload.get("archived", True):
+        raise ServerError(json.dumps(payload), "rehydrate_pool failed")
+
+
+class OriginParam(NamedTuple):
+    # REST API の WAF が通すヘッダと, その値を持つシークレット. 空のときは付けない
+    ORIGIN_VERIFY_HEADER: str
+    ORIGIN_SECRET_ARN: str
+
+    @classmethod
+    def from_env(cls: type["OriginParam"]) -> "OriginParam":
+        return OriginParam(
+            ORIGIN_VERIFY_HEADER=os.environ.get("ORIGIN_VERIFY_HEADER", ""),
+            ORIGIN_SECRET_ARN=os.environ.get("ORIGIN_SECRET_ARN", ""),
+        )
+
+
+@functools.cache
+def origin_secret(secret_arn: str) -> str:
+    # 値はローテーションしないため, コンテナの間は最初に読んだ値を使い回す
+    response = boto3.client("secretsmanager").get_secret_value(SecretId=secret_arn)
+    secret: str = response["SecretString"]
+    return secret
+
+
+def refresh_cache(
+    logger: Logger,
+    requests: list[tuple[str, dict[str, str]]],
+    timeout: float,
+) -> None:
+    # Cache-Control: max-age=0 を付けた署名付きリクエストで, 同じキャッシュキーの
+    # エントリだけを取り直させる (execute-api:InvalidateCache の権限が必要).
+    # 取り直せないと TTL が切れるまで古い内容を返すため, 失敗は ERROR として通知する
+    if not requests:
+        return
+    session = boto3.Session()
+    credentials = session.get_credentials()
+    origin = OriginParam.from_env()
+    common_headers = {"Cache-Control": "max-age=0"}
+    try:
+        if origin.ORIGIN_VERIFY_HEADER and origin.ORIGIN_SECRET_ARN:
+            common_headers[origin.ORIGIN_VERIFY_HEADER] = origin_secret(
+                origin.ORIGIN_SECRET_ARN,
+            )
+    except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError):
+        log_exception(logger, logging.ERROR, "invalidate_cache failed")
+        return
+
+    def refresh(url: str, headers: dict[str, str]) -> None:
+        request = AWSRequest(method="GET", url=url, headers=common_headers | headers)
+        if credentials is not None:
+            SigV4Auth(credentials, "execute-api", session.region_name).add_auth(request)
+        try:
+            with urllib.request.urlopen(  # noqa: S310
+                urllib.request.Request(
+                    url,
+                    headers=dict(request.headers.items()),
+                ),
+                timeout=timeout,
+            ) as response:
+                response.read()
+        except OSError:
+            # 2xx 以外の応答 (WAF の拒否など) も HTTPError としてここに来る
+            log_exception(logger, logging.ERROR, "invalidate_cache failed")
+
+    # 待ち時間がキーの数だけ積み重ならないよう, 並行して取り直す
+    with ThreadPoolExecutor(max_workers=min(len(requests), 16)) as executor:
+        list(executor.map(lambda x: refresh(*x), requests))
+
+
+def decimal_default_proc(obj: Any) -> int | float:  # noqa: ANN401
+    if isinstance(obj, Decimal):
+        return int(obj) if obj == obj.to_integral_value() else float(obj)
+    raise TypeError
+
+
+def pack_items(
+    items: list[dict[str, Any]],
+) -> tuple[bytes, "array[int]", "array[int]"]:
+    # 直列化済みのアイテムを 1 つのバッファに連結し, 境界をオフセット配列で持つ
+    chunks = [json.dumps(x, default=decimal_default_proc).encode() for x in items]
+    offsets = array("Q", [0])
+    for chunk in chunks:
+        offsets.append(offsets[-1] + len(chunk))
+    item_ids = array("Q", [int(x["item_id"]) for x in items])
+    return b"".join(chunks), offsets, item_ids
+
+
+def build_snapshot(items: list[dict[str, Any]], *, compress: bool) -> bytes:
+    # dice のキャッシュと同じ直列化を行い, 読み込み側で再エンコードせずに済ませる
+    payload, offsets, item_ids = pack_items(items)
+    flags = 0
+    if compress:
+        payload = zlib.compress(payload)
+        flags |= SNAPSHOT_FLAG_ZLIB
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, flags, len(items))
+    return header + offsets.tobytes() + item_ids.tobytes() + payload
+
+
+def read_snapshot(
+    view: memoryview,
+) -> tuple[bytes | memoryview, memoryview, memoryview]:
+    # 索引とペイロードはコピーせず, 渡されたバッファの上のビューとして参照する
+    magic, version, flags, count = SNAPSHOT_HEADER.unpack_from(view)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise ValueError(magic, version)
+    start = SNAPSHOT_HEADER.size
+    offsets = view[start : start + 8 * (count + 1)].cast("Q")
+    start += 8 * (count + 1)
+    item_ids = view[start : start + 8 * count].cast("Q")
+    start += 8 * count
+    buffer: bytes | memoryview = view[start:]
+    if flags & SNAPSHOT_FLAG_ZLIB:
+        buffer = zlib.decompress(buffer)
+    return buffer, offsets, item_ids
@@ -0,0 +1,122 @@
+"""ハンドラのサンプリングプロファイラ.
+
+全関数に共通のレイヤーとして配置し, 各関数からは次のように使う.
+
+    @profiled(logger)
+    @logger.inject_lambda_context(...)
+    def lambda_handler(event, context): ...
+"""
+import functools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from collections.abc import Callable
+from pathlib import Path
+from types import FrameType
+from typing import Any, NamedTuple, Self
+
+from aws_lambda_powertools.logging import Logger
+from aws_lambda_powertools.utilities.typing import LambdaContext
+
+try:
+    # SnapStart 環境でのみ提供されるランタイムフック
+    import snapshot_restore_py
+except ImportError:
+    snapshot_restore_py = None
+
+Handler = Callable[[dict[str, Any], LambdaContext], dict[str, Any]]
+
+# 採取するかどうかの判定はハンドラの乱数列 (出目) と分けて引く
+rng = random.Random()
+
+
+class ProfileParam(NamedTuple):
+    # 0 より大きいと, その割合の呼び出しでスタックを採取する
+    PROFILE_SAMPLE_RATE: float
+    PROFILE_INTERVAL_MS: float
+    PROFILE_MAX_STACKS: int
+
+    @classmethod
+    def from_env(cls: type["ProfileParam"]) -> "ProfileParam":
+        return ProfileParam(
+            PROFILE_SAMPLE_RATE=float(os.environ.get("PROFILE_SAMPLE_RATE", "0")),
+            PROFILE_INTERVAL_MS=float(os.environ.get("PROFILE_INTERVAL_MS", "5")),
+            PROFILE_MAX_STACKS=int(os.environ.get("PROFILE_MAX_STACKS", "100")),
+        )
+
+
+class StackSampler:
+    # 別スレッドからハンドラのスタックを一定間隔で採取し, collapsed 形式で数える
+    def __init__(self: Self, root: FrameType, interval_ms: float) -> None:
+        self.root = root
+        self.thread_id = threading.get_ident()
+        self.interval = interval_ms / 1000
+        self.stacks: Counter[str] = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def collapse(self: Self, frame: FrameType | None) -> str:
+        # ランタイム側のフレームは除き, ハンドラから下だけを根から順に並べる
+        names = []
+        while frame is not None and frame is not self.root:
+            code = frame.f_code
+            names.append(f"{Path(code.co_filename).stem}:{code.co_name}")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def run(self: Self) -> None:
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[self.collapse(frame)] += 1
+
+    def __enter__(self: Self) -> "StackSampler":
+        # GIL の切り替え間隔 (既定 5ms) より細かく採取できるよう採取中だけ縮める
+        self.switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self.switch_interval, self.interval))
+        self.started_at = time.perf_counter()
+        self.thread.start()
+        return self
+
+    def __exit__(self: Self, *args: object) -> None:
+        self.stopped.set()
+        self.thread.join()
+        sys.setswitchinterval(self.switch_interval)
+        self.elapsed_ms = (time.perf_counter() - self.started_at) * 1000
+
+    def summary(self: Self, max_stacks: int) -> list[str]:
+        return [f"{k} {v}" for k, v in self.stacks.most_common(max_stacks) if k]
+
+
+def profiled(logger: Logger) -> Callable[[Handler], Handler]:
+    def decorator(handler: Handler) -> Handler:
+        @functools.wraps(handler)
+        def wrapper(event: dict[str, Any], context: LambdaContext) -> dict[str, Any]:
+            param = ProfileParam.from_env()
+            if rng.random() >= param.PROFILE_SAMPLE_RATE:
+                return handler(event, context)
+            with StackSampler(sys._getframe(), param.PROFILE_INTERVAL_MS) as sampler:
+                response = handler(event, context)
+            # flamegraph.pl / speedscope にそのまま渡せる "関数;関数 回数" の行
+            logger.info(
+                "profile",
+                extra={
+                    "elapsed_ms": round(sampler.elapsed_ms, 3),
+                    "interval_ms": param.PROFILE_INTERVAL_MS,
+                    "samples": sum(sampler.stacks.values()),
+                    "stacks": sampler.summary(param.PROFILE_MAX_STACKS),
+                },
+            )
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+if snapshot_restore_py is not None:
+    # 復元されたインスタンス間で採取の判定が揃わないようにする
+    snapshot_restore_py.register_after_restore(rng.seed)
@@ -1,6 +1,7 @@
+import base64
 import json
 from pathlib import Path
-from typing import Any, NamedTuple
+from typing import Any, NamedTuple, Self
 
 from mypy_boto3_dynamodb import DynamoDBClient, DynamoDBServiceResource
 
@@ -71,6 +72,10 @@ def create_pool_table(
                 "AttributeName": "pool_name",
                 "AttributeType": "S",
             },
+            {
+                "AttributeName": "tenant_id",
+                "AttributeType": "S",
+            },
         ],
         TableName=table_name,
         KeySchema=[
@@ -79,6 +84,24 @@ def create_pool_table(
                 "KeyType": "HASH",
             },
         ],
+        GlobalSecondaryIndexes=[
+            {
+                "IndexName": "tenant_id",
+                "KeySchema": [
+                    {
+                        "AttributeName": "tenant_id",
+                        "KeyType": "HASH",
+                    },
+                    {
+                        "AttributeName": "pool_name",
+                        "KeyType": "RANGE",
+                    },
+                ],
+                "Projection": {
+                    "ProjectionType": "ALL",
+                },
+            },
+        ],
         BillingMode="PAY_PER_REQUEST",
     )
     return table_name
@@ -115,6 +138,124 @@ def create_item_table(
     return table_name
 
 
+def create_stats_table(
+    client: DynamoDBClient,
+) -> str:
+    table_name = "stats"
+    client.create_table(
+        AttributeDefinitions=[
+            {
+                "AttributeName": "pool_name",
+                "AttributeType": "S",
+            },
+            {
+                "AttributeName": "item_id",
+                "AttributeType": "N",
+            },
+        ],
+        TableName=table_name,
+        KeySchema=[
+            {
+                "AttributeName": "pool_name",
+                "KeyType": "HASH",
+            },
+            {
+                "AttributeName": "item_id",
+                "KeyType": "RANGE",
+            },
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    return table_name
+
+
+def create_catalog_table(
+    client: DynamoDBClient,
+) -> str:
+    table_name = "catalog"
+    client.create_table(
+        AttributeDefinitions=[
+            {
+                "AttributeName": "pool_name",
+                "AttributeType": "S",
+            },
+        ],
+        TableName=table_name,
+        KeySchema=[
+            {
+                "AttributeName": "pool_name",
+                "KeyType": "HASH",
+            },
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    return table_name
+
+
+def create_idempotency_table(
+    client: DynamoDBClient,
+) -> str:
+    table_name = "idempotency"
+    client.create_table(
+        AttributeDefinitions=[
+            {
+                "AttributeName": "id",
+                "AttributeType": "S",
+            },
+        ],
+        TableName=table_name,
+        KeySchema=[
+            {
+                "AttributeName": "id",
+                "KeyType": "HASH",
+            },
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    return table_name
+
+
+def create_connection_table(
+    client: DynamoDBClient,
+) -> str:
+    table_name = "connection"
+    client.create_table(
+        AttributeDefinitions=[
+            {
+                "AttributeName": "connection_id",
+                "AttributeType": "S",
+            },
+            {
+                "AttributeName": "session_key",
+                "AttributeType": "S",
+            },
+        ],
+        TableName=table_name,
+        KeySchema=[
+            {
+                "AttributeName": "connection_id",
+                "KeyType": "HASH",
+            },
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                "IndexName": "session_key",
+                "KeySchema": [
+                    {
+                        "AttributeName": "session_key",
+                        "KeyType": "HASH",
+                    },
+                ],
+                "Projection": {
+                    "ProjectionType": "KEYS_ONLY",
+                },
+            },
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    return table_name
+
+
 class LambdaContext(NamedTuple):
     function_name: str
     function_version: str
@@ -136,6 +277,9 @@ class LambdaContext(NamedTuple):
             log_stream_name="",
         )
 
+    def get_remaining_time_in_millis(self: Self) -> int:
+        return 3000
+
 
 def build_lambda_event(body: dict, path_paramater: dict) -> Any:  # noqa: ANN401
     template_path = Path.cwd() / "tests" / "resource" / "apigw_event_template.json"
@@ -144,3 +288,35 @@ def build_lambda_event(body: dict, path_paramater: dict) -> Any:  # noqa: ANN401
     template["body"] = json.dumps(body)
     template["pathParameters"] = path_paramater
     return template
+
+
+def build_http_api_event(
+    method: str,
+    raw_path: str,
+    body: dict | None = None,
+    path_paramater: dict | None = None,
+) -> dict[str, Any]:
+    # HTTP API / 関数 URL (ペイロード形式 2.0) のイベント
+    event: dict[str, Any] = {
+        "version": "2.0",
+        "routeKey": "$default",
+        "rawPath": raw_path,
+        "rawQueryString": "",
+        "headers": {"content-type": "application/json"},
+        "requestContext": {"http": {"method": method, "path": raw_path}},
+        "isBase64Encoded": body is not None,
+    }
+    if body is not None:
+        event["body"] = base64.b64encode(json.dumps(body).encode()).decode()
+    if path_paramater is not None:
+        event["pathParameters"] = path_paramater
+    return event
+
+
+def load_stream_event(table_name: str) -> Any:  # noqa: ANN401
+    # DynamoDB Streams から受け取ったイベントを記録したもの
+    event_path = (
+        Path.cwd() / "tests" / "resource" / f"dynamodb_stream_{table_name}_event.json"
+    )
+    with event_path.open() as f:
+        return json.load(f)
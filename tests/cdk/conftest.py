@@ -0,0 +1,17 @@
+import pytest
+
+from cdk import lmd_construct
+from cdk.paramater import paramater
+
+
+@pytest.fixture(autouse=True)
+def function_layer_dirs(monkeypatch, tmp_path):
+    # 関数専用のレイヤーはデプロイ時に pip でビルドするため, 空のディレクトリで代用する
+    for architecture in lmd_construct.FUNCTION_LAYER_DIRS:
+        for construct_id in paramater["lambda"]:
+            (tmp_path / architecture / construct_id).mkdir(parents=True)
+        monkeypatch.setitem(
+            lmd_construct.FUNCTION_LAYER_DIRS,
+            architecture,
+            str(tmp_path / architecture / "{}"),
+        )
@@ -1,8 +1,12 @@
+import json
+
 import aws_cdk as cdk
 from aws_cdk import assertions
 from syrupy.matchers import path_type
 
+from cdk import lmd_construct
 from cdk.destiny_dice_stack import DestinyDiceStack
+from cdk.paramater import build_name, paramater
 
 
 def test_snapshot(snapshot) -> None:
@@ -19,3 +23,118 @@ def test_snapshot(snapshot) -> None:
         regex=True,
     )
     assert template.to_json() == snapshot(matcher=matcher)
+
+
+def test_router(monkeypatch) -> None:
+    # 1. 初期化
+    monkeypatch.setitem(paramater["router"], "enabled", value=True)
+
+    # 2. テストの実行
+    stack = DestinyDiceStack(cdk.Stack(), "test", "hoge")
+    template = assertions.Template.from_stack(stack)
+
+    # 3. アサーション
+    template.has_resource_properties(
+        "AWS::Lambda::Function",
+        {
+            "Handler": "router.lambda_function.lambda_handler",
+            "Environment": {
+                "Variables": assertions.Match.object_like(
+                    {
+                        "LOG_LEVEL": "INFO",
+                        "CREATE_POOL__TENANT_RATE_LIMIT": "1",
+                        "DICE__TENANT_RATE_LIMIT": "50",
+                    },
+                ),
+            },
+        },
+    )
+    # routes の 4 メソッドは router に, それ以外は各関数に統合される
+    methods = template.find_resources("AWS::ApiGateway::Method")
+    uris = [
+        json.dumps(x["Properties"]["Integration"].get("Uri"))
+        for x in methods.values()
+        if x["Properties"]["HttpMethod"] != "OPTIONS"
+    ]
+    assert sum("router" in x for x in uris) == 4
+
+
+def test_architecture(monkeypatch, tmp_path) -> None:
+    # 1. 初期化
+    monkeypatch.setitem(paramater["lambda"]["dice"], "architecture", "arm64")
+    monkeypatch.setitem(paramater["lambda"]["dice"], "memory_size", 1024)
+    monkeypatch.setitem(lmd_construct.LAYER_DIRS, "arm64", str(tmp_path))
+
+    # 2. テストの実行
+    stack = DestinyDiceStack(cdk.Stack(), "test", "hoge")
+    template = assertions.Template.from_stack(stack)
+
+    # 3. アサーション
+    template.has_resource_properties(
+        "AWS::Lambda::Function",
+        {
+            "FunctionName": "dice-function-dice",
+            "Architectures": ["arm64"],
+            "MemorySize": 1024,
+        },
+    )
+    template.has_resource_properties(
+        "AWS::Lambda::LayerVersion",
+        {"CompatibleArchitectures": ["arm64"]},
+    )
+    # dice のほか, 既定で無効な router と origin_verify (HTTP API 用) は作られない
+    template.resource_properties_count_is(
+        "AWS::Lambda::Function",
+        {"Architectures": ["x86_64"]},
+        len(paramater["lambda"]) - 3,
+    )
+
+
+def test_api_cache(monkeypatch) -> None:
+    # 1. 初期化
+    monkeypatch.setitem(paramater["api_cache"], "enabled", value=True)
+
+    # 2. テストの実行
+    stack = DestinyDiceStack(cdk.Stack(), "test", "hoge")
+    template = assertions.Template.from_stack(stack)
+
+    # 3. アサーション
+    template.has_resource_properties(
+        "AWS::ApiGateway::Stage",
+        {"CacheClusterEnabled": True, "CacheClusterSize": "0.5"},
+    )
+    # 書き込み系の 2 関数と, 版数を進める stream_processor がキャッシュキーを取り直す
+    template.resource_properties_count_is(
+        "AWS::Lambda::Function",
+        {
+            "Environment": {
+                "Variables": assertions.Match.object_like(
+                    {
+                        "API_CACHE_URL": assertions.Match.any_value(),
+                        # 取り直しの GET は REST API の WAF をヘッダで通る
+                        "ORIGIN_VERIFY_HEADER": paramater["origin_verify"]["header"],
+                        "ORIGIN_SECRET_ARN": assertions.Match.any_value(),
+                    },
+                ),
+            },
+        },
+        3,
+    )
+
+
+def test_function_layer() -> None:
+    # 1. 初期化
+    stack = DestinyDiceStack(cdk.Stack(), "test", "hoge")
+
+    # 2. テストの実行
+    template = assertions.Template.from_stack(stack)
+
+    # 3. アサーション
+    # numpy などの重い依存は simulate にだけ付き, 他の関数の展開サイズを増やさない
+    layers = {
+        x["Properties"]["FunctionName"]: len(x["Properties"]["Layers"])
+        for x in template.find_resources("AWS::Lambda::Function").values()
+        if "FunctionName" in x["Properties"]
+    }
+    assert layers.pop(build_name("function", "simulate")) == 4
+    assert set(layers.values()) == {3}
@@ -0,0 +1,132 @@
+import json
+import shutil
+import subprocess
+import urllib.parse
+from typing import Any
+from unittest.mock import MagicMock
+
+import aws_cdk as cdk
+import pytest
+from aws_cdk import assertions
+
+from cdk.destiny_dice_stack import DestinyDiceStack
+from cdk.edge_construct import REQUIRE_VERSION_FUNCTION
+from cdk.paramater import build_name, paramater
+
+
+def api_distribution(template: assertions.Template) -> dict[str, Any] | None:
+    return next(
+        (
+            x["Properties"]["DistributionConfig"]
+            for x in template.find_resources("AWS::CloudFront::Distribution").values()
+            if x["Properties"]["DistributionConfig"].get("Comment")
+            == build_name("cloudfront", "api")
+        ),
+        None,
+    )
+
+
+def viewer_request(uri: str, querystring: dict[str, str]) -> dict[str, Any]:
+    # CloudFront Functions と同じく event.request を受け取る handler を node で実行する
+    event = {
+        "request": {
+            "uri": uri,
+            "querystring": {k: {"value": v} for k, v in querystring.items()},
+        },
+    }
+    script = (
+        REQUIRE_VERSION_FUNCTION
+        + "console.log(JSON.stringify(handler(JSON.parse(process.argv[1]))));"
+    )
+    result = subprocess.run(
+        ["node", "-e", script, json.dumps(event)],  # noqa: S603, S607
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    response: dict[str, Any] = json.loads(result.stdout)
+    return response
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="node is not installed")
+def test_snapshot_path(monkeypatch):
+    # 1. 初期化
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-west-2")
+    monkeypatch.setitem(paramater["edge"], "enabled", value=True)
+    from src.app.create_pool.lambda_function import SnapshotParam, put_snapshot
+    from src.app.list_pool.lambda_function import CatalogParam
+
+    template = assertions.Template.from_stack(
+        DestinyDiceStack(cdk.Stack(), "test", "hoge"),
+    )
+    distribution = api_distribution(template)
+    assert distribution is not None
+    origin_path = next(
+        x["OriginPath"] for x in distribution["Origins"] if "S3OriginConfig" in x
+    )
+    s3 = MagicMock()
+    put_snapshot(
+        client=s3,
+        param=SnapshotParam(
+            SNAPSHOT_BUCKET_NAME="snapshot",
+            SNAPSHOT_DIR="",
+            SNAPSHOT_COMPRESS=False,
+            SNAPSHOT_COMPRESS_MIN_BYTES=0,
+        ),
+        pool_name="acme#a b",
+        data=b"",
+    )
+    path = urllib.parse.urlsplit(
+        CatalogParam.from_env().snapshot_path("acme#a b", 3),
+    )
+
+    # 2. テストの実行
+    request = viewer_request(path.path, dict(urllib.parse.parse_qsl(path.query)))
+    unversioned = viewer_request(path.path, {})
+
+    # 3. アサーション
+    # list_pool が返す URL は, create_pool が書き込んだオブジェクトを指す
+    key = (origin_path + urllib.parse.unquote(request["uri"])).lstrip("/")
+    assert key == s3.put_object.call_args.kwargs["Key"]
+    assert unversioned["statusCode"] == 400
+
+
+def test_origin_verify(monkeypatch):
+    # 1. 初期化
+    monkeypatch.setitem(paramater["edge"], "enabled", value=True)
+
+    # 2. テストの実行
+    template = assertions.Template.from_stack(
+        DestinyDiceStack(cdk.Stack(), "test", "hoge"),
+    )
+    monkeypatch.setitem(paramater["edge"], "enabled", value=False)
+    disabled = assertions.Template.from_stack(
+        DestinyDiceStack(cdk.Stack(), "test", "hoge"),
+    )
+
+    # 3. アサーション
+    # CloudFront は REST API への要求にヘッダを付け, REST API の WAF はその値を通す
+    distribution = api_distribution(template)
+    assert distribution is not None
+    headers = next(
+        x["OriginCustomHeaders"]
+        for x in distribution["Origins"]
+        if "CustomOriginConfig" in x
+    )
+    header = paramater["origin_verify"]["header"]
+    assert [x["HeaderName"] for x in headers] == [header]
+    webacl = next(
+        x["Properties"]
+        for x in template.find_resources("AWS::WAFv2::WebACL").values()
+        if x["Properties"]["Scope"] == "REGIONAL"
+    )
+    statement = next(
+        x["Statement"]["ByteMatchStatement"]
+        for x in webacl["Rules"]
+        if "ByteMatchStatement" in x["Statement"]
+    )
+    assert statement["FieldToMatch"] == {"SingleHeader": {"Name": header.lower()}}
+    assert statement["SearchString"] == headers[0]["HeaderValue"]
+    # IP アドレスの許可リストは CloudFront の WAF で確かめる
+    assert distribution["WebACLId"] == "hoge"
+    assert api_distribution(disabled) is None
@@ -0,0 +1,70 @@
+import aws_cdk as cdk
+from aws_cdk import assertions
+
+from cdk.destiny_dice_stack import DestinyDiceStack
+from cdk.paramater import build_name, paramater
+
+
+def test_front_door(monkeypatch):
+    # 1. 初期化
+    monkeypatch.setitem(paramater["front_door"], "http_api", value=True)
+    monkeypatch.setitem(paramater["front_door"], "function_url", value=True)
+    monkeypatch.setitem(paramater["front_door"], "rest_api_data_trace", value=False)
+
+    # 2. テストの実行
+    stack = DestinyDiceStack(cdk.Stack(), "test", "hoge")
+    template = assertions.Template.from_stack(stack)
+
+    # 3. アサーション
+    template.has_resource_properties("AWS::ApiGatewayV2::Api", {"ProtocolType": "HTTP"})
+    template.resource_properties_count_is(
+        "AWS::ApiGatewayV2::Integration",
+        {"PayloadFormatVersion": "2.0"},
+        7,
+    )
+    template.has_resource_properties(
+        "AWS::ApiGatewayV2::Route",
+        {"RouteKey": "DELETE /pools/{pool_name}"},
+    )
+    # 関数 URL は IAM の署名を求め, HTTP API はオーソライザーでヘッダを確かめる
+    template.resource_properties_count_is(
+        "AWS::Lambda::Url",
+        {"AuthType": "AWS_IAM"},
+        7,
+    )
+    header = paramater["origin_verify"]["header"]
+    template.has_resource_properties(
+        "AWS::ApiGatewayV2::Authorizer",
+        {
+            "AuthorizerType": "REQUEST",
+            "IdentitySource": [f"$request.header.{header}"],
+            "EnableSimpleResponses": True,
+        },
+    )
+    # WebSocket API のルートを除き, HTTP API ("<メソッド> <パス>") はすべて確かめる
+    routes = [
+        x["Properties"]
+        for x in template.find_resources("AWS::ApiGatewayV2::Route").values()
+        if " " in x["Properties"]["RouteKey"]
+    ]
+    assert routes
+    assert all(x.get("AuthorizationType") == "CUSTOM" for x in routes)
+    distribution = next(
+        x["Properties"]["DistributionConfig"]
+        for x in template.find_resources("AWS::CloudFront::Distribution").values()
+        if x["Properties"]["DistributionConfig"].get("Comment")
+        == build_name("cloudfront", "http_api")
+    )
+    assert [
+        y["HeaderName"]
+        for x in distribution["Origins"]
+        for y in x.get("OriginCustomHeaders", [])
+    ] == [header]
+    template.has_resource_properties(
+        "AWS::ApiGateway::Stage",
+        {
+            "MethodSettings": assertions.Match.array_with(
+                [assertions.Match.object_like({"DataTraceEnabled": False})],
+            ),
+        },
+    )
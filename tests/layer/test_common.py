@@ -0,0 +1,30 @@
+import json
+from decimal import Decimal
+
+
+def test_snapshot_round_trip():
+    # 1. 初期化
+    from common import build_snapshot, read_snapshot
+
+    items = [
+        {"item_id": 0, "item_name": "a"},
+        {"item_id": 2, "item_name": "b", "weight": Decimal("0.25")},
+    ]
+
+    # 2. テストの実行
+    res = {
+        compress: read_snapshot(memoryview(build_snapshot(items, compress=compress)))
+        for compress in [False, True]
+    }
+
+    # 3. アサーション
+    # 書き出し側 (create_pool / archiver) と読み込み側 (dice) で同じ形式を使う
+    for buffer, offsets, item_ids in res.values():
+        assert list(item_ids) == [0, 2]
+        assert [
+            json.loads(bytes(buffer[offsets[i] : offsets[i + 1]]))
+            for i in range(len(item_ids))
+        ] == [
+            {"item_id": 0, "item_name": "a"},
+            {"item_id": 2, "item_name": "b", "weight": 0.25},
+        ]
@@ -0,0 +1,27 @@
+import random
+
+from aws_lambda_powertools.logging import Logger
+
+from tests.app.utils import LambdaContext
+
+
+def test_profiled_rng(monkeypatch):
+    # 1. 初期化
+    monkeypatch.setenv("PROFILE_SAMPLE_RATE", "0.5")
+    monkeypatch.setenv("PROFILE_INTERVAL_MS", "0.1")
+    from profiler import profiled
+
+    @profiled(Logger(service="profiler"))
+    def handler(event: dict, context: LambdaContext) -> dict:
+        return {"roll": random.random()}
+
+    random.seed(1)
+    expected = [random.random() for _ in range(10)]
+
+    # 2. テストの実行
+    random.seed(1)
+    res = [handler({}, LambdaContext.empty())["roll"] for _ in range(10)]
+
+    # 3. アサーション
+    # 採取の判定でハンドラの乱数列 (出目) を進めない
+    assert res == expected
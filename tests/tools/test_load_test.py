@@ -0,0 +1,117 @@
+import pytest
+
+from tools import load_test
+
+
+def build_workload(mix: dict[str, float]) -> load_test.Workload:
+    return load_test.Workload(
+        mix=mix,
+        num_pools=10,
+        zipf_s=1.0,
+        num_items=3,
+        prefix="t",
+    )
+
+
+def test_histogram():
+    # 1. 初期化
+    histogram = load_test.Histogram()
+
+    # 2. テストの実行
+    for i in range(1, 101):
+        histogram.add(i / 1000)
+
+    # 3. アサーション
+    # バケットの境界は 1.1 倍刻みのため 10% 以内の誤差で求まる
+    assert histogram.total == 100
+    assert histogram.max == 0.1
+    assert histogram.percentile(50) == pytest.approx(0.05, rel=0.1)
+    assert histogram.percentile(99) == pytest.approx(0.099, rel=0.1)
+    assert histogram.percentile(100) == 0.1
+    assert load_test.Histogram().percentile(99) == 0.0
+
+
+def test_pool_cum_weights():
+    # 1. 初期化
+    workload = build_workload({"dice": 1})
+
+    # 2. テストの実行
+    cum_weights = workload.pool_cum_weights()
+
+    # 3. アサーション
+    # s = 1 では順位 k のプールの重みが 1 / k
+    weights = [b - a for a, b in zip([0.0, *cum_weights], cum_weights, strict=False)]
+    assert weights == pytest.approx([1 / k for k in range(1, 11)])
+    assert workload.pool_names()[0] == "t-0"
+
+
+def test_operation_generator_mix():
+    # 1. 初期化
+    generator = load_test.OperationGenerator(
+        build_workload({"dice": 9, "list_pool": 1}),
+        seed=1,
+    )
+
+    # 2. テストの実行
+    operations = [generator.draw() for _ in range(2000)]
+
+    # 3. アサーション
+    dice = [x for x in operations if x.name == "dice"]
+    assert len(dice) / len(operations) == pytest.approx(0.9, abs=0.03)
+    # 最も人気のプールが最も多く選ばれる
+    counts = {x.path: 0 for x in dice}
+    for x in dice:
+        counts[x.path] += 1
+    assert max(counts, key=lambda x: counts[x]) == "/pools/t-0/dice"
+    assert {x.path for x in operations if x.name == "list_pool"} == {"/pools"}
+
+
+def test_operation_generator_churn():
+    # 1. 初期化
+    generator = load_test.OperationGenerator(
+        build_workload({"delete_pool": 1}),
+        seed=1,
+    )
+
+    # 2. テストの実行
+    # 作成が完了していないプールは削除されず, 代わりに作成が選ばれる
+    first = generator.draw()
+    second = generator.draw()
+    generator.complete(first, 200)
+    generator.complete(second, 500)
+    third = generator.draw()
+    fourth = generator.draw()
+
+    # 3. アサーション
+    assert (first.method, first.path) == ("POST", "/pools/t-churn-1")
+    assert (second.method, second.path) == ("POST", "/pools/t-churn-2")
+    # 作成に失敗したプールは削除の対象にしない
+    assert (third.method, third.path) == ("DELETE", "/pools/t-churn-1")
+    assert (fourth.method, fourth.path) == ("POST", "/pools/t-churn-3")
+
+
+def test_summarize():
+    # 1. 初期化
+    results = [
+        load_test.Result("dice", 200, 0.5, 0.010),
+        load_test.Result("dice", 429, 1.5, 0.020),
+        load_test.Result("dice", 500, 5.5, 0.030),
+        load_test.Result("create_pool", 400, 6.0, 0.040),
+    ]
+
+    # 2. テストの実行
+    report = load_test.summarize(results, interval=5.0)
+
+    # 3. アサーション
+    total = report["total"]
+    assert total["count"] == 4
+    assert (total["error_rate"], total["throttle_rate"]) == (0.25, 0.25)
+    assert total["client_error_rate"] == 0.25
+    assert total["latency_ms"]["max"] == 40.0
+    assert set(report["operations"]) == {"dice", "create_pool"}
+    assert [x["t"] for x in report["timeline"]] == [0.0, 5.0]
+    assert [x["throughput"] for x in report["timeline"]] == [0.4, 0.4]
+    assert [(x["errors"], x["throttles"]) for x in report["timeline"]] == [
+        (0, 1),
+        (1, 0),
+    ]
@@ -0,0 +1,102 @@
+import base64
+import io
+import json
+from unittest.mock import MagicMock
+
+import pytest
+
+from tools import power_tuning
+
+
+def report_log(duration: float, memory_size: int, init: float | None) -> str:
+    line = (
+        "REPORT RequestId: 00000000-0000-0000-0000-000000000000"
+        f"\tDuration: {duration} ms\tBilled Duration: {int(duration) + 1} ms"
+        f"\tMemory Size: {memory_size} MB\tMax Memory Used: 80 MB"
+    )
+    if init is not None:
+        line += f"\tInit Duration: {init} ms"
+    return base64.b64encode(f"START\n{line}\t\n".encode()).decode()
+
+
+def fake_client() -> MagicMock:
+    # 128MB では CPU 不足で大きく遅れ, 下限 10ms まではメモリを増やすほど速くなる
+    client = MagicMock()
+    state = {"memory_size": 128, "invoked": 0}
+
+    def update_function_configuration(FunctionName, MemorySize) -> None:  # noqa: N803
+        state["memory_size"] = MemorySize
+        state["invoked"] = 0
+
+    def invoke(FunctionName, Payload, LogType) -> dict:  # noqa: N803
+        duration = max(400 * (128 / state["memory_size"]) ** 1.5, 10.0)
+        init = 300.0 if state["invoked"] == 0 else None
+        state["invoked"] += 1
+        return {
+            "Payload": io.BytesIO(json.dumps({"statusCode": 200}).encode()),
+            "LogResult": report_log(duration, state["memory_size"], init),
+        }
+
+    client.get_function_configuration.return_value = {
+        "MemorySize": 128,
+        "Architectures": ["arm64"],
+    }
+    client.update_function_configuration.side_effect = update_function_configuration
+    client.invoke.side_effect = invoke
+    client.state = state
+    return client
+
+
+def test_power_tuning():
+    # 1. 初期化
+    client = fake_client()
+    events = [{"httpMethod": "GET", "path": "/pools/a/dice"}] * 4
+
+    # 2. テストの実行
+    points = power_tuning.tune(
+        client=client,
+        function_name="dice-function-dice",
+        events=events,
+        memory_sizes=[128, 1024, 3008],
+        repeat=2,
+    )
+
+    # 3. アサーション
+    # 計測後は元のメモリサイズに戻す
+    assert client.state["memory_size"] == 128
+    assert [x["memory_size"] for x in points] == [128, 1024, 3008]
+    assert all(x["architecture"] == "arm64" for x in points)
+    assert [x["cold_starts"] for x in points] == [1, 1, 1]
+    assert [x["duration_ms"]["p50"] for x in points] == [400.0, 17.68, 10.0]
+    # 実行時間が下げ止まった 3008MB は費用だけが増える
+    assert points[2]["cost_per_million_usd"] > points[1]["cost_per_million_usd"]
+    assert power_tuning.recommend(points, weight=1.0)["memory_size"] == 1024
+    assert power_tuning.recommend(points, weight=0.0)["memory_size"] == 3008
+
+
+def test_power_tuning_read_only():
+    # 1. 初期化
+    client = fake_client()
+    events = [
+        {"httpMethod": "GET", "path": "/pools/a/dice"},
+        {"httpMethod": "POST", "path": "/pools/a"},
+        {"requestContext": {"http": {"method": "DELETE"}}},
+        {"requestContext": {"http": {"method": "GET"}}},
+        {"record_rolls": []},
+    ]
+
+    # 2. テストの実行
+    with pytest.warns(UserWarning, match="skipped 3 non read-only events"):
+        points = power_tuning.tune(
+            client=client,
+            function_name="dice-function-dice",
+            events=events,
+            memory_sizes=[128],
+            repeat=2,
+        )
+
+    # 3. アサーション
+    # 書き込みや内部呼び出しのイベントは再生しない
+    assert points[0]["count"] == 4
+    payloads = [json.loads(x.kwargs["Payload"]) for x in client.invoke.call_args_list]
+    assert payloads == [events[0], events[3]] * 2
@@ -0,0 +1,68 @@
+"""ハンドラのプロファイルログを collapsed 形式にまとめるツール (開発用).
+
+PROFILE_SAMPLE_RATE を設定した関数が出力する "profile" ログを読み, 同じスタックの
+回数を合算する. 出力は flamegraph.pl や speedscope にそのまま渡せる.
+
+    aws logs filter-log-events --log-group-name /aws/lambda/dice-function-dice \\
+        --filter-pattern '{ $.message = "profile" }' --output json > events.json
+    python -m tools.flamegraph events.json > dice.folded
+"""
+import argparse
+import json
+import sys
+from collections import Counter
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any
+
+
+def iter_records(text: str) -> Iterator[dict[str, Any]]:
+    # filter-log-events の出力 / JSON Lines のどちらも受け付ける
+    try:
+        document = json.loads(text)
+    except json.JSONDecodeError:
+        document = None
+    if isinstance(document, dict) and "events" in document:
+        lines = [x["message"] for x in document["events"]]
+    elif isinstance(document, dict):
+        lines = [text]
+    else:
+        lines = text.splitlines()
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(record, dict) and "message" in record and "stacks" in record:
+            yield record
+        elif isinstance(record, dict) and isinstance(record.get("message"), str):
+            yield from iter_records(record["message"])
+
+
+def merge(records: list[dict[str, Any]], service: str | None) -> Counter[str]:
+    stacks: Counter[str] = Counter()
+    for record in records:
+        if record.get("message") != "profile":
+            continue
+        if service is not None and record.get("service") != service:
+            continue
+        for line in record["stacks"]:
+            stack, _, count = line.rpartition(" ")
+            stacks[stack] += int(count)
+    return stacks
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("files", type=Path, nargs="*", help="log files (default stdin)")
+    parser.add_argument("--service", help="only merge this POWERTOOLS_SERVICE_NAME")
+    args = parser.parse_args()
+
+    texts = [x.read_text() for x in args.files] or [sys.stdin.read()]
+    records = [record for text in texts for record in iter_records(text)]
+    for stack, count in merge(records, args.service).most_common():
+        print(f"{stack} {count}")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
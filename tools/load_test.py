@@ -0,0 +1,338 @@
+"""API の負荷試験 / ソーク試験ツール.
+
+オープンモデル (ポアソン到着) で create_pool / list_pool / delete_pool / dice を
+指定した比率で混在させ, レイテンシ分布・エラー率・スロットル率・スループットを集計する.
+
+    python -m tools.load_test --target local --rate 50 --duration 60
+    python -m tools.load_test --target https://xxx.execute-api.ap-northeast-1.amazonaws.com/v1
+    python -m tools.load_test --target local --record-events events
+"""
+import argparse
+import bisect
+import json
+import math
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, NamedTuple, Self
+
+from tools import local_env
+
+OPERATIONS = ["create_pool", "list_pool", "delete_pool", "dice"]
+STATUS_CLIENT_ERROR = 400
+STATUS_THROTTLED = 429
+STATUS_SERVER_ERROR = 500
+
+
+class Operation(NamedTuple):
+    name: str
+    method: str
+    path: str
+    body: str | None
+
+
+class Result(NamedTuple):
+    name: str
+    status: int
+    scheduled: float
+    latency: float
+
+
+class Workload(NamedTuple):
+    mix: dict[str, float]
+    num_pools: int
+    zipf_s: float
+    num_items: int
+    prefix: str
+
+    def pool_names(self: Self) -> list[str]:
+        return [f"{self.prefix}-{i}" for i in range(self.num_pools)]
+
+    def pool_cum_weights(self: Self) -> list[float]:
+        # 順位 k のプールが 1 / k^s に比例して選ばれる (Zipf 分布)
+        cum_weights = []
+        total = 0.0
+        for k in range(1, self.num_pools + 1):
+            total += 1 / k**self.zipf_s
+            cum_weights.append(total)
+        return cum_weights
+
+    def create_body(self: Self) -> str:
+        return json.dumps(
+            {"items": [{"item_name": str(i)} for i in range(self.num_items)]},
+        )
+
+
+class OperationGenerator:
+    def __init__(self: Self, workload: Workload, seed: int | None) -> None:
+        self.workload = workload
+        self.rng = random.Random(seed)
+        self.names = list(workload.mix)
+        self.weights = [workload.mix[x] for x in self.names]
+        self.pools = workload.pool_names()
+        self.pool_cum_weights = workload.pool_cum_weights()
+        self.create_body = workload.create_body()
+        self.churn = 0
+        # 作成が完了したプールだけを削除の対象とし, 作成中のプールとの競合を避ける
+        self.lock = threading.Lock()
+        self.created: list[str] = []
+
+    def draw(self: Self) -> Operation:
+        name = self.rng.choices(self.names, weights=self.weights)[0]
+        if name == "list_pool":
+            return Operation(name, "GET", "/pools", None)
+        if name == "dice":
+            pool = self.rng.choices(self.pools, cum_weights=self.pool_cum_weights)[0]
+            return Operation(name, "GET", f"/pools/{pool}/dice", None)
+        # 作成/削除は人気プールを壊さないよう別の名前空間で入れ替える
+        with self.lock:
+            if name == "delete_pool" and len(self.created) > 0:
+                pool = self.created.pop(self.rng.randrange(len(self.created)))
+                return Operation(name, "DELETE", f"/pools/{pool}", None)
+        self.churn += 1
+        pool = f"{self.workload.prefix}-churn-{self.churn}"
+        return Operation("create_pool", "POST", f"/pools/{pool}", self.create_body)
+
+    def complete(self: Self, operation: Operation, status: int) -> None:
+        if operation.name == "create_pool" and status < STATUS_CLIENT_ERROR:
+            with self.lock:
+                self.created.append(operation.path.rsplit("/", 1)[1])
+
+
+Target = Callable[[str, str, str | None], int]
+
+
+def http_target(base_url: str, timeout: float) -> Target:
+    def request(method: str, path: str, body: str | None) -> int:
+        req = urllib.request.Request(
+            url=base_url.rstrip("/") + path,
+            data=body.encode() if body is not None else None,
+            method=method,
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as res:  # noqa: S310
+                res.read()
+                return int(res.status)
+        except urllib.error.HTTPError as e:
+            return e.code
+        except Exception:
+            return 599
+
+    return request
+
+
+def local_target(endpoint_url: str | None, record_dir: Path | None) -> Target:
+    modules = local_env.setup(endpoint_url)
+    lock = threading.Lock()
+
+    def request(method: str, path: str, body: str | None) -> int:
+        route = local_env.match_route(method, path)
+        if record_dir is not None and route is not None:
+            # tools.power_tuning で再生できるよう, 関数ごとの JSON Lines に残す
+            event = local_env.build_event(method, path, route, {}, body)
+            with lock, (record_dir / f"{route[0]}.jsonl").open("a") as f:
+                f.write(json.dumps(event) + "\n")
+        return int(local_env.invoke(modules, method, path, {}, body)["statusCode"])
+
+    return request
+
+
+class Histogram:
+    # 1.1 倍刻みの対数バケット (HdrHistogram の簡易版)
+    RATIO = 1.1
+    MIN = 1e-4
+
+    def __init__(self: Self) -> None:
+        self.bounds = [self.MIN * self.RATIO**i for i in range(200)]
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0
+        self.max = 0.0
+
+    def add(self: Self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += 1
+        self.max = max(self.max, value)
+
+    def percentile(self: Self, p: float) -> float:
+        if self.total == 0:
+            return 0.0
+        rank = math.ceil(self.total * p / 100)
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.bounds[min(i, len(self.bounds) - 1)], self.max)
+        return self.max
+
+
+def prepare(target: Target, workload: Workload) -> None:
+    body = workload.create_body()
+    for pool in workload.pool_names():
+        target("DELETE", f"/pools/{pool}", None)
+        target("POST", f"/pools/{pool}", body)
+
+
+def run(
+    target: Target,
+    generator: OperationGenerator,
+    rate: float,
+    duration: float,
+    concurrency: int,
+) -> list[Result]:
+    results: list[Result] = []
+    lock = threading.Lock()
+
+    def execute(operation: Operation, scheduled: float) -> None:
+        status = target(operation.method, operation.path, operation.body)
+        # 予定到着時刻から計測し, 送信遅延による過小評価 (coordinated omission) を避ける
+        latency = time.perf_counter() - scheduled
+        generator.complete(operation, status)
+        with lock:
+            results.append(Result(operation.name, status, scheduled - start, latency))
+
+    start = time.perf_counter()
+    scheduled = start
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            scheduled += generator.rng.expovariate(rate)
+            if scheduled - start > duration:
+                break
+            time.sleep(max(0.0, scheduled - time.perf_counter()))
+            executor.submit(execute, generator.draw(), scheduled)
+    return results
+
+
+def is_error(result: Result) -> bool:
+    return result.status >= STATUS_SERVER_ERROR
+
+
+def is_throttle(result: Result) -> bool:
+    return result.status == STATUS_THROTTLED
+
+
+def is_client_error(result: Result) -> bool:
+    return (
+        STATUS_CLIENT_ERROR <= result.status < STATUS_SERVER_ERROR
+        and not is_throttle(result)
+    )
+
+
+def summarize(results: list[Result], interval: float) -> dict[str, Any]:
+    def stats(rows: list[Result]) -> dict[str, Any]:
+        histogram = Histogram()
+        for row in rows:
+            histogram.add(row.latency)
+        count = len(rows)
+        return {
+            "count": count,
+            "error_rate": sum(is_error(r) for r in rows) / max(count, 1),
+            "throttle_rate": sum(is_throttle(r) for r in rows) / max(count, 1),
+            "client_error_rate": (
+                sum(is_client_error(r) for r in rows) / max(count, 1)
+            ),
+            "latency_ms": {
+                f"p{p}": round(histogram.percentile(p) * 1000, 2)
+                for p in (50, 90, 95, 99, 99.9)
+            }
+            | {"max": round(histogram.max * 1000, 2)},
+        }
+
+    timeline: dict[int, list[Result]] = {}
+    for row in results:
+        timeline.setdefault(int(row.scheduled // interval), []).append(row)
+    return {
+        "total": stats(results),
+        "operations": {
+            name: stats([r for r in results if r.name == name])
+            for name in OPERATIONS
+            if any(r.name == name for r in results)
+        },
+        "timeline": [
+            {
+                "t": k * interval,
+                "throughput": len(rows) / interval,
+                "p99_ms": round(stats(rows)["latency_ms"]["p99"], 2),
+                "errors": sum(is_error(r) for r in rows),
+                "throttles": sum(is_throttle(r) for r in rows),
+            }
+            for k, rows in sorted(timeline.items())
+        ],
+    }
+
+
+def parse_mix(value: str) -> dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        name, ratio = part.split("=")
+        if name not in OPERATIONS:
+            msg = f"unknown operation: {name}"
+            raise argparse.ArgumentTypeError(msg)
+        mix[name] = float(ratio)
+    return mix
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target", default="local", help="local or base URL")
+    parser.add_argument("--endpoint-url", help="DynamoDB Local (local only)")
+    parser.add_argument("--rate", type=float, default=20.0, help="requests/sec")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default="create_pool=1,list_pool=10,delete_pool=1,dice=88",
+    )
+    parser.add_argument("--pools", type=int, default=100)
+    parser.add_argument("--zipf-s", type=float, default=1.1)
+    parser.add_argument("--items", type=int, default=100, help="items per pool")
+    parser.add_argument("--prefix", default="loadtest")
+    parser.add_argument("--interval", type=float, default=5.0)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--skip-prepare", action="store_true")
+    parser.add_argument("--output", help="write JSON report to file")
+    parser.add_argument(
+        "--record-events",
+        type=Path,
+        help="write invoked events as <function>.jsonl (local only)",
+    )
+    args = parser.parse_args()
+
+    if args.target == "local":
+        if args.record_events is not None:
+            args.record_events.mkdir(parents=True, exist_ok=True)
+        target = local_target(args.endpoint_url, args.record_events)
+    else:
+        target = http_target(args.target, args.timeout)
+    workload = Workload(
+        mix=args.mix,
+        num_pools=args.pools,
+        zipf_s=args.zipf_s,
+        num_items=args.items,
+        prefix=args.prefix,
+    )
+    if not args.skip_prepare:
+        prepare(target, workload)
+    results = run(
+        target=target,
+        generator=OperationGenerator(workload, args.seed),
+        rate=args.rate,
+        duration=args.duration,
+        concurrency=args.concurrency,
+    )
+    report = json.dumps(summarize(results, args.interval), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:  # noqa: PTH123
+            f.write(report)
+    print(report)  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""API Gateway Management API (@connections) のローカル代替サーバー (開発・テスト用).
+
+session 関数からの post_to_connection を受け取り, 接続ごとに記録する.
+WEBSOCKET_ENDPOINT_URL にこのサーバーの URL を指定して使う.
+
+    python -m tools.local_connections --port 8081
+"""
+import argparse
+import json
+import threading
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Self
+from urllib.parse import unquote
+
+CONNECTIONS_PREFIX = "/@connections/"
+
+
+class LocalConnectionsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self: Self, address: tuple[str, int]) -> None:
+        super().__init__(address, LocalConnectionsHandler)
+        self.messages: dict[str, list[bytes]] = {}
+        # 切断済みとして扱い, 410 Gone を返す接続 ID
+        self.gone: set[str] = set()
+        self.lock = threading.Lock()
+
+    def url(self: Self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host!s}:{port}"
+
+
+class LocalConnectionsHandler(BaseHTTPRequestHandler):
+    server: LocalConnectionsServer
+
+    def do_POST(self: Self) -> None:  # noqa: N802
+        # ステージ名の有無に関わらず /@connections/{connectionId} を受け付ける
+        _, _, connection_id = self.path.partition(CONNECTIONS_PREFIX)
+        connection_id = unquote(connection_id)
+        length = int(self.headers.get("Content-Length", 0))
+        data = self.rfile.read(length)
+        if not connection_id:
+            self.reply(HTTPStatus.NOT_FOUND, {"message": "Not Found"})
+        elif connection_id in self.server.gone:
+            self.reply(HTTPStatus.GONE, {"__type": "GoneException"})
+        else:
+            with self.server.lock:
+                self.server.messages.setdefault(connection_id, []).append(data)
+            self.reply(HTTPStatus.OK, {})
+
+    def reply(self: Self, status: HTTPStatus, body: dict) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("x-amzn-ErrorType", str(body.get("__type", "")))
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+
+    server = LocalConnectionsServer((args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""全ハンドラをまとめて提供するローカル HTTP サーバー (開発・プロファイル用).
+
+AppConstruct と同じルーティングで各 lambda_handler を呼び出す.
+DynamoDB は moto (既定) か DynamoDB Local (--endpoint-url) を使用する.
+
+    python -m tools.local_server --port 8080
+    python -m tools.local_server --endpoint-url http://localhost:8000 --profile-dir prof
+"""
+import argparse
+import cProfile
+import os
+import pstats
+import shutil
+import signal
+import subprocess
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Self
+
+from tools import local_env
+
+
+class RouteProfiler:
+    # ルート (関数) ごとに cProfile の結果を集約する
+    def __init__(self: Self, output_dir: Path) -> None:
+        self.output_dir = output_dir
+        self.stats: dict[str, pstats.Stats] = {}
+        self.lock = threading.Lock()
+
+    def add(self: Self, function: str, profile: cProfile.Profile) -> None:
+        with self.lock:
+            if function in self.stats:
+                self.stats[function].add(profile)
+            else:
+                self.stats[function] = pstats.Stats(profile)
+
+    def dump(self: Self) -> None:
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        with self.lock:
+            for function, stats in self.stats.items():
+                stats.dump_stats(self.output_dir / f"{function}.prof")
+
+
+class LocalApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self: Self,
+        address: tuple[str, int],
+        modules: dict[str, ModuleType],
+        profiler: RouteProfiler | None = None,
+    ) -> None:
+        super().__init__(address, LocalApiHandler)
+        self.modules = modules
+        self.profiler = profiler
+
+
+class LocalApiHandler(BaseHTTPRequestHandler):
+    server: LocalApiServer
+
+    def do_GET(self: Self) -> None:  # noqa: N802
+        self.dispatch()
+
+    def do_POST(self: Self) -> None:  # noqa: N802
+        self.dispatch()
+
+    def do_DELETE(self: Self) -> None:  # noqa: N802
+        self.dispatch()
+
+    def do_OPTIONS(self: Self) -> None:  # noqa: N802
+        # CORS プリフライトは API Gateway が応答するため, ここでも Lambda を通さない
+        self.send_response(204)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Allow-Methods", "GET, POST, DELETE")
+        self.send_header("Access-Control-Allow-Headers", "*")
+        self.end_headers()
+
+    def dispatch(self: Self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode() if length > 0 else None
+        route = local_env.match_route(self.command, self.path)
+        # py-spy --threads でルートごとに区別できるようスレッド名を付ける
+        if route is not None:
+            threading.current_thread().name = f"route:{route[0]}"
+        profile = None
+        if self.server.profiler is not None and route is not None:
+            profile = cProfile.Profile()
+            profile.enable()
+        try:
+            response = local_env.invoke(
+                self.server.modules,
+                self.command,
+                self.path,
+                dict(self.headers.items()),
+                body,
+            )
+        finally:
+            if profile is not None and route is not None:
+                profile.disable()
+                assert self.server.profiler is not None
+                self.server.profiler.add(route[0], profile)
+        self.write(response)
+
+    def write(self: Self, response: dict[str, Any]) -> None:
+        payload = response.get("body", "").encode()
+        self.send_response(response["statusCode"])
+        for key, value in response.get("headers", {}).items():
+            self.send_header(key, str(value))
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def start_py_spy(output: Path) -> subprocess.Popen | None:
+    py_spy = shutil.which("py-spy")
+    if py_spy is None:
+        return None
+    output.parent.mkdir(parents=True, exist_ok=True)
+    return subprocess.Popen(
+        [  # noqa: S603
+            py_spy,
+            "record",
+            "--threads",
+            "--idle",
+            "--format",
+            "speedscope",
+            "--output",
+            str(output),
+            "--pid",
+            str(os.getpid()),
+        ],
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--endpoint-url", help="DynamoDB Local endpoint")
+    parser.add_argument("--profile-dir", type=Path, help="dump cProfile per route")
+    parser.add_argument("--py-spy", type=Path, help="record py-spy output file")
+    args = parser.parse_args()
+
+    modules = local_env.setup(args.endpoint_url)
+    profiler = RouteProfiler(args.profile_dir) if args.profile_dir else None
+    server = LocalApiServer((args.host, args.port), modules, profiler)
+    py_spy = start_py_spy(args.py_spy) if args.py_spy else None
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if profiler is not None:
+            profiler.dump()
+        if py_spy is not None:
+            py_spy.send_signal(signal.SIGINT)
+            py_spy.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""Lambda のメモリサイズごとの実行時間と費用を計測するツール (開発用).
+
+デプロイ済みの関数のメモリサイズを順に切り替えながら記録済みのイベントを再生し,
+REPORT 行の課金時間から 1 呼び出しあたりの費用とレイテンシの曲線を求める.
+計測後は元のメモリサイズに戻す. アーキテクチャは paramater で切り替えてデプロイし,
+前回の結果を --baseline に渡すと両方をまとめて比較する. 実データを書き換えないよう,
+再生するのは GET のイベントだけで, それ以外は警告を出して読み飛ばす.
+
+    python -m tools.load_test --target local --record-events events
+    python -m tools.power_tuning dice --events events/dice.jsonl --output x86.json
+    python -m tools.power_tuning dice --events events/dice.jsonl --baseline x86.json
+"""
+import argparse
+import base64
+import json
+import math
+import re
+import warnings
+from pathlib import Path
+from typing import Any, NamedTuple
+
+import boto3
+from mypy_boto3_lambda import LambdaClient
+
+from cdk.paramater import build_name, paramater
+
+MEMORY_SIZES = [128, 256, 512, 1024, 1769, 3008]
+# 東京リージョンのオンデマンド料金 USD, 課金時間には初期化時間も含まれる
+PRICE_PER_GB_SECOND = {"x86_64": 0.0000166667, "arm64": 0.0000133334}
+PRICE_PER_REQUEST = 0.20 / 1_000_000
+REPORT_PATTERN = re.compile(
+    r"\tDuration: (?P<duration>[\d.]+) ms"
+    r"\tBilled Duration: (?P<billed>\d+) ms"
+    r"\tMemory Size: \d+ MB"
+    r"\tMax Memory Used: (?P<max_memory>\d+) MB"
+    r"(?:\tInit Duration: (?P<init>[\d.]+) ms)?",
+)
+STATUS_SERVER_ERROR = 500
+READ_ONLY_METHODS = ["GET", "HEAD"]
+
+
+class Invocation(NamedTuple):
+    duration_ms: float
+    billed_ms: int
+    max_memory_mb: int
+    init_ms: float | None
+    status: int
+
+
+def parse_report(log_result: str, status: int) -> Invocation | None:
+    # invoke(LogType="Tail") が返す末尾 4KB のログ (Base64) から REPORT 行を取り出す
+    match = REPORT_PATTERN.search(base64.b64decode(log_result).decode())
+    if match is None:
+        return None
+    return Invocation(
+        duration_ms=float(match["duration"]),
+        billed_ms=int(match["billed"]),
+        max_memory_mb=int(match["max_memory"]),
+        init_ms=float(match["init"]) if match["init"] is not None else None,
+        status=status,
+    )
+
+
+def load_events(path: Path) -> list[dict[str, Any]]:
+    # JSON の配列 / JSON Lines のどちらも受け付ける
+    text = path.read_text()
+    try:
+        document = json.loads(text)
+    except json.JSONDecodeError:
+        return [json.loads(x) for x in text.splitlines() if x.strip()]
+    return document if isinstance(document, list) else [document]
+
+
+def http_method(event: dict[str, Any]) -> str:
+    # REST API (1.0) と HTTP API (2.0) のイベント. 内部呼び出しのイベントは空
+    http = event.get("requestContext", {}).get("http", {})
+    method: str = event.get("httpMethod") or http.get("method", "")
+    return method.upper()
+
+
+def read_only_events(events: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    # 書き込みを繰り返すと実データが変わり, 2 回目以降は "already exists" などの
+    # 400 の経路を計測してしまうため, 読み取りのイベントだけを再生する
+    read_only = [x for x in events if http_method(x) in READ_ONLY_METHODS]
+    if len(read_only) < len(events):
+        warnings.warn(
+            f"skipped {len(events) - len(read_only)} non read-only events",
+            stacklevel=2,
+        )
+    return read_only
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(math.ceil(len(ordered) * p / 100) - 1, 0)]
+
+
+def summarize(
+    architecture: str,
+    memory_size: int,
+    invocations: list[Invocation],
+) -> dict[str, Any]:
+    # レイテンシは初期化を除いた実行時間, 費用は課金時間 (初期化込み) で求める
+    durations = [x.duration_ms for x in invocations]
+    cost = sum(
+        x.billed_ms / 1000 * memory_size / 1024 * PRICE_PER_GB_SECOND[architecture]
+        + PRICE_PER_REQUEST
+        for x in invocations
+    )
+    return {
+        "architecture": architecture,
+        "memory_size": memory_size,
+        "count": len(invocations),
+        "cold_starts": sum(x.init_ms is not None for x in invocations),
+        "errors": sum(x.status >= STATUS_SERVER_ERROR for x in invocations),
+        "duration_ms": {
+            f"p{p}": round(percentile(durations, p), 2) for p in (50, 95, 99)
+        },
+        "max_memory_used_mb": max((x.max_memory_mb for x in invocations), default=0),
+        "cost_per_million_usd": round(cost / max(len(invocations), 1) * 1e6, 4),
+    }
+
+
+def recommend(points: list[dict[str, Any]], weight: float) -> dict[str, Any]:
+    # 費用と p95 をそれぞれ最小値で割って正規化し, weight で重み付けした和が最小の点
+    candidates = [x for x in points if x["errors"] == 0] or points
+    min_cost = min(x["cost_per_million_usd"] for x in candidates) or 1.0
+    min_p95 = min(x["duration_ms"]["p95"] for x in candidates) or 1.0
+
+    def score(point: dict[str, Any]) -> float:
+        return float(
+            weight * point["cost_per_million_usd"] / min_cost
+            + (1 - weight) * point["duration_ms"]["p95"] / min_p95,
+        )
+
+    return min(candidates, key=score)
+
+
+def configure(client: LambdaClient, function_name: str, memory_size: int) -> None:
+    client.update_function_configuration(
+        FunctionName=function_name,
+        MemorySize=memory_size,
+    )
+    client.get_waiter("function_updated").wait(FunctionName=function_name)
+
+
+def replay(
+    client: LambdaClient,
+    function_name: str,
+    events: list[dict[str, Any]],
+    repeat: int,
+) -> list[Invocation]:
+    invocations = []
+    for _ in range(repeat):
+        for event in events:
+            response = client.invoke(
+                FunctionName=function_name,
+                Payload=json.dumps(event).encode(),
+                LogType="Tail",
+            )
+            payload = json.loads(response["Payload"].read() or b"{}")
+            status = (
+                STATUS_SERVER_ERROR
+                if "FunctionError" in response
+                else int(payload.get("statusCode", 200))
+            )
+            invocation = parse_report(response.get("LogResult", ""), status)
+            if invocation is not None:
+                invocations.append(invocation)
+    return invocations
+
+
+def tune(
+    client: LambdaClient,
+    function_name: str,
+    events: list[dict[str, Any]],
+    memory_sizes: list[int],
+    repeat: int,
+) -> list[dict[str, Any]]:
+    events = read_only_events(events)
+    configuration = client.get_function_configuration(FunctionName=function_name)
+    architecture = configuration.get("Architectures", ["x86_64"])[0]
+    points = []
+    try:
+        for memory_size in memory_sizes:
+            configure(client, function_name, memory_size)
+            invocations = replay(client, function_name, events, repeat)
+            points.append(summarize(architecture, memory_size, invocations))
+    finally:
+        configure(client, function_name, configuration["MemorySize"])
+    return points
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("function", choices=sorted(paramater["lambda"]))
+    parser.add_argument("--events", type=Path, required=True)
+    parser.add_argument(
+        "--memory",
+        type=lambda x: [int(v) for v in x.split(",")],
+        default=MEMORY_SIZES,
+        help="comma separated memory sizes (MB)",
+    )
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--limit", type=int, help="replay the first N events")
+    parser.add_argument(
+        "--weight",
+        type=float,
+        default=0.5,
+        help="0: fastest, 1: cheapest",
+    )
+    parser.add_argument("--baseline", type=Path, help="previous report to compare")
+    parser.add_argument("--output", type=Path, help="write JSON report to file")
+    args = parser.parse_args()
+
+    events = read_only_events(load_events(args.events)[: args.limit])
+    if not events:
+        parser.error("no read-only events to replay")
+    points = tune(
+        client=boto3.client("lambda"),
+        function_name=build_name("function", args.function),
+        events=events,
+        memory_sizes=args.memory,
+        repeat=args.repeat,
+    )
+    if args.baseline is not None:
+        points = json.loads(args.baseline.read_text())["points"] + points
+    best = recommend(points, args.weight)
+    current = paramater["lambda"][args.function]
+    report = json.dumps(
+        {
+            "function": args.function,
+            "current": {
+                "architecture": current["architecture"],
+                "memory_size": current["memory_size"],
+            },
+            "recommended": {
+                "architecture": best["architecture"],
+                "memory_size": best["memory_size"],
+            },
+            "points": points,
+        },
+        indent=2,
+    )
+    if args.output:
+        args.output.write_text(report)
+    print(report)  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
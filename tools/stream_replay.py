@@ -0,0 +1,135 @@
+"""DynamoDB Streams のレコードを stream_processor に再生するツール (開発用).
+
+DynamoDB Local のストリームを読み, Lambda のイベントソースマッピングと同じ形で
+バッチを渡す. 記録済みのイベントファイルを 1 回だけ再生することもできる.
+
+    python -m tools.stream_replay --endpoint-url http://localhost:8000
+    python -m tools.stream_replay --event tests/resource/dynamodb_stream_item_event.json
+"""
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Self
+
+import boto3
+from mypy_boto3_dynamodb import DynamoDBClient
+from mypy_boto3_dynamodbstreams import DynamoDBStreamsClient
+
+from tools import local_env
+
+
+def enable_streams(client: DynamoDBClient, table_names: list[str]) -> list[str]:
+    stream_arns = []
+    for table_name in table_names:
+        table = client.describe_table(TableName=table_name)["Table"]
+        if not table.get("StreamSpecification", {}).get("StreamEnabled", False):
+            table = client.update_table(
+                TableName=table_name,
+                StreamSpecification={
+                    "StreamEnabled": True,
+                    "StreamViewType": "NEW_AND_OLD_IMAGES",
+                },
+            )["TableDescription"]
+        stream_arns.append(table["LatestStreamArn"])
+    return stream_arns
+
+
+class StreamReplayer:
+    # シャードごとに読み取り位置を持ち, 失敗したレコードから読み直す
+    def __init__(
+        self: Self,
+        client: DynamoDBStreamsClient,
+        stream_arns: list[str],
+        batch_size: int,
+    ) -> None:
+        self.client = client
+        self.stream_arns = stream_arns
+        self.batch_size = batch_size
+        self.iterators: dict[tuple[str, str], str] = {}
+
+    def refresh_shards(self: Self) -> None:
+        for stream_arn in self.stream_arns:
+            description = self.client.describe_stream(StreamArn=stream_arn)
+            for shard in description["StreamDescription"]["Shards"]:
+                key = (stream_arn, shard["ShardId"])
+                if key not in self.iterators:
+                    self.iterators[key] = self.client.get_shard_iterator(
+                        StreamArn=stream_arn,
+                        ShardId=shard["ShardId"],
+                        ShardIteratorType="TRIM_HORIZON",
+                    )["ShardIterator"]
+
+    def poll(self: Self, module: ModuleType) -> int:
+        processed = 0
+        self.refresh_shards()
+        for (stream_arn, shard_id), iterator in list(self.iterators.items()):
+            response = self.client.get_records(
+                ShardIterator=iterator,
+                Limit=self.batch_size,
+            )
+            records: list[dict[str, Any]] = [
+                dict(x) | {"eventSourceARN": stream_arn} for x in response["Records"]
+            ]
+            next_iterator = response.get("NextShardIterator")
+            if records:
+                result = module.lambda_handler(
+                    {"Records": records},
+                    local_env.LambdaContext.of("stream_processor"),
+                )
+                failures = [x["itemIdentifier"] for x in result["batchItemFailures"]]
+                if failures:
+                    next_iterator = self.client.get_shard_iterator(
+                        StreamArn=stream_arn,
+                        ShardId=shard_id,
+                        ShardIteratorType="AT_SEQUENCE_NUMBER",
+                        SequenceNumber=min(failures, key=int),
+                    )["ShardIterator"]
+                processed += len(records)
+            if next_iterator is None:
+                del self.iterators[(stream_arn, shard_id)]
+            else:
+                self.iterators[(stream_arn, shard_id)] = next_iterator
+        return processed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--endpoint-url", help="DynamoDB Local endpoint")
+    parser.add_argument("--event", type=Path, help="replay a recorded event file")
+    parser.add_argument("--interval", type=float, default=1.0)
+    args = parser.parse_args()
+
+    modules = local_env.setup(args.endpoint_url)
+    module = modules["stream_processor"]
+    if args.event is not None:
+        with args.event.open() as f:
+            event = json.load(f)
+        result = module.lambda_handler(
+            event,
+            local_env.LambdaContext.of("stream_processor"),
+        )
+        print(json.dumps(result))  # noqa: T201
+        return
+
+    stream_arns = enable_streams(
+        boto3.client("dynamodb", endpoint_url=args.endpoint_url),
+        [os.environ["POOL_TABLE_NAME"], os.environ["ITEM_TABLE_NAME"]],
+    )
+    replayer = StreamReplayer(
+        boto3.client("dynamodbstreams", endpoint_url=args.endpoint_url),
+        stream_arns,
+        batch_size=100,
+    )
+    try:
+        while True:
+            replayer.poll(module)
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()